@@ -0,0 +1,124 @@
+"""
+Server-side agent loop for /ai/chat with agent=true: tool calls the backend can answer
+(ServerTools) are run concurrently on the AI lane and fed back to the model without a round
+trip to the browser. The loop ends when the model answers, asks for a tool only the browser
+has, or runs out of turns.
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List
+
+from ai_tools import ServerTools
+
+logger = logging.getLogger(__name__)
+
+
+async def _run_tool(tools: ServerTools, executor, function_call) -> Dict[str, Any]:
+    step = {"function_call": function_call}
+    try:
+        step["content"] = await asyncio.get_running_loop().run_in_executor(
+            tools.executor(function_call, executor), tools.run, function_call
+        )
+    except Exception as e:
+        logger.info(f"Server-side {function_call.get('name')} failed: {e}")
+        step["error"] = str(e)
+    return step
+
+
+def _tool_message(step: Dict[str, Any]) -> Dict[str, str]:
+    """Tool result as the browser reports it: the function name, then its output"""
+    name = step["function_call"]["name"]
+    result = step["content"] if "content" in step else f"Error: {step['error']}"
+    return {"role": "tool", "tool_name": name, "content": f"{name}:\n{result}"}
+
+
+async def run_agent(
+    llm,
+    messages: List[Dict],
+    functions,
+    tools: ServerTools,
+    executor,
+    max_turns: int,
+    stream: bool = False,
+    compact=None,
+    tool_executor=None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Events as of OllamaLLM.chat_stream (delta and thinking only with stream), plus a
+    tool_result event for every server-side call as it completes. The final done event has
+    the usual fields, function_call(s) being those left to the browser, and the steps taken
+    on the server: [{text, function_call, content | error}] in call order, text being the
+    model's message of the turn on its first call.
+
+    compact: applied to the prompt of every turn after the first, which grows by the tool
+    results of the turns before, see ContextCompactor.compact
+    tool_executor: where tools run, executor (which runs chat_complete) if not given, except
+    for Trino queries, which run on their cluster lane (ServerTools.executor)
+    """
+    messages = list(messages)
+    steps = []
+    for turn in range(max_turns):
+        prompt = compact(messages)[0] if compact is not None and turn > 0 else messages
+        if stream:
+            response = None
+            events = llm.chat_stream(prompt, functions)
+            try:
+                async for event in events:
+                    if event["type"] == "done":
+                        response = event
+                    elif event["type"] == "error":
+                        yield event
+                        return
+                    elif event["type"] != "tool_call":
+                        yield event
+            finally:
+                await events.aclose()
+            if response is None:
+                return
+        else:
+            response = await asyncio.get_running_loop().run_in_executor(
+                executor, llm.chat_complete, prompt, functions
+            )
+            if not response.get("success"):
+                yield {"type": "error", "error": response.get("error", "Unknown LLM error")}
+                return
+
+        calls = response.get("function_calls") or []
+        server_calls = [c for c in calls if tools.handles(c)]
+        client_calls = [c for c in calls if not tools.handles(c)]
+        if not server_calls or turn == max_turns - 1:
+            yield {**response, "type": "done", "steps": steps}
+            return
+
+        logger.info(
+            f"Agent turn {turn + 1}: running {[c['name'] for c in server_calls]} on the server"
+        )
+        results = await asyncio.gather(
+            *(_run_tool(tools, tool_executor or executor, call) for call in server_calls)
+        )
+        results[0]["text"] = response.get("text", "")
+        for step in results:
+            yield {"type": "tool_result", **step}
+        steps.extend(results)
+
+        if client_calls:
+            # The turn's text went out with its first step
+            yield {
+                **response,
+                "type": "done",
+                "text": "",
+                "function_call": client_calls[0],
+                "function_calls": client_calls,
+                "steps": steps,
+            }
+            return
+
+        messages.append(
+            {
+                "role": "assistant",
+                "content": response.get("text", ""),
+                "tool_calls": [{"function": call} for call in server_calls],
+            }
+        )
+        messages.extend(_tool_message(step) for step in results)
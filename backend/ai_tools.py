@@ -0,0 +1,259 @@
+"""
+The AI functions the backend can run itself: the knowledge tools behind /ai/search,
+/ai/semantic_search, /ai/ls and /ai/retrieve_doc, and read-only metadata queries (SHOW,
+DESCRIBE). The handlers serve them to the browser, the agent loop of /ai/chat calls them
+directly. Each returns the text the model gets to see.
+"""
+
+import re
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Optional
+
+import pyarrow as pa
+
+import docs_index
+from result_cache import normalize_sql
+
+# Leading keywords of the queries execute_sql_query runs on the server, the ones the browser
+# also only reports back as a table
+_METADATA_QUERY_RE = re.compile(r"^\s*(SHOW|DESCRIBE)\b", re.IGNORECASE)
+# SHOW STATS FOR (SELECT ...) runs the whole query, only SHOW STATS FOR <table> is metadata
+_STATS_OF_QUERY_RE = re.compile(r"^SHOW\s+STATS\s+FOR\s*\(", re.IGNORECASE)
+
+
+class ToolError(Exception):
+    """A tool call that cannot be answered, status is the HTTP status the handlers use"""
+
+    def __init__(self, message: str, status: int = 500, details: Optional[Dict] = None):
+        super().__init__(message)
+        self.status = status
+        self.details = details or {}
+
+
+def search(snapshot, pattern: str, max_results: int, candidates: int) -> str:
+    with snapshot.cursor() as conn:
+        rows = docs_index.search(conn, pattern, max_results, candidates, snapshot.indexed)
+
+    yaml_lines = ["results:"]
+    for path, title, summary, score in rows:
+        yaml_lines.append(f'  - title: "{title or path}"')
+        yaml_lines.append(f'    id: "{path}"')
+        yaml_lines.append(f'    summary: "{summary or ""}"')
+        if score is not None:
+            yaml_lines.append(f"    score: {score:.3f}")
+    yaml_lines.append(f'regex: "{pattern}"')
+    yaml_lines.append(f"total_results: {len(rows)}")
+    return "\n".join(yaml_lines) + "\n"
+
+
+def semantic_search(snapshot, query: str, k: int) -> str:
+    if snapshot.semantic_index is None:
+        raise ToolError("No embedding index, re-run seed_docs_db.py to build it", 503)
+
+    with snapshot.cursor() as conn:
+        rows = snapshot.semantic_index.search(conn, query, k)
+
+    # Chunk text goes in a literal block so newlines and quotes survive
+    yaml_lines = ["results:"]
+    for path, ordinal, start, length, text, score in rows:
+        yaml_lines.append(f'  - id: "{path}"')
+        yaml_lines.append(f"    chunk: {ordinal}")
+        yaml_lines.append(f"    start: {start}")
+        yaml_lines.append(f"    length: {length}")
+        yaml_lines.append(f"    score: {score:.3f}")
+        yaml_lines.append("    text: |-")
+        yaml_lines.extend(f"      {line}" for line in text.splitlines())
+    yaml_lines.append(f'query: "{query}"')
+    yaml_lines.append(f"total_results: {len(rows)}")
+    return "\n".join(yaml_lines) + "\n"
+
+
+def ls(snapshot, prefix: str, offset: int = 0, limit: int = 200) -> str:
+    """One page of the files under prefix, with the total and where the next page starts"""
+    offset = max(int(offset), 0)
+    with snapshot.cursor() as conn:
+        total = conn.execute(
+            "SELECT count(*) FROM document WHERE path LIKE ?", [prefix + "%"]
+        ).fetchone()[0]
+        rows = conn.execute(
+            "SELECT path, title, summary FROM document WHERE path LIKE ?"
+            " ORDER BY path LIMIT ? OFFSET ?",
+            [prefix + "%", limit, offset],
+        ).fetchall()
+
+    yaml_lines = ["files:"]
+    for path, title, summary in rows:
+        yaml_lines.append(f'  - title: "{title or path}"')
+        yaml_lines.append(f'    id: "{path}"')
+        yaml_lines.append(f'    summary: "{summary or ""}"')
+    yaml_lines.append(f'prefix: "{prefix}"')
+    yaml_lines.append(f"offset: {offset}")
+    yaml_lines.append(f"total_files: {total}")
+    if offset + len(rows) < total:
+        yaml_lines.append(f"next_offset: {offset + len(rows)}")
+    return "\n".join(yaml_lines) + "\n"
+
+
+def table_of_contents(doc) -> str:
+    lines = [
+        f"Document: {doc.path}",
+        f"Length: {len(doc.content)} characters (~{doc.tokens} tokens)",
+        "Sections:",
+    ]
+    for s in doc.sections:
+        indent = "  " * max(s.level - 1, 0)
+        lines.append(
+            f"{indent}{s.number}. {s.title}"
+            f" (offset {s.start}, length {s.end - s.start}, ~{s.tokens} tokens)"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def excerpt(doc, label: str, start: int, end: int, max_chars: int) -> str:
+    """Text of doc between start and end, cut at max_chars"""
+    start = min(max(start, 0), len(doc.content))
+    end = min(max(end, start), len(doc.content), start + max_chars)
+    whole = start == 0 and end == len(doc.content)
+    header = (
+        f"Document: {doc.path}"
+        if whole
+        else f"Document: {doc.path}{label} (characters {start}-{end} of {len(doc.content)})"
+    )
+    text = f"{header}\n\n{doc.content[start:end]}"
+    if end < len(doc.content) and (not label or end == start + max_chars):
+        text += (
+            f"\n\n[{len(doc.content) - end} more characters, continue with"
+            f" offset={end} or ask for toc=true to pick a section]"
+        )
+    return text
+
+
+def retrieve_doc(
+    doc_cache,
+    snapshot,
+    doc_id: str,
+    max_chars: int,
+    toc: bool = False,
+    section=None,
+    offset: Optional[int] = None,
+    length: Optional[int] = None,
+) -> str:
+    doc = doc_cache.get(snapshot, doc_id)
+    if doc is None:
+        raise ToolError(f"Document not found: {doc_id}", 404)
+
+    if toc:
+        return table_of_contents(doc)
+    if section is not None and section != "":
+        found = doc.find_section(section)
+        if found is None:
+            raise ToolError(
+                f"Section not found in {doc_id}: {section}",
+                404,
+                {"toc": table_of_contents(doc)},
+            )
+        return excerpt(
+            doc, f", section {found.number} {found.title!r}", found.start, found.end, max_chars
+        )
+    if offset is not None or length is not None:
+        start = int(offset or 0)
+        end = start + int(length) if length is not None else len(doc.content)
+        return excerpt(doc, "", start, end, max_chars)
+    return excerpt(doc, "", 0, len(doc.content), max_chars)
+
+
+def is_metadata_query(query: str) -> bool:
+    return (
+        bool(query)
+        and _METADATA_QUERY_RE.match(query) is not None
+        and _STATS_OF_QUERY_RE.match(normalize_sql(query)) is None
+    )
+
+
+def format_table(arrow_bytes: bytes) -> str:
+    """A query result as pipe-separated rows, as the browser reports SHOW/DESCRIBE results"""
+    table = pa.ipc.open_stream(arrow_bytes).read_all()
+    lines = ["|".join(table.column_names)]
+    for row in zip(*(column.to_pylist() for column in table.columns)):
+        lines.append("|".join("" if v is None else str(v) for v in row))
+    return "Query successful:\n\n" + "\n".join(lines)
+
+
+class ServerTools:
+    """
+    The tool calls /ai/chat answers without a round trip to the browser. All of them are
+    read-only, so calls of one turn can run concurrently and be repeated safely. Malloy,
+    memory and regular queries stay with the browser, which renders their results.
+    """
+
+    DOCS_TOOLS = ("search", "semantic_search", "ls", "retrieve_doc")
+
+    def __init__(
+        self,
+        docs_store,
+        doc_cache,
+        limits: Dict[str, int],
+        run_query: Optional[Callable[[str], bytes]] = None,
+        query_executor: Optional[Callable[[str], Executor]] = None,
+    ):
+        """
+        limits: search_candidates, semantic_search_max_k, ls_max_results and
+            retrieve_doc_max_chars.
+        run_query: runs a metadata query on the user's cluster and returns Arrow IPC bytes,
+            without it execute_sql_query is left to the browser.
+        query_executor: the executor (a cluster lane) run_query is called on for a query,
+            rather than where the other tools run.
+        """
+        self.docs_store = docs_store
+        self.doc_cache = doc_cache
+        self.limits = limits
+        self.run_query = run_query
+        self.query_executor = query_executor
+
+    def handles(self, function_call: Dict[str, Any]) -> bool:
+        name = function_call.get("name")
+        if name in self.DOCS_TOOLS:
+            return True
+        if name == "execute_sql_query" and self.run_query is not None:
+            return is_metadata_query((function_call.get("arguments") or {}).get("query"))
+        return False
+
+    def executor(self, function_call: Dict[str, Any], default: Executor) -> Executor:
+        """Where a call handles() accepted runs, default unless it is a Trino query"""
+        if function_call.get("name") == "execute_sql_query" and self.query_executor is not None:
+            return self.query_executor((function_call.get("arguments") or {}).get("query"))
+        return default
+
+    def run(self, function_call: Dict[str, Any]) -> str:
+        """Result of a call handles() accepted (blocking)"""
+        name = function_call.get("name")
+        args = function_call.get("arguments") or {}
+        snapshot = self.docs_store.current
+        if name == "search":
+            return search(
+                snapshot,
+                args.get("regex", ""),
+                int(args.get("max_results", 10)),
+                self.limits["search_candidates"],
+            )
+        if name == "semantic_search":
+            k = min(max(int(args.get("k", 5)), 1), self.limits["semantic_search_max_k"])
+            return semantic_search(snapshot, args.get("query", ""), k)
+        if name == "ls":
+            max_results = self.limits["ls_max_results"]
+            limit = min(max(int(args.get("limit") or max_results), 1), max_results)
+            return ls(snapshot, args.get("prefix", "") or "", args.get("offset") or 0, limit)
+        if name == "retrieve_doc":
+            return retrieve_doc(
+                self.doc_cache,
+                snapshot,
+                args.get("doc_id", "unknown"),
+                self.limits["retrieve_doc_max_chars"],
+                bool(args.get("toc", False)),
+                args.get("section"),
+                args.get("offset"),
+                args.get("length"),
+            )
+        if name == "execute_sql_query":
+            return format_table(self.run_query(args.get("query").strip().rstrip(";")))
+        raise ToolError(f"Not a server-side tool: {name}", 400)
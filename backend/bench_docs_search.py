@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark /ai/search: regex over every document vs BM25 candidates from the full-text index.
+
+Usage:
+    python bench_docs_search.py [--docs 50000] [--words 300] [--repeat 5]
+
+A synthetic corpus with a Zipf-distributed vocabulary is written to a temporary docs.db, so
+no docs folder is needed.
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from docs_index import build_search_index, regex_terms, scan_search, search
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "xe", "zo", "an", "el"]
+
+QUERIES = [
+    "revenue",
+    "trino_catalog",
+    "revenue|warehouse",
+    "order.*date",
+    "kalomi",
+    "colou?r",
+]
+
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        n = rng.integers(2, 5)
+        words.add("".join(rng.choice(SYLLABLES, n)))
+    # Some recognisable words at the head, middle and tail of the distribution
+    return ["order", "date", "revenue"] + sorted(words) + ["warehouse", "trino_catalog"]
+
+
+def make_corpus(num_docs, words_per_doc, rng):
+    vocabulary = np.array(make_vocabulary(20000, rng))
+    ranks = np.minimum(rng.zipf(1.2, num_docs * words_per_doc), len(vocabulary)) - 1
+    tokens = vocabulary[ranks].reshape(num_docs, words_per_doc)
+    return pd.DataFrame(
+        {
+            "path": [f"doc{i:06d}.md" for i in range(num_docs)],
+            "title": [" ".join(row[:5]) for row in tokens],
+            "summary": [" ".join(row[5:15]) for row in tokens],
+            "content": [" ".join(row) for row in tokens],
+        }
+    )
+
+
+def timed(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark docs search")
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--max-results", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    start = time.perf_counter()
+    corpus = make_corpus(args.docs, args.words, rng)
+    print(f"Generated {args.docs} documents in {time.perf_counter() - start:.1f}s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = duckdb.connect(os.path.join(tmp, "docs.db"))
+        conn.execute(
+            "CREATE TABLE document (path VARCHAR PRIMARY KEY, title VARCHAR,"
+            " summary VARCHAR, content VARCHAR)"
+        )
+        conn.execute("INSERT INTO document SELECT * FROM corpus")
+
+        start = time.perf_counter()
+        build_search_index(conn)
+        postings = conn.execute("SELECT count(*) FROM doc_posting").fetchone()[0]
+        print(
+            f"Built index in {time.perf_counter() - start:.1f}s ({postings} postings)\n"
+        )
+
+        for query in QUERIES:
+            scan_time, scan_rows = timed(
+                lambda: scan_search(conn, query, args.max_results), args.repeat
+            )
+            index_time, index_rows = timed(
+                lambda: search(conn, query, args.max_results, indexed=True), args.repeat
+            )
+            mode = "bm25" if regex_terms(query) else "scan"
+            print(
+                f"{query!r:>22}: scan {scan_time * 1000:8.1f} ms ({len(scan_rows):>2}) | "
+                f"{mode} {index_time * 1000:8.1f} ms ({len(index_rows):>2}) | "
+                f"speedup {scan_time / index_time:6.1f}x"
+            )
+        conn.close()
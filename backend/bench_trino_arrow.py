@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark Trino row to Arrow IPC conversion: the pandas path vs the native converter.
+
+Usage:
+    python bench_trino_arrow.py [--wide-rows 20000] [--wide-cols 200] [--long-rows 1000000]
+
+Rows are synthesised in the shape the Trino client returns them (Decimal, tz-aware datetime,
+lists, ...) and fed through a fake cursor, so no Trino server is needed.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import decimal
+import random
+import time
+from collections import namedtuple
+
+import pandas as pd
+import pyarrow as pa
+
+from trino_arrow import ArrowBatchStream, sanitize_df
+
+ColumnDescription = namedtuple(
+    "ColumnDescription",
+    "name type_code display_size internal_size precision scale null_ok",
+)
+
+UTC = datetime.timezone.utc
+SCALE_4 = decimal.Decimal("0.0001")
+
+COLUMN_TYPES = [
+    ("bigint", lambda i: i),
+    ("double", lambda i: i * 0.5),
+    ("varchar", lambda i: f"value-{i % 1000}"),
+    ("decimal(18,4)", lambda i: (decimal.Decimal(i) / 7).quantize(SCALE_4)),
+    ("timestamp(3) with time zone", lambda i: datetime.datetime.fromtimestamp(i, UTC)),
+    ("date", lambda i: datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 365)),
+    ("boolean", lambda i: i % 2 == 0),
+    ("array(varchar)", lambda i: ["a", "b", str(i % 10)]),
+]
+
+
+class FakeCursor:
+    """Minimal DB-API cursor over pre-built rows"""
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+        self.pos = 0
+
+    def fetchmany(self, size):
+        rows = self.rows[self.pos : self.pos + size]
+        self.pos += size
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+
+def make_result(num_rows, num_cols):
+    description = []
+    generators = []
+    for c in range(num_cols):
+        type_code, gen = COLUMN_TYPES[c % len(COLUMN_TYPES)]
+        description.append(
+            ColumnDescription(f"col{c}", type_code, None, None, None, None, True)
+        )
+        generators.append(gen)
+
+    rows = []
+    for i in range(num_rows):
+        rows.append(
+            [None if random.random() < 0.05 else gen(i) for gen in generators]
+        )
+    return description, rows
+
+
+def pandas_path(description, rows):
+    """The original /trino path: pd.read_sql -> sanitize_df -> Table.from_pandas -> IPC"""
+    cur = FakeCursor(description, rows)
+    df = pd.DataFrame.from_records(
+        cur.fetchall(), columns=[cd.name for cd in description]
+    )
+    table = pa.Table.from_pandas(sanitize_df(df))
+    sink = pa.BufferOutputStream()
+    writer = pa.ipc.new_stream(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+def native_path(description, rows, batch_rows):
+    return ArrowBatchStream(FakeCursor(description, rows), batch_rows, "native").read_all()
+
+
+def timed(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(label, num_rows, num_cols, batch_rows, repeat):
+    description, rows = make_result(num_rows, num_cols)
+
+    # sanitize_df prints every frame, keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        pandas_time, pandas_bytes = timed(lambda: pandas_path(description, rows), repeat)
+        native_time, native_bytes = timed(
+            lambda: native_path(description, rows, batch_rows), repeat
+        )
+
+    print(
+        f"{label:>5}: {num_rows:>9} rows x {num_cols:>3} cols | "
+        f"pandas {pandas_time:7.3f}s ({len(pandas_bytes) / 1e6:7.1f} MB) | "
+        f"native {native_time:7.3f}s ({len(native_bytes) / 1e6:7.1f} MB) | "
+        f"speedup {pandas_time / native_time:5.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Trino to Arrow conversion")
+    parser.add_argument("--wide-rows", type=int, default=20000)
+    parser.add_argument("--wide-cols", type=int, default=200)
+    parser.add_argument("--long-rows", type=int, default=1000000)
+    parser.add_argument("--long-cols", type=int, default=8)
+    parser.add_argument("--batch-rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(42)
+    run("wide", args.wide_rows, args.wide_cols, args.batch_rows, args.repeat)
+    run("long", args.long_rows, args.long_cols, args.batch_rows, args.repeat)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark Trino row to JSON conversion: the original row dicts vs the vectorised converter.
+
+Usage:
+    python bench_trino_json.py [--rows 200000] [--cols 8] [--wide-rows 20000] [--wide-cols 100]
+
+Uses the synthetic results of bench_trino_arrow.py, so no Trino server is needed. The original
+path could not encode Decimal or date values, it is given json.dumps(default=str) here.
+"""
+
+import argparse
+import datetime
+import json
+import random
+
+from bench_trino_arrow import FakeCursor, make_result, timed
+from trino_json import JsonBatchStream
+
+
+def rows_path(description, rows):
+    """The original format=json path: fetchall -> dict per row with per-cell checks -> dumps"""
+    cur = FakeCursor(description, rows)
+    columns = [cd.name for cd in description]
+    converted = []
+    for t in cur.fetchall():
+        row = {}
+        for i in range(len(columns)):
+            if isinstance(t[i], datetime.datetime):
+                row[columns[i]] = t[i].isoformat()
+            else:
+                row[columns[i]] = t[i]
+        converted.append(row)
+    data = {
+        "columns": columns,
+        "types": [cd.type_code for cd in description],
+        "query": "",
+        "rows": converted,
+        "error": None,
+        "connectionTested": True,
+    }
+    return json.dumps(data, default=str).encode("utf-8")
+
+
+def stream_path(description, rows, batch_rows, format):
+    cur = FakeCursor(description, rows)
+    return JsonBatchStream(cur, batch_rows, format, "").read_all()
+
+
+def run(label, num_rows, num_cols, batch_rows, repeat):
+    description, rows = make_result(num_rows, num_cols)
+
+    legacy_time, legacy_bytes = timed(lambda: rows_path(description, rows), repeat)
+    json_time, json_bytes = timed(
+        lambda: stream_path(description, rows, batch_rows, "json"), repeat
+    )
+    columnar_time, columnar_bytes = timed(
+        lambda: stream_path(description, rows, batch_rows, "json-columnar"), repeat
+    )
+
+    print(
+        f"{label:>5}: {num_rows:>9} rows x {num_cols:>3} cols | "
+        f"row dicts {legacy_time:7.3f}s ({len(legacy_bytes) / 1e6:7.1f} MB) | "
+        f"json {json_time:7.3f}s ({len(json_bytes) / 1e6:7.1f} MB) | "
+        f"json-columnar {columnar_time:7.3f}s ({len(columnar_bytes) / 1e6:7.1f} MB) | "
+        f"speedup {legacy_time / json_time:5.2f}x / {legacy_time / columnar_time:5.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Trino to JSON conversion")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--cols", type=int, default=8)
+    parser.add_argument("--wide-rows", type=int, default=20000)
+    parser.add_argument("--wide-cols", type=int, default=100)
+    parser.add_argument("--batch-rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(42)
+    run("long", args.rows, args.cols, args.batch_rows, args.repeat)
+    run("wide", args.wide_rows, args.wide_cols, args.batch_rows, args.repeat)
@@ -0,0 +1,312 @@
+"""
+Trino cluster definitions: coordinator routing, per-cluster connection pools and executor lanes
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import requests
+from trino.exceptions import HttpError, TrinoConnectionError
+
+from scheduler import FairShareExecutor
+from trino_pool import TrinoConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Seconds a coordinator that failed to connect is skipped by routing
+COORDINATOR_COOLDOWN = 30.0
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """True for failures reaching a coordinator, as opposed to errors in the query itself"""
+    return isinstance(
+        error,
+        (
+            TrinoConnectionError,
+            HttpError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ),
+    )
+
+
+class Coordinator:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.in_flight = 0
+        self.down_until = 0.0
+        self.failures = 0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def __repr__(self):
+        return f"{self.host}:{self.port}"
+
+
+class ClusterLease:
+    """A checked out connection on a particular coordinator, release() exactly once"""
+
+    def __init__(self, cluster: "TrinoCluster", coordinator: Coordinator, key, conn):
+        self.cluster = cluster
+        self.coordinator = coordinator
+        self.key = key
+        self.conn = conn
+
+    def release(self, error: Optional[BaseException] = None):
+        self.cluster._release(self, error)
+
+
+class TrinoCluster:
+    """
+    One Trino cluster, as defined in the "clusters" section of config.json:
+
+        "uat": {
+            "coordinators": [{"host": "trino-uat-1", "port": 443}, {"host": "trino-uat-2", "port": 443}],
+            "http_scheme": "https",
+            "verify": true,
+            "catalog": "hive",
+            "schema": "default",
+            "routing": "failover" | "least_loaded",
+            "interactive_workers": 4,
+            "bulk_workers": 4,
+            "queue_limit": 100,
+            "max_connections_per_key": 8
+        }
+
+    Each cluster has its own connection pool and executor lanes, so a slow or overloaded
+    cluster only queues its own queries.
+    """
+
+    def __init__(self, cluster_id: str, definition: Dict[str, Any], defaults: Dict[str, Any]):
+        settings = {**defaults, **definition}
+        self.id = cluster_id
+        self.coordinators = [
+            Coordinator(c.get("host", "localhost"), int(c.get("port", 8080)))
+            for c in settings.get("coordinators") or [{}]
+        ]
+        self.routing = settings.get("routing", "failover")
+        self.catalog = settings.get("catalog", "default")
+        self.schema = settings.get("schema", "default")
+
+        self.connect_kwargs = {}
+        if "http_scheme" in settings:
+            self.connect_kwargs["http_scheme"] = settings["http_scheme"]
+        if "verify" in settings:
+            self.connect_kwargs["verify"] = settings["verify"]
+
+        self.pool = TrinoConnectionPool(
+            max_per_key=settings["max_connections_per_key"],
+            idle_timeout=settings["pool_idle_timeout"],
+            wait_timeout=settings["pool_wait_timeout"],
+        )
+        self.lanes = {
+            "interactive": FairShareExecutor(
+                f"{cluster_id}-interactive",
+                settings["interactive_workers"],
+                settings["queue_limit"],
+            ),
+            "bulk": FairShareExecutor(
+                f"{cluster_id}-bulk", settings["bulk_workers"], settings["queue_limit"]
+            ),
+        }
+        self._lock = threading.Lock()
+        self.failovers = 0
+
+    def _candidates(self) -> List[Coordinator]:
+        """Coordinators in the order they should be tried"""
+        with self._lock:
+            available = [c for c in self.coordinators if c.available]
+            # If everything is marked down, try anyway rather than failing outright
+            candidates = available or sorted(self.coordinators, key=lambda c: c.down_until)
+            if self.routing == "least_loaded":
+                candidates = sorted(candidates, key=lambda c: c.in_flight)
+            return candidates
+
+    def execute(self, user, password, catalog, schema, extra_credential, query, running):
+        """
+        Run query on the first coordinator that accepts it, returns (lease, cursor). The caller
+        reads the cursor and then releases the lease. Connection failures mark the coordinator
+        down for a while and move on to the next one.
+        """
+        last_error = None
+        for coordinator in self._candidates():
+            key, conn = self.pool.acquire(
+                coordinator.host,
+                coordinator.port,
+                user,
+                password,
+                catalog or self.catalog,
+                schema or self.schema,
+                extra_credential,
+                **self.connect_kwargs,
+            )
+            lease = ClusterLease(self, coordinator, key, conn)
+            with self._lock:
+                coordinator.in_flight += 1
+            try:
+                cur = conn.cursor()
+                running.attach(cur)
+                cur.execute(query)
+                running.check()
+                return lease, cur
+            except Exception as e:
+                lease.release(e)
+                if not is_connection_error(e):
+                    raise
+                self._mark_down(coordinator, e)
+                last_error = e
+        raise last_error
+
+    def _release(self, lease: ClusterLease, error: Optional[BaseException]):
+        with self._lock:
+            lease.coordinator.in_flight -= 1
+        self.pool.release(lease.key, lease.conn, error)
+
+    def _mark_down(self, coordinator: Coordinator, error: BaseException):
+        with self._lock:
+            coordinator.down_until = time.monotonic() + COORDINATOR_COOLDOWN
+            coordinator.failures += 1
+            self.failovers += 1
+        logger.warning(
+            f"Trino coordinator {coordinator} of cluster {self.id} is unreachable ({error}), "
+            f"skipping it for {COORDINATOR_COOLDOWN:.0f}s"
+        )
+
+    @property
+    def busy(self) -> bool:
+        """Whether anything still runs, waits for or holds a connection on this cluster"""
+        with self._lock:
+            if any(c.in_flight for c in self.coordinators):
+                return True
+        pool = self.pool.metrics()
+        return pool["open"] > pool["idle"] or any(
+            lane.metrics()["active"] or lane.metrics()["queued"] for lane in self.lanes.values()
+        )
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.shutdown(wait=False, cancel_futures=True)
+        self.pool.close_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            coordinators = [
+                {
+                    "coordinator": repr(c),
+                    "in_flight": c.in_flight,
+                    "available": c.available,
+                    "failures": c.failures,
+                }
+                for c in self.coordinators
+            ]
+        return {
+            "routing": self.routing,
+            "failovers": self.failovers,
+            "coordinators": coordinators,
+            "pool": self.pool.metrics(),
+            "lanes": {name: lane.metrics() for name, lane in self.lanes.items()},
+        }
+
+
+class ClusterRegistry:
+    """
+    Resolves UI environments to clusters. Environments whose cluster has no definition, and
+    requests that name an explicit host, get an ad-hoc single coordinator cluster. Clusters
+    for explicit hosts are kept for the max_adhoc most recently used hosts. The least recently
+    used one is retired when another host comes along, and shut down once nothing runs on it
+    any more.
+    """
+
+    def __init__(self, config: Dict[str, Any], defaults: Dict[str, Any], max_adhoc: int = 16):
+        self.defaults = defaults
+        self.environments = {
+            env["id"]: env.get("cluster", env["id"]) for env in config.get("environments", [])
+        }
+        self.definitions = config.get("clusters", {})
+        self.max_adhoc = max_adhoc
+        self._clusters: Dict[str, TrinoCluster] = {}
+        self._adhoc: "OrderedDict[str, TrinoCluster]" = OrderedDict()
+        # Ad-hoc clusters pushed out of _adhoc, waiting for their queries to finish
+        self._retired: Dict[str, TrinoCluster] = {}
+        self._lock = threading.Lock()
+        self._warned = set()
+
+    def resolve(
+        self,
+        environment: Optional[str],
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+    ) -> TrinoCluster:
+        if host is not None:
+            return self._get_adhoc(host, int(port or 8080))
+
+        cluster_id = self.environments.get(environment, environment)
+        if cluster_id in self.definitions:
+            return self._get(cluster_id, self.definitions[cluster_id])
+
+        if environment is not None and environment not in self._warned:
+            self._warned.add(environment)
+            logger.warning(
+                f"No cluster defined for environment {environment}, using localhost:8080"
+            )
+        return self._get("localhost:8080", {"coordinators": [{"host": "localhost", "port": 8080}]})
+
+    def _get(self, cluster_id: str, definition: Dict[str, Any]) -> TrinoCluster:
+        with self._lock:
+            cluster = self._clusters.get(cluster_id)
+            if cluster is None:
+                cluster = TrinoCluster(cluster_id, definition, self.defaults)
+                self._clusters[cluster_id] = cluster
+            return cluster
+
+    def _get_adhoc(self, host: str, port: int) -> TrinoCluster:
+        cluster_id = f"{host}:{port}"
+        with self._lock:
+            cluster = self._adhoc.get(cluster_id)
+            if cluster is not None:
+                self._adhoc.move_to_end(cluster_id)
+                return cluster
+            # Back before a retired cluster was shut down, it is still in working order
+            cluster = self._retired.pop(cluster_id, None) or TrinoCluster(
+                cluster_id, {"coordinators": [{"host": host, "port": port}]}, self.defaults
+            )
+            self._adhoc[cluster_id] = cluster
+            while len(self._adhoc) > self.max_adhoc:
+                old_id, old = self._adhoc.popitem(last=False)
+                self._retired[old_id] = old
+        self._shutdown_retired()
+        return cluster
+
+    def _shutdown_retired(self):
+        """Shut down the retired clusters nothing runs on any more"""
+        with self._lock:
+            idle = [
+                self._retired.pop(cluster_id)
+                for cluster_id, cluster in list(self._retired.items())
+                if not cluster.busy
+            ]
+        for cluster in idle:
+            logger.info(f"Shutting down ad-hoc Trino cluster {cluster.id}, least recently used")
+            cluster.shutdown()
+
+    def _all(self) -> Dict[str, TrinoCluster]:
+        with self._lock:
+            return {**self._retired, **self._adhoc, **self._clusters}
+
+    def evict_idle(self):
+        self._shutdown_retired()
+        for cluster in self._all().values():
+            cluster.pool.evict_idle()
+
+    def shutdown(self):
+        for cluster in self._all().values():
+            cluster.shutdown()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {cluster_id: cluster.metrics() for cluster_id, cluster in self._all().items()}
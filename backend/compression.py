@@ -0,0 +1,64 @@
+"""
+Response compression: Arrow IPC buffer codecs and HTTP gzip for text responses
+"""
+
+import time
+from typing import Dict, Optional
+
+import tornado.web
+
+# Request values accepted for Arrow IPC body compression, mapped to pyarrow codec names
+IPC_CODECS = {
+    "lz4": "lz4",
+    "lz4_frame": "lz4",
+    "zstd": "zstd",
+}
+
+
+def parse_ipc_compression(name: Optional[str]) -> Optional[str]:
+    """The pyarrow codec for a request's "compression" value, None for no compression"""
+    if name is None or name == "" or str(name).lower() == "none":
+        return None
+    codec = IPC_CODECS.get(str(name).lower())
+    if codec is None:
+        raise ValueError(
+            f"Unsupported compression: {name}. Supported compression: none, {', '.join(IPC_CODECS)}"
+        )
+    return codec
+
+
+def compression_headers(
+    codec: str, raw_bytes: int, encoded_bytes: int, seconds: float
+) -> Dict[str, str]:
+    """X-Compression* response headers, the ratio is uncompressed over compressed size"""
+    return {
+        "X-Compression": codec,
+        "X-Compression-Ratio": f"{raw_bytes / encoded_bytes:.2f}" if encoded_bytes else "1.00",
+        "X-Compression-Time-Ms": f"{seconds * 1000:.1f}",
+    }
+
+
+class GZipWithStats(tornado.web.GZipContentEncoding):
+    """
+    Tornado's gzip transform (compress_response=True), adding X-Compression* headers to
+    responses that are written in one go. Streamed responses are compressed too, but their
+    headers go out before the ratio is known. Server-sent events are never compressed.
+    """
+
+    def _compressible_type(self, ctype: str) -> bool:
+        # Server-sent events have to reach the client as written, not in gzip blocks
+        return ctype != "text/event-stream" and super()._compressible_type(ctype)
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        raw_bytes = len(chunk)
+        started = time.perf_counter()
+        status_code, headers, chunk = super().transform_first_chunk(
+            status_code, headers, chunk, finishing
+        )
+        if self._gzipping and finishing:
+            headers.update(
+                compression_headers(
+                    "gzip", raw_bytes, len(chunk), time.perf_counter() - started
+                )
+            )
+        return status_code, headers, chunk
@@ -0,0 +1,330 @@
+"""
+Chunked embedding index over the docs `document` table for semantic search.
+
+Documents are split into chunks of a few paragraphs, stored in the `doc_chunk` table of
+docs.db. Their embeddings are an L2-normalised float32 matrix saved next to the database as
+<docs.db>.vectors.<id>.npy, row i belonging to chunk_id i. Every build writes a new file, named
+in doc_embedding_meta, so a docs.db snapshot always finds its own vectors. The server
+memory-maps the matrix and scores a query against every chunk with one matrix-vector product.
+
+Embedders are pluggable, see create_embedder(). The "hashing" embedder needs no model and is
+deterministic, "ollama:<model>" uses a local Ollama embedding model.
+"""
+
+import functools
+import hashlib
+import logging
+import os
+import re
+import uuid
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Chunks are cut at paragraph boundaries where possible and hold at most this many characters
+CHUNK_CHARS = 1200
+# Chunks embedded per embedder call
+EMBED_BATCH = 64
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]{2,}")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n|\n(?=#)")
+
+
+class HashingEmbedder:
+    """
+    Feature hashing of words and word pairs into `dim` signed buckets. Deterministic across
+    processes and machines, so suitable for tests and for installs without an embedding model.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing:{dim}"
+
+    @staticmethod
+    @functools.lru_cache(maxsize=200000)
+    def _bucket(feature: str) -> int:
+        return int.from_bytes(
+            hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = self._bucket(feature)
+                vectors[row, h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        # Dampen repeated features like a log term frequency would
+        return normalize(np.sign(vectors) * np.log1p(np.abs(vectors)))
+
+
+class OllamaEmbedder:
+    """Embeddings from a model served by the local Ollama instance (e.g. nomic-embed-text)"""
+
+    def __init__(self, model: str, base_url: Optional[str] = None):
+        import ollama
+
+        self.model = model
+        self.name = f"ollama:{model}"
+        self.client = ollama.Client(
+            host=base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        )
+        self.dim = None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self.client.embed(model=self.model, input=texts)
+        vectors = np.asarray(response["embeddings"], dtype=np.float32)
+        self.dim = vectors.shape[1]
+        return normalize(vectors)
+
+
+def create_embedder(spec: str):
+    """Embedder from a "hashing[:dim]" or "ollama:<model>" spec, as stored with the index"""
+    kind, _, arg = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(int(arg) if arg else 512)
+    if kind == "ollama" and arg:
+        return OllamaEmbedder(arg)
+    raise ValueError(
+        f"Unsupported embedder: {spec}. Supported embedders: hashing[:dim], ollama:<model>"
+    )
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def chunk_document(content: str, chunk_chars: int = CHUNK_CHARS) -> List[Tuple[int, int]]:
+    """(start, end) offsets of the chunks of content, paragraphs are kept whole if they fit"""
+    paragraphs = []
+    start = 0
+    for match in _PARAGRAPH_RE.finditer(content):
+        paragraphs.append((start, match.start()))
+        start = match.end()
+    paragraphs.append((start, len(content)))
+
+    chunks = []
+    chunk_start, chunk_end = None, None
+    for p_start, p_end in paragraphs:
+        if not content[p_start:p_end].strip():
+            continue
+        # Paragraphs longer than a chunk are cut at the last whitespace that fits
+        while p_end - p_start > chunk_chars:
+            cut = content.rfind(" ", p_start, p_start + chunk_chars)
+            cut = cut if cut > p_start else p_start + chunk_chars
+            if chunk_start is not None:
+                chunks.append((chunk_start, chunk_end))
+                chunk_start = None
+            chunks.append((p_start, cut))
+            p_start = cut
+        if chunk_start is not None and p_end - chunk_start > chunk_chars:
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = None
+        if chunk_start is None:
+            chunk_start = p_start
+        chunk_end = p_end
+    if chunk_start is not None:
+        chunks.append((chunk_start, chunk_end))
+    return chunks
+
+
+def new_vectors_file(db_path: str) -> str:
+    """Name of a fresh vectors file for db_path, relative to the directory of db_path"""
+    return f"{os.path.basename(db_path)}.vectors.{uuid.uuid4().hex[:12]}.npy"
+
+
+def remove_stale_vectors(db_path: str, keep: Optional[str]):
+    """Delete vectors files of db_path other than keep, left over from earlier snapshots"""
+    directory = os.path.dirname(os.path.abspath(db_path))
+    prefix = f"{os.path.basename(db_path)}.vectors."
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(".npy") and name != keep:
+            try:
+                # Servers still using the old snapshot keep their mapping of the file
+                os.remove(os.path.join(directory, name))
+            except OSError as e:
+                logger.warning(f"Could not remove {name}: {e}")
+
+
+def _chunk_rows(rows, chunk_chars: int):
+    """(path, ordinal, start, length, text) of the chunks of (path, content) rows"""
+    for path, content in rows:
+        for ordinal, (start, end) in enumerate(chunk_document(content, chunk_chars)):
+            yield path, ordinal, start, end - start, content[start:end]
+
+
+def _embed(embedder, texts: List[str]) -> np.ndarray:
+    vectors = [
+        embedder.embed(texts[i : i + EMBED_BATCH])
+        for i in range(0, len(texts), EMBED_BATCH)
+    ]
+    if not vectors:
+        return np.zeros((0, embedder.dim or 1), dtype=np.float32)
+    return np.vstack(vectors).astype(np.float32)
+
+
+def _write_index(conn, db_path: str, embedder_name: str, chunk_rows, matrix: np.ndarray):
+    """Store chunk_rows as doc_chunk, chunk_id being the row of the chunk in matrix"""
+    vectors_file = new_vectors_file(db_path)
+    np.save(os.path.join(os.path.dirname(os.path.abspath(db_path)), vectors_file), matrix)
+
+    conn.execute("""
+        CREATE OR REPLACE TABLE doc_chunk (
+            chunk_id INTEGER PRIMARY KEY,
+            path     VARCHAR,
+            ordinal  INTEGER,
+            start    INTEGER,
+            length   INTEGER,
+            text     VARCHAR
+        )
+    """)
+    if chunk_rows:
+        columns = list(zip(*chunk_rows))
+        chunks = pa.table(
+            {
+                "chunk_id": pa.array(range(len(chunk_rows)), pa.int32()),
+                "path": pa.array(columns[0], pa.string()),
+                "ordinal": pa.array(columns[1], pa.int32()),
+                "start": pa.array(columns[2], pa.int32()),
+                "length": pa.array(columns[3], pa.int32()),
+                "text": pa.array(columns[4], pa.string()),
+            }
+        )
+        conn.execute("INSERT INTO doc_chunk SELECT * FROM chunks")
+    conn.execute(
+        "CREATE OR REPLACE TABLE doc_embedding_meta AS"
+        " SELECT ? AS embedder, ?::INTEGER AS dim, ?::INTEGER AS chunks, ? AS vectors",
+        [embedder_name, matrix.shape[1], len(chunk_rows), vectors_file],
+    )
+
+
+def build_embedding_index(conn, db_path: str, embedder, chunk_chars: int = CHUNK_CHARS):
+    """(Re)build doc_chunk and the vectors file for every document, returns the chunk count"""
+    chunk_rows = list(
+        _chunk_rows(
+            conn.execute(
+                "SELECT path, COALESCE(content, '') FROM document ORDER BY path"
+            ).fetchall(),
+            chunk_chars,
+        )
+    )
+    _write_index(
+        conn, db_path, embedder.name, chunk_rows, _embed(embedder, [r[4] for r in chunk_rows])
+    )
+    return len(chunk_rows)
+
+
+def update_embedding_index(
+    conn, db_path: str, embedder, changed_paths: List[str], chunk_chars: int = CHUNK_CHARS
+):
+    """
+    Re-embed only the documents at changed_paths, reusing the vectors of every other chunk.
+    Falls back to a full build if there is no usable index or it was built with another
+    embedder. Returns the number of chunks embedded.
+    """
+    index = SemanticIndex.load(conn, db_path)
+    if index is None or index.embedder.name != embedder.name:
+        return build_embedding_index(conn, db_path, embedder, chunk_chars)
+    if not changed_paths:
+        return 0
+
+    conn.register("changed_path", pa.table({"path": list(changed_paths)}))
+    try:
+        kept = conn.execute("""
+            SELECT chunk_id, path, ordinal, start, length, text FROM doc_chunk
+            WHERE path NOT IN (SELECT path FROM changed_path)
+            ORDER BY chunk_id
+        """).fetchall()
+        changed_rows = list(
+            _chunk_rows(
+                conn.execute("""
+                    SELECT path, COALESCE(content, '') FROM document
+                    WHERE path IN (SELECT path FROM changed_path)
+                    ORDER BY path
+                """).fetchall(),
+                chunk_chars,
+            )
+        )
+    finally:
+        conn.unregister("changed_path")
+
+    dim = index.vectors.shape[1]
+    kept_ids = np.array([row[0] for row in kept], dtype=np.int64)
+    matrix = np.vstack(
+        [
+            np.asarray(index.vectors[kept_ids], dtype=np.float32).reshape(-1, dim),
+            _embed(embedder, [r[4] for r in changed_rows]).reshape(-1, dim),
+        ]
+    )
+    _write_index(
+        conn, db_path, embedder.name, [row[1:] for row in kept] + changed_rows, matrix
+    )
+    return len(changed_rows)
+
+
+class SemanticIndex:
+    """
+    Read side of the embedding index: the memory-mapped vectors plus the embedder they were
+    built with. load() returns None when docs.db has no embedding index.
+    """
+
+    def __init__(self, vectors: np.ndarray, embedder, vectors_file: Optional[str] = None):
+        self.vectors = vectors
+        self.embedder = embedder
+        self.vectors_file = vectors_file
+
+    def warm(self):
+        """Page the vectors into memory, so the first search does not pay for it"""
+        float(np.sum(self.vectors, dtype=np.float64))
+
+    @classmethod
+    def load(cls, conn, db_path: str) -> Optional["SemanticIndex"]:
+        # Checked up front, a failing query would abort the seeding transaction
+        found = conn.execute("""
+            SELECT count(*) FROM information_schema.columns
+            WHERE (table_name = 'doc_chunk' AND column_name = 'chunk_id')
+               OR (table_name = 'doc_embedding_meta' AND column_name = 'vectors')
+        """).fetchone()[0]
+        if found != 2:
+            return None
+        embedder_spec, dim, chunks, vectors_file = conn.execute(
+            "SELECT embedder, dim, chunks, vectors FROM doc_embedding_meta"
+        ).fetchone()
+        path = os.path.join(os.path.dirname(os.path.abspath(db_path)), vectors_file)
+        if not os.path.isfile(path):
+            logger.warning(f"Embedding index of {db_path} is missing {path}")
+            return None
+        vectors = np.load(path, mmap_mode="r")
+        if vectors.shape != (chunks, dim):
+            logger.warning(
+                f"{path} has shape {vectors.shape}, expected ({chunks}, {dim}), re-run seeding"
+            )
+            return None
+        return cls(vectors, create_embedder(embedder_spec), vectors_file)
+
+    def search(self, conn, query: str, k: int):
+        """Rows of (path, ordinal, start, length, text, score) for the k most similar chunks"""
+        if len(self.vectors) == 0:
+            return []
+        query_vector = self.embedder.embed([query])[0]
+        scores = self.vectors @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        placeholders = ", ".join("?" for _ in top)
+        rows = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                "SELECT chunk_id, path, ordinal, start, length, text FROM doc_chunk"
+                f" WHERE chunk_id IN ({placeholders})",
+                [int(i) for i in top],
+            ).fetchall()
+        }
+        return [(*rows[int(i)], float(scores[i])) for i in top if int(i) in rows]
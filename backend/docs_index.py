@@ -0,0 +1,285 @@
+"""
+Full-text index over the docs `document` table with BM25 ranking.
+
+The index is a plain inverted index kept in DuckDB tables next to `document`, so it needs no
+extension download and travels with docs.db:
+
+    doc_posting (term, path, tf, length)  term frequency per document, title terms weighted
+                                          up, and the document's weighted number of terms
+    doc_term    (term, df)                number of documents containing each term
+    doc_stats   (path, length)            weighted number of terms per document
+
+Searches look up BM25 candidates for the literal words of the query and only run the regex
+on that candidate set.
+"""
+
+import logging
+import re
+from typing import List, Optional
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Tokens are runs of 2+ ASCII letters, digits or underscores of the lower-cased text, query
+# words are picked out of the regex the same way
+TOKEN_PATTERN = "[a-z0-9_]{2,}"
+# A title term counts as this many content terms
+TITLE_WEIGHT = 3
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Incremental updates touching more than this share of documents rebuild the index instead
+REBUILD_FRACTION = 0.2
+
+INDEX_TABLES = ("doc_posting", "doc_term", "doc_stats")
+
+_WORD_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789_")
+_REPEATS = ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+
+
+def _required_words(items) -> Optional[set]:
+    """
+    Words of 2+ characters every match of the parsed (sub)pattern items contains, as runs of
+    literal characters, or None if a match may do without any (e.g. "." or "(a|.+)").
+    Several words only ever make for more candidates, any one of them would do.
+    """
+    words = set()
+    run = []
+
+    def end_run():
+        if len(run) >= 2:
+            words.add("".join(run))
+        run.clear()
+
+    for op, arg in items:
+        name = str(op)
+        if name == "LITERAL" and chr(arg).lower() in _WORD_CHARS:
+            run.append(chr(arg).lower())
+            continue
+        end_run()
+        if name == "SUBPATTERN":
+            inner = _required_words(arg[-1])
+        elif name in _REPEATS:
+            # Only a part that has to be there at least once is required
+            inner = _required_words(arg[2]) if arg[0] > 0 else None
+        elif name == "BRANCH":
+            inner = set()
+            for branch in arg[1]:
+                branch_words = _required_words(branch)
+                if branch_words is None:
+                    # One alternative without a word of its own can match anything
+                    inner = None
+                    break
+                inner |= branch_words
+        else:
+            inner = None
+        if inner is not None:
+            words |= inner
+    end_run()
+    return words or None
+
+
+def regex_terms(pattern: str) -> List[str]:
+    """
+    Literal words of a regex usable to look up candidates, empty if there are none (e.g. "."
+    or "(revenue|x)"), in which case the caller has to scan every document. Every match of
+    the regex contains at least one of them; a word in an alternative, or in an optional or
+    repeated part, only counts if all the others have one too.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, OverflowError, RecursionError):
+        # Syntax Python does not know (DuckDB runs RE2), scan rather than guess
+        return []
+    return sorted(_required_words(parsed) or [])
+
+
+def _postings_sql(source: str) -> str:
+    """Postings of the documents in source (a table or subquery with path, title, content)"""
+    return f"""
+        SELECT term, path, tf, (sum(tf) OVER (PARTITION BY path))::INTEGER AS length
+        FROM (
+            SELECT term, path, sum(weight)::INTEGER AS tf
+            FROM (
+                SELECT path, unnest(regexp_extract_all(lower(COALESCE(title, '')), '{TOKEN_PATTERN}')) AS term,
+                       {TITLE_WEIGHT} AS weight
+                FROM {source}
+                UNION ALL
+                SELECT path, unnest(regexp_extract_all(lower(COALESCE(content, '')), '{TOKEN_PATTERN}')) AS term,
+                       1 AS weight
+                FROM {source}
+            )
+            GROUP BY term, path
+        )
+    """
+
+
+def build_search_index(conn):
+    """(Re)build the index tables from `document`, all in DuckDB"""
+    # Sorted by term, lookups of a few terms only touch a few row groups
+    conn.execute(
+        f"CREATE OR REPLACE TABLE doc_posting AS {_postings_sql('document')} ORDER BY term, path"
+    )
+    refresh_search_stats(conn)
+
+
+def update_search_index(conn, changed_paths: List[str]):
+    """
+    Bring the index in line with `document` after the documents at changed_paths were
+    inserted, replaced or deleted. Postings of other documents are left alone unless so many
+    changed that a rebuild is cheaper.
+    """
+    if not has_search_index(conn):
+        build_search_index(conn)
+        return
+    if not changed_paths:
+        return
+    documents = conn.execute("SELECT count(*) FROM document").fetchone()[0]
+    if len(changed_paths) > REBUILD_FRACTION * max(documents, 1):
+        build_search_index(conn)
+        return
+
+    conn.register("changed_path", pa.table({"path": list(changed_paths)}))
+    try:
+        conn.execute(
+            "DELETE FROM doc_posting WHERE path IN (SELECT path FROM changed_path)"
+        )
+        changed = "(SELECT * FROM document WHERE path IN (SELECT path FROM changed_path))"
+        conn.execute(f"INSERT INTO doc_posting {_postings_sql(changed)}")
+    finally:
+        conn.unregister("changed_path")
+    refresh_search_stats(conn)
+
+
+def refresh_search_stats(conn):
+    """Recompute document frequencies and lengths after doc_posting changed"""
+    conn.execute("""
+        CREATE OR REPLACE TABLE doc_term AS
+        SELECT term, count(*)::INTEGER AS df FROM doc_posting GROUP BY term ORDER BY term
+    """)
+    conn.execute("""
+        CREATE OR REPLACE TABLE doc_stats AS
+        SELECT DISTINCT path, length FROM doc_posting
+    """)
+
+
+def has_search_index(conn) -> bool:
+    tables = {
+        row[0]
+        for row in conn.execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_name IN (?, ?, ?)",
+            list(INDEX_TABLES),
+        ).fetchall()
+    }
+    return tables == set(INDEX_TABLES)
+
+
+def scan_search(conn, pattern: str, max_results: int):
+    """Regex over every document, the fallback when the index cannot narrow things down"""
+    return conn.execute(
+        "SELECT path, title, summary, NULL AS score FROM document"
+        " WHERE regexp_matches(COALESCE(title, ''), ?, 'i')"
+        "    OR regexp_matches(COALESCE(content, ''), ?, 'i')"
+        " ORDER BY path LIMIT ?",
+        [pattern, pattern, max_results],
+    ).fetchall()
+
+
+def bm25_candidates(conn, terms: List[str], limit: int):
+    """
+    (path, score) of the best documents by BM25 over every indexed term containing one of
+    terms, so "sale" still finds "sales" and "venue" finds "revenue", as the regex would
+    """
+    return conn.execute(
+        f"""
+        WITH query_term AS (
+            SELECT DISTINCT t.term, t.df
+            FROM doc_term t JOIN (SELECT unnest(?::VARCHAR[]) AS word) q
+              ON contains(t.term, q.word)
+        ),
+        corpus AS (
+            SELECT count(*)::DOUBLE AS n, avg(length) AS avgdl FROM doc_stats
+        )
+        SELECT p.path,
+               sum(
+                   ln(1 + (corpus.n - q.df + 0.5) / (q.df + 0.5))
+                   * p.tf * ({BM25_K1} + 1)
+                   / (p.tf + {BM25_K1} * (1 - {BM25_B} + {BM25_B} * p.length / corpus.avgdl))
+               ) AS score
+        FROM doc_posting p
+        JOIN query_term q ON p.term = q.term
+        CROSS JOIN corpus
+        GROUP BY p.path
+        ORDER BY score DESC, p.path
+        LIMIT ?
+        """,
+        [terms, limit],
+    ).fetchall()
+
+
+def bm25_search(
+    conn, pattern: str, terms: List[str], max_results: int, candidates: int
+):
+    """
+    Run the regex over the BM25 candidates best first, in growing windows, until max_results
+    documents matched. Candidates are fetched by primary key, the regex never sees the rest.
+    If the candidates ran out at the cap before that, the documents beyond it come from a
+    scan, unscored after the ranked ones.
+    """
+    ranked = bm25_candidates(conn, terms, candidates)
+    results = []
+    start = 0
+    window = max_results * 4
+    while start < len(ranked) and len(results) < max_results:
+        batch = ranked[start : start + window]
+        placeholders = ", ".join("?" for _ in batch)
+        matched = {
+            row[0]: row
+            for row in conn.execute(
+                "SELECT path, title, summary FROM document"
+                f" WHERE path IN ({placeholders})"
+                "   AND (regexp_matches(COALESCE(title, ''), ?, 'i')"
+                "        OR regexp_matches(COALESCE(content, ''), ?, 'i'))",
+                [path for path, _ in batch] + [pattern, pattern],
+            ).fetchall()
+        }
+        for path, score in batch:
+            if path in matched and len(results) < max_results:
+                results.append((*matched[path], score))
+        start += window
+        window *= 4
+
+    if len(results) < max_results and len(ranked) >= candidates:
+        found = {row[0] for row in results}
+        for row in scan_search(conn, pattern, max_results + len(results)):
+            if row[0] not in found and len(results) < max_results:
+                results.append(row)
+    return results
+
+
+def search(
+    conn,
+    pattern: str,
+    max_results: int,
+    candidates: int = 1000,
+    indexed: Optional[bool] = None,
+):
+    """
+    Rows of (path, title, summary, score) for documents matching pattern, best first. score is
+    None for results of a full scan. indexed can pass a cached has_search_index() result.
+    """
+    if indexed is None:
+        indexed = has_search_index(conn)
+    terms = regex_terms(pattern) if indexed else []
+    if not terms:
+        return scan_search(conn, pattern, max_results)
+    return bm25_search(
+        conn, pattern, terms, max_results, max(candidates, max_results)
+    )
@@ -0,0 +1,151 @@
+"""
+Parsed documents for /ai/retrieve_doc: markdown sections with character offsets and token
+estimates, kept in an LRU keyed by path and content hash.
+
+A chat session typically retrieves the same few documents again and again, a section or a
+range at a time. The hash of every document of a snapshot is loaded with the snapshot, so a
+repeated lookup is a dict access and never touches DuckDB, and unchanged documents stay
+cached across docs.db reloads.
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$")
+_FENCE_RE = re.compile(r"^(```|~~~)")
+
+
+def content_hash(content: str) -> str:
+    """Hash stored with each document by seed_docs_db.py"""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count, about four characters per token for English and SQL"""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class Section:
+    number: int
+    level: int
+    title: str
+    start: int
+    end: int
+    tokens: int
+
+
+@dataclass
+class ParsedDocument:
+    path: str
+    digest: str
+    content: str
+    sections: List[Section]
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.content)
+
+    @classmethod
+    def parse(cls, path: str, content: str, digest: str) -> "ParsedDocument":
+        """
+        Split content at its markdown headings. A section runs up to the next heading of the
+        same or a higher level, so it includes its subsections. Text before the first
+        heading becomes an untitled section of its own.
+        """
+        headings = []
+        offset = 0
+        in_fence = False
+        for line in content.splitlines(keepends=True):
+            stripped = line.rstrip("\r\n")
+            if _FENCE_RE.match(stripped):
+                in_fence = not in_fence
+            elif not in_fence:
+                match = _HEADING_RE.match(stripped)
+                if match:
+                    headings.append((offset, len(match.group(1)), match.group(2)))
+            offset += len(line)
+
+        if not headings or content[: headings[0][0]].strip():
+            # Level 0 ends at the next heading of any level
+            headings.insert(0, (0, 0, "(untitled)"))
+
+        sections = []
+        for i, (start, level, title) in enumerate(headings):
+            following = [h for h in headings[i + 1 :] if level == 0 or h[1] <= level]
+            end = following[0][0] if following else len(content)
+            sections.append(
+                Section(i + 1, level, title, start, end, estimate_tokens(content[start:end]))
+            )
+        return cls(path, digest, content, sections)
+
+    def find_section(self, section) -> Optional[Section]:
+        """Section by number, or by heading text: exact match first, then substring"""
+        if isinstance(section, int) or str(section).isdigit():
+            number = int(section)
+            return self.sections[number - 1] if 0 < number <= len(self.sections) else None
+        wanted = str(section).strip().lstrip("#").strip().lower()
+        for s in self.sections:
+            if s.title.lower() == wanted:
+                return s
+        for s in self.sections:
+            if wanted in s.title.lower():
+                return s
+        return None
+
+
+class DocumentCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, ParsedDocument]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, snapshot, path: str) -> Optional[ParsedDocument]:
+        """The parsed document at path in snapshot, None if there is none"""
+        if snapshot.hashed and path not in snapshot.content_hashes:
+            return None
+        digest = snapshot.content_hashes.get(path)
+        if digest is not None:
+            with self._lock:
+                doc = self._entries.get((path, digest))
+                if doc is not None:
+                    self._entries.move_to_end((path, digest))
+                    self.hits += 1
+                    return doc
+
+        with snapshot.cursor() as conn:
+            row = conn.execute(
+                "SELECT content FROM document WHERE path = ?", [path]
+            ).fetchone()
+        if row is None:
+            return None
+        content = row[0] or ""
+        if digest is None:
+            # Snapshot seeded without hashes
+            digest = content_hash(content)
+            snapshot.content_hashes[path] = digest
+        doc = ParsedDocument.parse(path, content, digest)
+
+        with self._lock:
+            self.misses += 1
+            self._entries[(path, digest)] = doc
+            self._entries.move_to_end((path, digest))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return doc
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,190 @@
+"""
+The docs.db snapshot served by /ai/search, /ai/ls, /ai/retrieve_doc and /ai/semantic_search,
+reloaded when seed_docs_db.py replaces the file.
+
+Handlers take `docs_store.current` once per request and query that snapshot's cursor() on
+the docs lane, never on the IOLoop. A reload opens and warms the new snapshot first and then
+swaps `current` in a single assignment; requests still running on the old snapshot finish on
+it, and its connection is closed once the last of them lets go of it.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import duckdb
+
+import docs_index
+from docs_embeddings import SemanticIndex
+
+logger = logging.getLogger(__name__)
+
+
+def file_version(path: str) -> Optional[tuple]:
+    """Identity of the file at path, changes when seeding replaces it"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class DocsSnapshot:
+    """A read-only connection to one version of docs.db, with what its indexes offer"""
+
+    def __init__(
+        self,
+        path: str,
+        pool_size: int = 4,
+        threads: int = 0,
+        memory_limit: Optional[str] = None,
+    ):
+        """
+        pool_size: cursors opened up front, one per docs lane worker
+        threads, memory_limit: DuckDB settings for this snapshot's queries, DuckDB's
+            defaults (all cores, 80% of RAM) if not set
+        """
+        self.path = path
+        self.version = file_version(path)
+        # duckdb.connect() would hand back the database already open for the same path,
+        # i.e. the old snapshot, attaching opens the file anew
+        quoted_path = path.replace("'", "''")
+        self.conn = duckdb.connect(":memory:")
+        if threads:
+            self.conn.execute("SET threads = ?", [int(threads)])
+        if memory_limit:
+            self.conn.execute("SET memory_limit = ?", [memory_limit])
+        self.conn.execute(f"ATTACH '{quoted_path}' AS docs (READ_ONLY)")
+        self.conn.execute("USE docs")
+        self.indexed = docs_index.has_search_index(self.conn)
+        if not self.indexed:
+            logger.warning(
+                f"{path} has no full-text index, /ai/search scans every document. "
+                "Re-run seed_docs_db.py to build it."
+            )
+        self.semantic_index = SemanticIndex.load(self.conn, path)
+        if self.semantic_index is None:
+            logger.warning(
+                f"{path} has no embedding index, /ai/semantic_search is unavailable. "
+                "Re-run seed_docs_db.py to build it."
+            )
+        self.documents = self.conn.execute("SELECT count(*) FROM document").fetchone()[0]
+        # {path: content_hash} for the document cache, filled lazily if docs.db has no hashes
+        self.hashed = (
+            self.conn.execute(
+                "SELECT count(*) FROM information_schema.columns"
+                " WHERE table_name = 'document' AND column_name = 'content_hash'"
+            ).fetchone()[0]
+            > 0
+        )
+        self.content_hashes = (
+            dict(self.conn.execute("SELECT path, content_hash FROM document").fetchall())
+            if self.hashed
+            else {}
+        )
+        self.loaded_at = time.time()
+        self._cursors = queue.SimpleQueue()
+        for _ in range(pool_size):
+            self._cursors.put(self._open_cursor())
+        # Cursors opened because all pooled ones were in use
+        self.extra_cursors = 0
+
+    def _open_cursor(self):
+        # Cursors do not inherit USE
+        cursor = self.conn.cursor()
+        cursor.execute("USE docs")
+        return cursor
+
+    @contextmanager
+    def cursor(self):
+        """
+        A connection of its own for one request: a pooled cursor, or a new one if they are
+        all in use (docs tools also run on the AI lane for the agent loop)
+        """
+        try:
+            cursor = self._cursors.get_nowait()
+        except queue.Empty:
+            self.extra_cursors += 1
+            with self._open_cursor() as cursor:
+                yield cursor
+            return
+        try:
+            yield cursor
+        finally:
+            self._cursors.put(cursor)
+
+    def warm(self):
+        """Read the index tables and vectors once, so first searches run at full speed"""
+        if self.indexed:
+            self.conn.execute("SELECT sum(df) FROM doc_term").fetchone()
+            self.conn.execute("SELECT count(*), sum(tf) FROM doc_posting").fetchone()
+        if self.semantic_index is not None:
+            self.conn.execute("SELECT sum(length) FROM doc_chunk").fetchone()
+            self.semantic_index.warm()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "documents": self.documents,
+            "indexed": self.indexed,
+            "semantic_index": self.semantic_index is not None,
+            "loaded_at": self.loaded_at,
+            "extra_cursors": self.extra_cursors,
+        }
+
+
+class DocsStore:
+    def __init__(self, path: str, **snapshot_options):
+        """snapshot_options: passed to every DocsSnapshot, see there"""
+        self.path = path
+        self.snapshot_options = snapshot_options
+        self.current = DocsSnapshot(path, **snapshot_options)
+        self.current.warm()
+        self.reloads = 0
+        self.failed_reloads = 0
+        self._reload_lock = threading.Lock()
+
+    def changed(self) -> bool:
+        version = file_version(self.path)
+        return version is not None and version != self.current.version
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Swap in the current docs.db if it was replaced since it was loaded, or regardless with
+        force. Blocking, run it off the IOLoop. Returns True if a new snapshot was swapped in.
+        """
+        if not (force or self.changed()):
+            return False
+        # A reload already in progress picks up the same file
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            started = time.perf_counter()
+            snapshot = DocsSnapshot(self.path, **self.snapshot_options)
+            snapshot.warm()
+            # The old snapshot is not closed here, requests may still be reading it. Its
+            # connection closes when the last reference goes away.
+            self.current = snapshot
+            self.reloads += 1
+            logger.info(
+                f"Reloaded {self.path} ({snapshot.documents} documents) in "
+                f"{(time.perf_counter() - started) * 1000:.0f} ms"
+            )
+            return True
+        except Exception as e:
+            self.failed_reloads += 1
+            logger.error(f"Could not reload {self.path}, keeping the current snapshot: {e}")
+            raise
+        finally:
+            self._reload_lock.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.current.info(),
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+        }
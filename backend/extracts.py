@@ -0,0 +1,218 @@
+"""
+Server-side DuckDB for dashboards: query results (Arrow IPC, usually straight from the result
+cache) are registered as views of a session's DuckDB, and Mosaic runs its aggregate SQL
+against them here. Only the aggregated result goes to the browser, instead of the whole
+extract for DuckDB-WASM to aggregate there.
+
+Each session is a DuckDB of its own, so sessions only see their own tables and whatever
+Mosaic creates for them (data cube indexes in the mosaic schema). DuckDB has no access to
+files or extensions, only to the registered results.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import duckdb
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+_TABLE_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Query types of Mosaic's REST connector protocol
+QUERY_TYPES = ("arrow", "json", "exec")
+
+
+def read_arrow(payload: Union[bytes, pa.Buffer]) -> pa.Table:
+    """Arrow IPC stream bytes as a table, without copying unless they are compressed"""
+    return pa.ipc.open_stream(payload).read_all()
+
+
+def _configure(conn, threads: int, memory_limit: Optional[str]):
+    if threads > 0:
+        conn.execute("SET threads = ?", [threads])
+    if memory_limit:
+        conn.execute("SET memory_limit = ?", [memory_limit])
+    conn.execute("SET enable_external_access = false")
+    conn.execute("SET lock_configuration = true")
+
+
+class ExtractSession:
+    """
+    A dashboard's DuckDB. Statements run one at a time on its connection, Mosaic's exec
+    statements have to be visible to the queries after them.
+    """
+
+    def __init__(
+        self, session_id: str, user: str, threads: int = 0, memory_limit: Optional[str] = None
+    ):
+        self.id = session_id
+        self.user = user
+        self.conn = duckdb.connect(":memory:")
+        _configure(self.conn, threads, memory_limit)
+        # name: Arrow table backing the view
+        self.tables: Dict[str, pa.Table] = {}
+        self.last_used = time.monotonic()
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return sum(table.nbytes for table in list(self.tables.values()))
+
+    def register(self, name: str, table: pa.Table):
+        """Make table queryable as name, replacing a table of the same name (blocking)"""
+        if not _TABLE_NAME_RE.match(name):
+            raise ValueError(f"Invalid table name: {name}")
+        with self._lock:
+            # The Arrow table is scanned in place through a temporary view, a view of the
+            # name in main makes it memory.name as well, like tables DuckDB-WASM loaded
+            if name in self.tables:
+                self.conn.unregister(f"__extract_{name}")
+            self.conn.register(f"__extract_{name}", table)
+            self.conn.execute(
+                f'CREATE OR REPLACE VIEW "{name}" AS SELECT * FROM "__extract_{name}"'
+            )
+            self.tables[name] = table
+            self.last_used = time.monotonic()
+
+    def execute(self, query_type: str, sql: str) -> Union[bytes, List[Dict[str, Any]], None]:
+        """
+        Run sql (blocking): Arrow IPC stream bytes for arrow, rows as dicts for json and
+        nothing for exec
+        """
+        if query_type not in QUERY_TYPES:
+            raise ValueError(
+                f"Unsupported query type: {query_type}. Supported types: {', '.join(QUERY_TYPES)}"
+            )
+        with self._lock:
+            self.last_used = time.monotonic()
+            self.queries += 1
+            result = self.conn.execute(sql)
+            if query_type == "exec":
+                return None
+            if query_type == "json":
+                columns = [d[0] for d in result.description]
+                return [dict(zip(columns, row)) for row in result.fetchall()]
+            table = result.fetch_arrow_table()
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+            self.tables = {}
+
+
+class ExtractEngine:
+    """
+    The sessions of all users. A session is closed ttl seconds after it was last used. The
+    extracts of all sessions together may take up to max_bytes.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 4 * 1024 * 1024 * 1024,
+        ttl: float = 1800.0,
+        threads: int = 0,
+        memory_limit: Optional[str] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, ExtractSession] = {}
+        # Bytes of tables being registered, counted against max_bytes until they are
+        self._reserved = 0
+        self.loads = 0
+        self.expired = 0
+
+    def session(
+        self, session_id: str, user: Optional[str] = None, create: bool = True
+    ) -> Optional[ExtractSession]:
+        """
+        The session, created for user if given, create is set and it is not there yet. A
+        session belonging to another user is not handed out.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None and user is not None and create:
+                session = ExtractSession(session_id, user, self.threads, self.memory_limit)
+                self._sessions[session_id] = session
+                logger.info(f"Opened extract session {session_id} for {user}")
+        if session is not None and user is not None and session.user != user:
+            raise PermissionError(f"Extract session {session_id} belongs to a different user")
+        return session
+
+    def load(self, session: ExtractSession, name: str, payload: Union[bytes, pa.Buffer]):
+        """Register the Arrow IPC result payload as table name of session (blocking)"""
+        table = read_arrow(payload)
+        replaced = session.tables.get(name)
+        # Checked and reserved in one go, concurrent loads cannot both take the last room
+        with self._lock:
+            used = sum(s.size for s in self._sessions.values()) + self._reserved
+            used -= replaced.nbytes if replaced is not None else 0
+            if used + table.nbytes > self.max_bytes:
+                raise MemoryError(
+                    f"No room for {name} ({table.nbytes} bytes), extracts already take {used}"
+                    f" of {self.max_bytes} bytes"
+                )
+            self._reserved += table.nbytes
+        try:
+            session.register(name, table)
+        finally:
+            # Registered, the table counts through its session now
+            with self._lock:
+                self._reserved -= table.nbytes
+        with self._lock:
+            self.loads += 1
+        return table
+
+    def close(self, session_id: str, user: Optional[str] = None) -> bool:
+        """Close the session, if user is given only a session of the user (blocking)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            if user is not None and session.user != user:
+                raise PermissionError(f"Extract session {session_id} belongs to a different user")
+            del self._sessions[session_id]
+        session.close()
+        return True
+
+    def expire(self):
+        """Close the sessions unused for ttl seconds (blocking)"""
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [s for s in self._sessions.values() if s.last_used < cutoff]
+            for session in expired:
+                del self._sessions[session.id]
+            self.expired += len(expired)
+        for session in expired:
+            logger.info(f"Extract session {session.id} expired")
+            session.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            return {
+                "sessions": len(sessions),
+                "tables": sum(len(s.tables) for s in sessions),
+                "bytes": sum(s.size for s in sessions),
+                "queries": sum(s.queries for s in sessions),
+                "loads": self.loads,
+                "expired": self.expired,
+            }
+
+
+def encode_rows(rows: List[Dict[str, Any]]) -> str:
+    """JSON for the json query type, dates and decimals as strings"""
+    return json.dumps(rows, default=str)
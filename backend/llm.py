@@ -2,14 +2,38 @@
 LLM utility module for Ollama-based AI chat functionality
 """
 
-from typing import Any, Dict, List, Optional
+import threading
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
 
 import ollama
 
 
+def freeze(value: Any) -> Any:
+    """Read-only deep copy: dicts become mappingproxies and lists tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Plain dict/list deep copy of a frozen value"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
 class OllamaLLM:
     def __init__(
-        self, base_url: str = "http://localhost:11434", model: str = "gpt-oss"
+        self,
+        base_url: str = "http://localhost:11434",
+        model: str = "gpt-oss",
+        keep_alive: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
     ):
         """
         Initialize OllamaLLM with Ollama Python client
@@ -17,12 +41,82 @@ class OllamaLLM:
         Args:
             base_url: The base URL for the Ollama server
             model: The model name to use for chat completions
+            keep_alive: How long Ollama keeps the model loaded after a request, e.g. "30m"
+                (Ollama's default if None)
+            options: Sampling options, temperature and top_p default to 0.7 and 0.9
         """
+        self.base_url = base_url
+        # Both clients pool their HTTP connections, instances are meant to be shared
         self.client = ollama.Client(host=base_url)
+        self._async_client = None
         self.model = model
+        self.keep_alive = keep_alive
+        self.options = {"temperature": 0.7, "top_p": 0.9, **(options or {})}
+        # {id(functions): (functions, tools)}, holding on to functions keeps the id unique
+        self._tools = {}
+        self._tools_lock = threading.Lock()
+
+    @property
+    def async_client(self) -> ollama.AsyncClient:
+        """Client for streaming on the IOLoop, created there on first use"""
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient(host=self.base_url)
+        return self._async_client
+
+    def tools(self, functions: Sequence) -> List[ollama.Tool]:
+        """Ollama tools for functions, converted and validated once per functions object"""
+        cached = self._tools.get(id(functions))
+        if cached is not None and cached[0] is functions:
+            return cached[1]
+        tools = [
+            ollama.Tool.model_validate(tool)
+            for tool in self._convert_functions_to_tools(functions)
+        ]
+        with self._tools_lock:
+            self._tools[id(functions)] = (functions, tools)
+        return tools
+
+    def preload(self):
+        """Have Ollama load the model now, so the first chat does not wait for it"""
+        self.client.generate(model=self.model, prompt="", keep_alive=self.keep_alive)
+
+    def sampling_options(self, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """The options a request with options sends, defaults filled in"""
+        return {**self.options, **(options or {})}
+
+    def _chat_params(
+        self,
+        messages: List[Dict[str, str]],
+        functions: Optional[List[Dict]] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Parameters of a chat request, shared by chat_complete and chat_stream"""
+        chat_params = {
+            "model": self.model,
+            "messages": messages,
+            "options": self.sampling_options(options),
+        }
+
+        if self.keep_alive is not None:
+            chat_params["keep_alive"] = self.keep_alive
+
+        # Convert functions to Ollama tools format if provided
+        if functions:
+            chat_params["tools"] = self.tools(functions)
+        return chat_params
+
+    @staticmethod
+    def _function_call(tool_call) -> Dict[str, Any]:
+        return {
+            "name": tool_call.get("function", {}).get("name"),
+            "arguments": tool_call.get("function", {}).get("arguments", {}),
+        }
 
     def chat_complete(
-        self, messages: List[Dict[str, str]], functions: Optional[List[Dict]] = None
+        self,
+        messages: List[Dict[str, str]],
+        functions: Optional[List[Dict]] = None,
+        options: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
         """
         Send a chat completion request to Ollama
@@ -30,25 +124,13 @@ class OllamaLLM:
         Args:
             messages: List of message objects with 'role' and 'content'
             functions: Optional list of function definitions for function calling
+            options: Sampling options overriding the instance's, e.g. temperature
 
         Returns:
             Dict containing the response from Ollama
         """
         try:
-            # Prepare the chat request parameters
-            chat_params = {
-                "model": self.model,
-                "messages": messages,
-                "options": {
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                },
-            }
-
-            # Convert functions to Ollama tools format if provided
-            if functions:
-                tools = self._convert_functions_to_tools(functions)
-                chat_params["tools"] = tools
+            chat_params = self._chat_params(messages, functions, options)
 
             # Send chat request using Ollama client
             response = self.client.chat(**chat_params)
@@ -57,23 +139,18 @@ class OllamaLLM:
             message = response.get("message", {})
             response_text = message.get("content", "")
 
-            # Check for tool calls in the response
-            tool_calls = message.get("tool_calls", [])
-            function_call = None
-
-            if tool_calls:
-                # Convert the first tool call to our expected format
-                # (maintaining backward compatibility with existing code)
-                first_call = tool_calls[0]
-                function_call = {
-                    "name": first_call.get("function", {}).get("name"),
-                    "arguments": first_call.get("function", {}).get("arguments", {}),
-                }
+            # Check for tool calls in the response, the model may ask for several at once
+            function_calls = [
+                self._function_call(tool_call)
+                for tool_call in message.get("tool_calls") or []
+            ]
 
             return {
                 "success": True,
                 "text": response_text,
-                "function_call": function_call,
+                # The first tool call, for callers handling one call per turn
+                "function_call": function_calls[0] if function_calls else None,
+                "function_calls": function_calls,
                 "model": self.model,
                 "extra_data": {"thought_signature": "nonce"},
                 "raw_message": message,  # Include full message for debugging
@@ -84,6 +161,64 @@ class OllamaLLM:
         except Exception as e:
             return {"success": False, "error": f"Unexpected error: {str(e)}"}
 
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        functions: Optional[List[Dict]] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a chat completion from Ollama as events, without blocking a thread:
+
+            {"type": "delta", "text": ...}          next piece of the answer
+            {"type": "thinking", "text": ...}       next piece of the model's reasoning
+            {"type": "tool_call", "function_call": {"name", "arguments"}}
+            {"type": "done", ...}                   same fields as chat_complete, plus stats
+            {"type": "error", "error": ...}
+
+        Closing the generator early closes the request, which stops the generation.
+        """
+        text = []
+        stream = None
+        function_calls = []
+        try:
+            stream = await self.async_client.chat(
+                **self._chat_params(messages, functions, options), stream=True
+            )
+            async for chunk in stream:
+                message = chunk.get("message", {})
+                if message.get("thinking"):
+                    yield {"type": "thinking", "text": message.get("thinking")}
+                if message.get("content"):
+                    text.append(message.get("content"))
+                    yield {"type": "delta", "text": message.get("content")}
+                for tool_call in message.get("tool_calls") or []:
+                    call = self._function_call(tool_call)
+                    function_calls.append(call)
+                    yield {"type": "tool_call", "function_call": call}
+                if chunk.get("done"):
+                    yield {
+                        "type": "done",
+                        "text": "".join(text),
+                        "function_call": function_calls[0] if function_calls else None,
+                        "function_calls": function_calls,
+                        "model": self.model,
+                        "extra_data": {"thought_signature": "nonce"},
+                        "stats": {
+                            "prompt_tokens": chunk.get("prompt_eval_count"),
+                            "completion_tokens": chunk.get("eval_count"),
+                            "total_ms": (chunk.get("total_duration") or 0) / 1e6,
+                        },
+                    }
+        except ollama.ResponseError as e:
+            yield {"type": "error", "error": f"Ollama API error: {str(e)}"}
+        except Exception as e:
+            yield {"type": "error", "error": f"Unexpected error: {str(e)}"}
+        finally:
+            # Closing the response stream drops its connection, which ends the generation
+            if stream is not None:
+                await stream.aclose()
+
     def _convert_functions_to_tools(self, functions: List[Dict]) -> List[Dict]:
         """
         Convert function definitions to Ollama tools format
@@ -105,17 +240,12 @@ class OllamaLLM:
                 },
             }
 
-            # Add parameters if they exist
-            if "parameters" in func:
-                params = func["parameters"]
-
-                # Ensure parameters follow the correct schema
-                if isinstance(params, dict):
-                    # If it already has the correct structure, use it
-                    if "type" not in params:
-                        params["type"] = "object"
-
-                    tool["function"]["parameters"] = params
+            # Add parameters if they exist, without touching the (possibly frozen) input
+            params = func.get("parameters")
+            if isinstance(params, (dict, MappingProxyType)):
+                params = thaw(params)
+                params.setdefault("type", "object")
+                tool["function"]["parameters"] = params
 
             tools.append(tool)
 
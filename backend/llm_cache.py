@@ -0,0 +1,126 @@
+"""
+Cache of LLM chat completions for UniversalLLM, keyed by model, tool schemas, the
+normalised messages and the sampling options.
+
+Conversations start the same way across users, with the same system prompt and the same
+openers, and agent runs and dashboard replays repeat whole conversations. With greedy
+sampling (temperature 0) the model answers those identically, so a repeat is served from
+memory instead of running the model again. Sampled completions vary by design and bypass
+the cache unless allow_sampled is set.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+from llm import thaw
+
+# Message fields that make up a conversation; ids, timestamps and extra_data do not
+_MESSAGE_FIELDS = ("role", "content", "name", "tool_name", "tool_calls", "function_call", "images")
+
+# Response fields worth keeping, raw_message is Ollama's message object
+_RESPONSE_FIELDS = ("success", "text", "function_call", "function_calls", "model", "extra_data")
+
+
+def _digest(value: Any) -> str:
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    normalized = []
+    for message in messages:
+        entry = {}
+        for field in _MESSAGE_FIELDS:
+            value = message.get(field)
+            if isinstance(value, str):
+                value = value.strip()
+            if value:
+                entry[field] = value
+        normalized.append(entry)
+    return normalized
+
+
+class LLMResponseCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, allow_sampled: bool = False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.allow_sampled = allow_sampled
+        # key: (expires_at, response)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # {id(functions): (functions, digest)}, tool schemas are long-lived, see llm_factory
+        self._schema_digests = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.expired = 0
+
+    def cacheable(self, options: Dict[str, Any]) -> bool:
+        if self.allow_sampled or (options.get("temperature") or 0) <= 0:
+            return True
+        with self._lock:
+            self.bypassed += 1
+        return False
+
+    def _schema_digest(self, functions: Optional[Sequence]) -> str:
+        if not functions:
+            return ""
+        cached = self._schema_digests.get(id(functions))
+        if cached is not None and cached[0] is functions:
+            return cached[1]
+        digest = _digest(thaw(functions))
+        with self._lock:
+            self._schema_digests[id(functions)] = (functions, digest)
+        return digest
+
+    def key(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        functions: Optional[Sequence],
+        options: Dict[str, Any],
+    ) -> str:
+        return _digest(
+            [model, self._schema_digest(functions), _digest(normalize_messages(messages)), options]
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, key: str, response: Dict[str, Any]):
+        """Keep a successful response, failures are not cached"""
+        if not response.get("success"):
+            return
+        stored = {field: response.get(field) for field in _RESPONSE_FIELDS}
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,187 @@
+"""
+Keeps the prompt of /ai/chat under a token budget. The browser sends the whole conversation
+on every turn, tool results included, so without a cap every turn of a long session costs
+more than the one before.
+
+Over budget, old tool results are cut to their first lines first, then other old long
+messages, and finally the oldest messages are dropped. An assistant message calling tools is
+dropped together with the results of its calls, or not at all. System messages and the most
+recent messages are never touched.
+"""
+
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Tuple
+
+from docs_sections import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Role, separators and such, per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Roles of the messages answering an assistant's tool_calls / function_call
+TOOL_RESULT_ROLES = ("tool", "function")
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content") or "")
+    for field in ("tool_calls", "function_call"):
+        if message.get(field):
+            tokens += estimate_tokens(json.dumps(message[field], default=str))
+    return tokens
+
+
+def _calls_tools(message: Dict[str, Any]) -> bool:
+    return message.get("role") == "assistant" and bool(
+        message.get("tool_calls") or message.get("function_call")
+    )
+
+
+def truncate(content: str, max_chars: int) -> str:
+    """The first lines of content, up to max_chars, and a note on what was left out"""
+    head = content[:max_chars]
+    cut = head.rfind("\n")
+    if cut > max_chars // 2:
+        head = head[:cut]
+    omitted = content[len(head) :]
+    return (
+        f"{head}\n[... {omitted.count(chr(10)) + 1} more lines ({len(omitted)} characters)"
+        " left out to save context, call the tool again if they are needed]"
+    )
+
+
+class ContextCompactor:
+    def __init__(self, budget_tokens: int, keep_recent: int = 6, max_old_chars: int = 2000):
+        """
+        budget_tokens: estimated prompt tokens to stay under, 0 disables compaction
+        keep_recent: number of most recent messages kept as they are
+        max_old_chars: length older tool results and messages are cut to
+        """
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.max_old_chars = max_old_chars
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.compacted = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def _old(self, messages: List[Dict[str, Any]]) -> List[int]:
+        """Indexes of the messages that may be compacted, oldest first"""
+        protected = set(range(max(len(messages) - self.keep_recent, 0), len(messages)))
+        users = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+        if users:
+            protected.add(users[-1])
+        return [
+            i
+            for i, m in enumerate(messages)
+            if i not in protected and m.get("role") != "system"
+        ]
+
+    def _droppable(self, messages: List[Dict[str, Any]], old: List[int]) -> List[List[int]]:
+        """
+        The old messages in the units they are dropped in, oldest first: an assistant message
+        calling tools goes with the tool results following it, the model API rejects either
+        without the other
+        """
+        groups = []
+        for i in old:
+            previous = groups[-1] if groups else None
+            if (
+                previous is not None
+                and previous[-1] == i - 1
+                and messages[i].get("role") in TOOL_RESULT_ROLES
+                and _calls_tools(messages[previous[0]])
+            ):
+                previous.append(i)
+            else:
+                groups.append([i])
+        # A call whose results run on into the recent messages has to stay with them
+        return [
+            group
+            for group in groups
+            if not (
+                _calls_tools(messages[group[0]])
+                and group[-1] + 1 < len(messages)
+                and messages[group[-1] + 1].get("role") in TOOL_RESULT_ROLES
+            )
+        ]
+
+    def compact(self, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict]:
+        """Messages to send instead of messages, and what was done to them"""
+        tokens = [message_tokens(m) for m in messages]
+        before = total = sum(tokens)
+        stats = {"messages": len(messages), "tokens_before": before, "truncated": 0, "dropped": 0}
+
+        if self.budget_tokens > 0 and total > self.budget_tokens:
+            messages = list(messages)
+            old = self._old(messages)
+
+            # Tool results first, they are the bulk of long sessions, then everything else
+            for tools_only in (True, False):
+                for i in old:
+                    if total <= self.budget_tokens:
+                        break
+                    message = messages[i]
+                    content = message.get("content") or ""
+                    is_tool = message.get("role") == "tool"
+                    if is_tool != tools_only or len(content) <= self.max_old_chars:
+                        continue
+                    messages[i] = {**message, "content": truncate(content, self.max_old_chars)}
+                    total -= tokens[i] - message_tokens(messages[i])
+                    tokens[i] = message_tokens(messages[i])
+                    stats["truncated"] += 1
+
+            dropped = set()
+            for group in self._droppable(messages, old):
+                if total <= self.budget_tokens:
+                    break
+                dropped.update(group)
+                total -= sum(tokens[i] for i in group)
+            if dropped:
+                note = {
+                    "role": "system",
+                    "content": f"[{len(dropped)} earlier messages were left out to save context]",
+                }
+                # Everything before the first dropped message is kept, the note takes its place
+                first = min(dropped)
+                messages = [m for i, m in enumerate(messages) if i not in dropped]
+                messages.insert(first, note)
+                total += message_tokens(note)
+                stats["dropped"] = len(dropped)
+
+        stats["tokens_after"] = total
+        stats["ratio"] = round(total / before, 3) if before else 1.0
+        with self._lock:
+            self.prompts += 1
+            self.tokens_before += before
+            self.tokens_after += total
+            if total != before:
+                self.compacted += 1
+
+        if total != before:
+            logger.info(
+                f"Prompt of {stats['messages']} messages compacted from ~{before} to ~{total}"
+                f" tokens (ratio {stats['ratio']}): {stats['truncated']} truncated,"
+                f" {stats['dropped']} dropped"
+            )
+        else:
+            logger.info(f"Prompt of {stats['messages']} messages, ~{before} tokens")
+        return messages, stats
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "budget_tokens": self.budget_tokens,
+                "prompts": self.prompts,
+                "compacted": self.compacted,
+                "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after,
+                "ratio": (
+                    round(self.tokens_after / self.tokens_before, 3)
+                    if self.tokens_before
+                    else 1.0
+                ),
+            }
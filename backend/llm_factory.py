@@ -3,14 +3,48 @@ LLM Factory for creating appropriate LLM instances based on configuration
 """
 
 import os
-from typing import Any, Dict, List, Optional
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
 
-from llm import OllamaLLM
+from llm import OllamaLLM, freeze
+from llm_cache import LLMResponseCache
 
 
 class LLMFactory:
     """Factory class for creating LLM instances"""
 
+    # Shared instances by (provider, base_url, model), so requests reuse HTTP connections and
+    # converted tool schemas
+    _instances: Dict[tuple, Any] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_llm(provider: str = None, **kwargs):
+        """
+        The process-wide LLM instance for the provider and its settings, created on first use.
+        Takes the same arguments as create_llm.
+        """
+        provider = (provider or os.getenv("LLM_PROVIDER", "ollama")).lower()
+        if provider == "ollama":
+            key = (provider, *LLMFactory._ollama_settings(**kwargs)[:2])
+        else:
+            key = (provider, None, kwargs.get("model"))
+        llm = LLMFactory._instances.get(key)
+        if llm is None:
+            with LLMFactory._lock:
+                llm = LLMFactory._instances.get(key)
+                if llm is None:
+                    llm = LLMFactory.create_llm(provider, **kwargs)
+                    LLMFactory._instances[key] = llm
+        return llm
+
+    @staticmethod
+    def instances() -> List[Dict[str, Any]]:
+        return [
+            {"provider": provider, "base_url": base_url, "model": model}
+            for provider, base_url, model in list(LLMFactory._instances)
+        ]
+
     @staticmethod
     def create_llm(provider: str = None, **kwargs):
         """
@@ -40,14 +74,25 @@ class LLMFactory:
             )
 
     @staticmethod
-    def _create_ollama_llm(**kwargs) -> OllamaLLM:
-        """Create Ollama LLM instance"""
+    def _ollama_settings(**kwargs) -> tuple:
+        """base_url, model and keep_alive from kwargs, falling back to the environment"""
         base_url = kwargs.get("base_url") or os.getenv(
             "OLLAMA_BASE_URL", "http://localhost:11434"
         )
         model = kwargs.get("model") or os.getenv("OLLAMA_MODEL", "gpt-oss")
+        keep_alive = kwargs.get("keep_alive") or os.getenv("OLLAMA_KEEP_ALIVE") or None
+        return base_url, model, keep_alive
 
-        return OllamaLLM(base_url=base_url, model=model)
+    @staticmethod
+    def _create_ollama_llm(**kwargs) -> OllamaLLM:
+        """Create Ollama LLM instance"""
+        base_url, model, keep_alive = LLMFactory._ollama_settings(**kwargs)
+        temperature = os.getenv("OLLAMA_TEMPERATURE")
+        options = {"temperature": float(temperature)} if temperature else None
+
+        return OllamaLLM(
+            base_url=base_url, model=model, keep_alive=keep_alive, options=options
+        )
 
 
 class UniversalLLM:
@@ -56,16 +101,34 @@ class UniversalLLM:
     regardless of the underlying provider
     """
 
-    def __init__(self, provider: str = None, **kwargs):
+    def __init__(
+        self,
+        provider: str = None,
+        cache: Optional[LLMResponseCache] = None,
+        options: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ):
         """
         Initialize UniversalLLM with the specified provider
 
         Args:
             provider: The LLM provider to use ('ollama' or 'gemini')
+            cache: Optional cache completions are served from and stored in
+            options: Sampling options for this wrapper's requests, e.g. temperature
             **kwargs: Additional arguments passed to the LLM constructor
         """
-        self.llm = LLMFactory.create_llm(provider, **kwargs)
+        self.llm = LLMFactory.get_llm(provider, **kwargs)
         self.provider = provider or os.getenv("LLM_PROVIDER", "ollama").lower()
+        self.cache = cache
+        self.options = options
+
+    def _cache_key(self, messages, functions) -> Optional[str]:
+        if self.cache is None:
+            return None
+        options = self.llm.sampling_options(self.options)
+        if not self.cache.cacheable(options):
+            return None
+        return self.cache.key(self.get_model_name(), messages, functions, options)
 
     def chat_complete(
         self, messages: List[Dict[str, str]], functions: Optional[List[Dict]] = None
@@ -80,7 +143,51 @@ class UniversalLLM:
         Returns:
             Dict containing the response from the LLM provider
         """
-        return self.llm.chat_complete(messages, functions)
+        key = self._cache_key(messages, functions)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return {**cached, "cached": True}
+
+        response = self.llm.chat_complete(messages, functions, self.options)
+        if key is not None:
+            self.cache.put(key, response)
+        return response
+
+    async def chat_stream(
+        self, messages: List[Dict[str, str]], functions: Optional[List[Dict]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a chat completion as events (delta, thinking, tool_call, done, error), see
+        OllamaLLM.chat_stream. A cached completion is replayed as a single delta.
+        """
+        key = self._cache_key(messages, functions)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                if cached.get("text"):
+                    yield {"type": "delta", "text": cached["text"]}
+                for call in cached.get("function_calls") or []:
+                    yield {"type": "tool_call", "function_call": call}
+                yield {**cached, "type": "done", "cached": True}
+                return
+
+        done = None
+        events = self.llm.chat_stream(messages, functions, self.options)
+        try:
+            async for event in events:
+                if event["type"] == "done":
+                    done = event
+                yield event
+        finally:
+            await events.aclose()
+        # Only completions streamed to the end get here
+        if key is not None and done is not None:
+            self.cache.put(key, {**done, "success": True})
+
+    def preload(self):
+        """Load the model in the provider ahead of the first chat"""
+        self.llm.preload()
 
     def get_provider(self) -> str:
         """Get the current provider name"""
@@ -96,9 +203,16 @@ class UniversalLLM:
             return "unknown"
 
 
-def get_available_functions() -> List[Dict]:
-    """Return list of available functions for the AI (common to all providers)"""
-    return [
+def get_available_functions() -> Sequence:
+    """
+    Return list of available functions for the AI (common to all providers). The definitions
+    are built once and read-only, so LLMs can convert them once and reuse the result.
+    """
+    return AVAILABLE_FUNCTIONS
+
+
+AVAILABLE_FUNCTIONS = freeze(
+    [
         {
             "name": "execute_sql_query",
             "description": "Execute a SQL query against the Trino database and return results. Will return full results for schema data queries (SHOW, DESCRIBE) and otherwise result metadata only.",
@@ -115,7 +229,7 @@ def get_available_functions() -> List[Dict]:
         },
         {
             "name": "search",
-            "description": "Search knowledge files by regex against file contents. Returns YAML list of matching files with title, id, and summary.",
+            "description": "Search knowledge files by regex against file contents. Returns YAML list of matching files with title, id, and summary, most relevant first. Regexes containing whole words (e.g. 'revenue|orders') are answered from the full-text index and are much faster than ones without.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -125,27 +239,45 @@ def get_available_functions() -> List[Dict]:
                 "required": ["regex"],
             },
         },
+        {
+            "name": "semantic_search",
+            "description": "Search knowledge files by meaning with a natural language question. Returns YAML list of the most similar passages with document id, score, and the passage text, so often no retrieve_doc call is needed.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "Natural language description of the information needed."},
+                    "k": {"type": "integer", "description": "Number of passages to return.", "default": 5},
+                },
+                "required": ["query"],
+            },
+        },
         {
             "name": "ls",
-            "description": "List knowledge files by filename prefix. Returns YAML list of files with title, id, and summary.",
+            "description": "List knowledge files by filename prefix. Returns YAML list of files with title, id, and summary, one page at a time: total_files is the number of matching files and next_offset, if present, where the next page starts.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "prefix": {"type": "string", "description": "Filename prefix to filter files. Use empty string to list all files."},
+                    "offset": {"type": "integer", "description": "Number of files to skip, next_offset of the previous page."},
+                    "limit": {"type": "integer", "description": "Maximum number of files to return."},
                 },
                 "required": ["prefix"],
             },
         },
         {
             "name": "retrieve_doc",
-            "description": "Retrieve documentation by document id using document ids from the `search` function.",
+            "description": "Retrieve documentation by document id using document ids from the `search` function. Long documents are cut off; use toc to list their sections, then fetch only the section or character range needed.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "doc_id": {
                         "type": "string",
                         "description": "The document id to retrieve.",
-                    }
+                    },
+                    "toc": {"type": "boolean", "description": "Return only the table of contents: section numbers, headings, offsets and token estimates."},
+                    "section": {"type": "string", "description": "Section number from the table of contents, or heading text, to retrieve only that section."},
+                    "offset": {"type": "integer", "description": "Character offset to start reading at."},
+                    "length": {"type": "integer", "description": "Number of characters to read from offset."},
                 },
                 "required": ["doc_id"],
             },
@@ -184,3 +316,4 @@ def get_available_functions() -> List[Dict]:
             },
         },
     ]
+)
@@ -0,0 +1,317 @@
+"""
+Catalog metadata held in memory: the catalogs a user sees on a cluster, and per catalog its
+schemas, tables and columns, loaded in bulk from information_schema. SHOW CATALOGS, SHOW
+SCHEMAS, SHOW TABLES and DESCRIBE (what the schema browser, Malloy and the AI agent send
+all the time) are answered from here instead of one Trino round trip each.
+
+Metadata is kept per credential scope, like the result cache, since access control decides
+what a user gets to see. Entries are served for ttl seconds after they were loaded, the
+ones still in use get reloaded in the background every refresh_interval seconds. Only what
+is there is answered: a catalog, schema or table that is not known (yet) goes to Trino.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pyarrow as pa
+
+from result_cache import normalize_sql
+from trino_pool import credentials_hash
+
+_IDENTIFIER = r'(?:"(?:[^"]|"")+"|[A-Za-z_][A-Za-z0-9_@$]*)'
+_IDENTIFIER_RE = re.compile(_IDENTIFIER)
+
+
+def _name(parts: int) -> str:
+    return rf"({_IDENTIFIER}(?:\s*\.\s*{_IDENTIFIER}){{0,{parts - 1}}})"
+
+
+_SHOW_CATALOGS_RE = re.compile(r"^SHOW\s+CATALOGS$", re.I)
+_SHOW_SCHEMAS_RE = re.compile(rf"^SHOW\s+SCHEMAS(?:\s+(?:FROM|IN)\s+{_name(1)})?$", re.I)
+_SHOW_TABLES_RE = re.compile(rf"^SHOW\s+TABLES(?:\s+(?:FROM|IN)\s+{_name(2)})?$", re.I)
+_DESCRIBE_RE = re.compile(
+    rf"^(?:DESCRIBE|SHOW\s+COLUMNS\s+(?:FROM|IN))\s+{_name(3)}$", re.I
+)
+
+# Statements after which what was loaded may be out of date
+_DDL_RE = re.compile(r"^\(*\s*(create|drop|alter|comment|grant|revoke)\b", re.I)
+
+# kind: catalogs, schemas, tables or columns, the names it needs are filled in
+MetadataRequest = namedtuple("MetadataRequest", ["kind", "catalog", "schema", "table"])
+
+# How many of catalog, schema and table each kind of request names
+_NAMES_NEEDED = {"catalogs": 0, "schemas": 1, "tables": 2, "columns": 3}
+
+# Column names of Trino's own results
+RESULT_COLUMNS = {
+    "catalogs": ["Catalog"],
+    "schemas": ["Schema"],
+    "tables": ["Table"],
+    "columns": ["Column", "Type", "Extra", "Comment"],
+}
+
+
+def _identifiers(name: str) -> List[str]:
+    # Trino folds identifiers to lower case, quoted ones as well
+    return [
+        (part[1:-1].replace('""', '"') if part.startswith('"') else part).lower()
+        for part in _IDENTIFIER_RE.findall(name)
+    ]
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def parse_metadata_query(
+    query: str, catalog: Optional[str], schema: Optional[str]
+) -> Optional[MetadataRequest]:
+    """
+    The metadata query query asks for, names not given taken from the session's catalog and
+    schema. None for anything else, including LIKE filters and queries lacking a catalog or
+    schema to resolve against, which Trino has to answer.
+    """
+    sql = normalize_sql(query or "")
+    catalog = catalog.lower() if catalog else None
+    schema = schema.lower() if schema else None
+
+    if _SHOW_CATALOGS_RE.match(sql):
+        return MetadataRequest("catalogs", None, None, None)
+
+    match = _SHOW_SCHEMAS_RE.match(sql)
+    if match:
+        names = _identifiers(match.group(1)) if match.group(1) else [catalog]
+        request = MetadataRequest("schemas", names[0], None, None)
+    else:
+        match = _SHOW_TABLES_RE.match(sql)
+        if match:
+            names = _identifiers(match.group(1)) if match.group(1) else [schema]
+            names = [catalog] * (2 - len(names)) + names
+            request = MetadataRequest("tables", names[0], names[1], None)
+        else:
+            match = _DESCRIBE_RE.match(sql)
+            if not match:
+                return None
+            names = _identifiers(match.group(1))
+            names = [catalog, schema][: 3 - len(names)] + names
+            request = MetadataRequest("columns", *names)
+
+    if None in request[1 : _NAMES_NEEDED[request.kind] + 1]:
+        return None
+    return request
+
+
+def changes_metadata(query: str) -> bool:
+    """Whether query is DDL, after which the metadata of its cluster is reloaded"""
+    return bool(_DDL_RE.match(normalize_sql(query or "")))
+
+
+def encode_arrow(columns: List[str], rows: Sequence[tuple], compression=None) -> bytes:
+    """A metadata result as an Arrow IPC stream of varchar columns, like Trino's"""
+    table = pa.table(
+        {
+            name: pa.array([row[i] for row in rows], pa.string())
+            for i, name in enumerate(columns)
+        }
+    )
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class MetadataEntry:
+    """
+    The catalog list (a sorted list of names) or a catalog: {schema: {table: [(column, type,
+    extra, comment)]}}. value is None for a catalog with more columns than the cache takes.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.loaded = time.monotonic()
+        self.used = self.loaded
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.loaded
+
+
+class MetadataScope:
+    """What one user, with one set of credentials, sees on a cluster"""
+
+    def __init__(self, key: str, cluster, connection: tuple):
+        self.key = key
+        self.cluster = cluster
+        # Kept to reload in the background, the connection pool holds the same
+        self.connection = connection
+        self.user = connection[0]
+        # None: the catalog list, catalog name: the catalog
+        self.entries: Dict[Optional[str], MetadataEntry] = {}
+
+
+class MetadataCache:
+    """
+    The metadata scopes of all users. A catalog with more than max_columns columns is not
+    kept, its queries go to Trino.
+    """
+
+    def __init__(
+        self, ttl: float = 900.0, refresh_interval: float = 300.0, max_columns: int = 500000
+    ):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.max_columns = max_columns
+        self._lock = threading.Lock()
+        self._scopes: Dict[str, MetadataScope] = {}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def scope(self, cluster, connection: tuple) -> MetadataScope:
+        """The scope of connection (user, password, catalog, schema, extra_credential)"""
+        user, password, _, _, extra_credential = connection
+        key = hashlib.sha256(
+            "\0".join(
+                [str(cluster.id), str(user), credentials_hash(password, extra_credential)]
+            ).encode("utf-8")
+        ).hexdigest()
+        with self._lock:
+            scope = self._scopes.get(key)
+            if scope is None:
+                scope = MetadataScope(key, cluster, connection)
+                self._scopes[key] = scope
+            return scope
+
+    def get(self, scope: MetadataScope, catalog: Optional[str]) -> Optional[MetadataEntry]:
+        """The catalog list (catalog None) or the catalog, unless not loaded or too old"""
+        with self._lock:
+            entry = scope.entries.get(catalog)
+            if entry is None or entry.age > self.ttl:
+                self.misses += 1
+                return None
+            entry.used = time.monotonic()
+            self.hits += 1
+            return entry
+
+    def lookup(
+        self, scope: MetadataScope, request: MetadataRequest
+    ) -> Tuple[Optional[List[tuple]], bool]:
+        """
+        The rows answering request, in the columns of RESULT_COLUMNS[request.kind], and
+        whether the metadata needed was loaded. No rows if it was not, or if it does not
+        have what is asked for.
+        """
+        entry = self.get(scope, request.catalog)
+        if entry is None:
+            return None, False
+        if request.kind == "catalogs":
+            return [(name,) for name in entry.value], True
+        if entry.value is None:
+            return None, True
+        if request.kind == "schemas":
+            return [(name,) for name in sorted(entry.value)], True
+        tables = entry.value.get(request.schema)
+        if tables is None:
+            return None, True
+        if request.kind == "tables":
+            return [(name,) for name in sorted(tables)], True
+        columns = tables.get(request.table)
+        if columns is None:
+            return None, True
+        return list(columns), True
+
+    def load(
+        self, scope: MetadataScope, catalog: Optional[str], run: Callable[[str], List[tuple]]
+    ) -> MetadataEntry:
+        """
+        (Re)load the catalog list (catalog None) or the catalog (blocking), run returns the
+        rows of a query on the scope's cluster
+        """
+        if catalog is None:
+            value = sorted(row[0] for row in run("SHOW CATALOGS"))
+        else:
+            value = self._load_catalog(catalog, run)
+        entry = MetadataEntry(value)
+        with self._lock:
+            scope.entries[catalog] = entry
+            # due() drops scopes left empty, possibly while this was loading
+            self._scopes.setdefault(scope.key, scope)
+            self.loads += 1
+        return entry
+
+    def _load_catalog(self, catalog: str, run) -> Optional[Dict[str, Dict[str, list]]]:
+        information_schema = f"{quote_identifier(catalog)}.information_schema"
+        rows = run(
+            # Extra and Comment of DESCRIBE are extra_info and comment, as Trino answers it
+            "SELECT table_schema, table_name, column_name, data_type, ordinal_position,"
+            " extra_info, comment"
+            f" FROM {information_schema}.columns LIMIT {self.max_columns + 1}"
+        )
+        if len(rows) > self.max_columns:
+            return None
+        # Schemas without tables are only in schemata
+        schemata = run(f"SELECT schema_name FROM {information_schema}.schemata")
+        schemas = {row[0]: {} for row in schemata}
+        for table_schema, table_name, column_name, data_type, _, extra, comment in sorted(
+            rows, key=lambda row: (row[0], row[1], row[4])
+        ):
+            schemas.setdefault(table_schema, {}).setdefault(table_name, []).append(
+                (column_name, data_type, extra, comment)
+            )
+        return schemas
+
+    def due(self) -> List[Tuple[MetadataScope, Optional[str]]]:
+        """
+        The entries to reload in the background: older than refresh_interval and used since
+        ttl seconds. Entries past ttl are dropped, and scopes left without any.
+        """
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for key, scope in list(self._scopes.items()):
+                for catalog, entry in list(scope.entries.items()):
+                    if entry.age > self.ttl:
+                        del scope.entries[catalog]
+                    elif entry.age > self.refresh_interval and now - entry.used < self.ttl:
+                        due.append((scope, catalog))
+                if not scope.entries:
+                    del self._scopes[key]
+        return due
+
+    def invalidate(self, cluster_id: str):
+        """Drop everything loaded from cluster_id, e.g. after DDL"""
+        with self._lock:
+            for scope in self._scopes.values():
+                if scope.cluster.id == cluster_id and scope.entries:
+                    scope.entries = {}
+                    self.invalidations += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            catalogs = [
+                entry.value
+                for scope in self._scopes.values()
+                for catalog, entry in scope.entries.items()
+                if catalog is not None and entry.value is not None
+            ]
+            return {
+                "scopes": len(self._scopes),
+                "catalogs": len(catalogs),
+                "tables": sum(len(tables) for c in catalogs for tables in c.values()),
+                "columns": sum(
+                    len(columns)
+                    for c in catalogs
+                    for tables in c.values()
+                    for columns in tables.values()
+                ),
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "invalidations": self.invalidations,
+            }
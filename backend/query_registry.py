@@ -0,0 +1,138 @@
+"""
+Book-keeping of running Trino queries so they can be cancelled by request id or query id
+"""
+
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCancelledError(Exception):
+    """Raised on the executor thread once the query it is working on has been cancelled"""
+
+    def __init__(self, reason: str, status: int = 409):
+        super().__init__(f"Query cancelled: {reason}")
+        self.reason = reason
+        self.status = status
+
+
+class RunningQuery:
+    """
+    A /trino request in flight. The executor thread attaches its cursor before executing, any
+    other thread may cancel() it. Cancelling before the cursor is attached (or before Trino
+    has assigned a query id) is remembered and enforced by check().
+
+    A request sharing another's execution (see single_flight) has no cursor of its own,
+    shared is the RunningQuery of that execution.
+    """
+
+    def __init__(self, request_id: str, user: str, query: str):
+        self.request_id = request_id
+        self.user = user
+        self.query = query
+        self.started = time.monotonic()
+        self.cursor = None
+        self.cancelled = False
+        self.reason = None
+        self.status = None
+        self.shared = None
+        self._on_cancel = []
+        self._lock = threading.Lock()
+
+    @property
+    def query_id(self) -> Optional[str]:
+        cursor = self.cursor if self.shared is None else self.shared.cursor
+        return cursor.query_id if cursor is not None else None
+
+    def attach(self, cursor):
+        with self._lock:
+            self.cursor = cursor
+        self.check()
+
+    def check(self):
+        """Raise QueryCancelledError if the query was cancelled, cancelling the cursor too"""
+        if not self.cancelled:
+            return
+        self._cancel_cursor()
+        raise QueryCancelledError(self.reason, self.status)
+
+    def cancel(self, reason: str, status: int = 409) -> bool:
+        """Cancel the query on Trino, blocks on an HTTP call so keep it off the IOLoop"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            self.status = status
+            callbacks, self._on_cancel = self._on_cancel, []
+        logger.info(
+            f"Cancelling request {self.request_id} (query {self.query_id}): {reason}"
+        )
+        self._cancel_cursor()
+        for callback in callbacks:
+            callback(reason, status)
+        return True
+
+    def on_cancel(self, callback: Callable[[str, int], None]):
+        """Call callback(reason, status) once cancelled, on the cancelling thread"""
+        with self._lock:
+            if not self.cancelled:
+                self._on_cancel.append(callback)
+                return
+        callback(self.reason, self.status)
+
+    def _cancel_cursor(self):
+        cursor = self.cursor
+        if cursor is None:
+            return
+        try:
+            cursor.cancel()
+        except Exception as e:
+            logger.warning(f"Error cancelling query {self.query_id}: {e}")
+
+
+class QueryRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running: Dict[str, RunningQuery] = {}
+        self.cancelled = 0
+        self.timed_out = 0
+
+    def register(self, request_id: Optional[str], user: str, query: str) -> RunningQuery:
+        running = RunningQuery(request_id or str(uuid.uuid4()), user, query)
+        with self._lock:
+            self._running[running.request_id] = running
+        return running
+
+    def unregister(self, running: RunningQuery):
+        with self._lock:
+            if self._running.get(running.request_id) is running:
+                del self._running[running.request_id]
+            if running.cancelled:
+                if running.status == 504:
+                    self.timed_out += 1
+                else:
+                    self.cancelled += 1
+
+    def find(
+        self, request_id: Optional[str] = None, query_id: Optional[str] = None
+    ) -> Optional[RunningQuery]:
+        with self._lock:
+            if request_id is not None:
+                return self._running.get(request_id)
+            for running in self._running.values():
+                if query_id is not None and running.query_id == query_id:
+                    return running
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": len(self._running),
+                "cancelled": self.cancelled,
+                "timed_out": self.timed_out,
+            }
@@ -0,0 +1,312 @@
+"""
+Server side cache of Arrow IPC query results, bounded by size with spill to local disk
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Union
+
+import pyarrow as pa
+
+from trino_pool import credentials_hash
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_LINE_COMMENT_RE = re.compile(r"--[^\n]*")
+_BLOCK_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+_WHITESPACE_RE = re.compile(r"\s+")
+_CACHEABLE_RE = re.compile(r"^\(*\s*(select|with|show|describe|values|table)\b", re.I)
+
+
+def normalize_sql(query: str) -> str:
+    """Strip comments, collapse whitespace and drop a trailing ';' outside of quoted text"""
+    parts = _STRING_LITERAL_RE.split(query)
+    for i in range(0, len(parts), 2):
+        part = _BLOCK_COMMENT_RE.sub(" ", parts[i])
+        part = _LINE_COMMENT_RE.sub(" ", part)
+        parts[i] = _WHITESPACE_RE.sub(" ", part)
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def is_cacheable(query: str) -> bool:
+    """Only read-only statements are cached"""
+    return bool(_CACHEABLE_RE.match(normalize_sql(query)))
+
+
+def cache_key(
+    query, cluster, user, password, catalog, schema, extra_credential, *extra
+) -> str:
+    """Key a result by its normalised SQL, target cluster and credential scope"""
+    parts = [
+        normalize_sql(query),
+        str(cluster),
+        str(user),
+        str(catalog),
+        str(schema),
+        credentials_hash(password, extra_credential),
+        *[str(e) for e in extra],
+    ]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class CachedResult:
+    """
+    A cache entry: Arrow IPC stream bytes held in memory or memory-mapped from disk, and the
+    response headers describing them (X-Compression*), sent again on every hit
+    """
+
+    def __init__(
+        self,
+        key: str,
+        payload: Union[bytes, pa.Buffer],
+        ttl: float,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        self.key = key
+        self.payload = payload
+        self.headers = headers or {}
+        self.size = len(payload) if isinstance(payload, bytes) else payload.size
+        self.created = time.time()
+        self.expires = time.monotonic() + ttl
+        self.path = None
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() > self.expires
+
+    def chunks(self, chunk_size: int) -> Iterator[bytes]:
+        """Yield the payload in slices so large spilled entries are never copied in full"""
+        for offset in range(0, self.size, chunk_size):
+            if isinstance(self.payload, bytes):
+                yield self.payload[offset : offset + chunk_size]
+            else:
+                length = min(chunk_size, self.size - offset)
+                yield self.payload.slice(offset, length).to_pybytes()
+
+
+class CacheWriter:
+    """
+    A result written to the cache while it is streamed, chunk by chunk (blocking). Chunks are
+    buffered up to the spill threshold, past it they go straight to the spill file, so a large
+    stream never holds more than that in memory. Past max_entry_bytes it is abandoned.
+    """
+
+    def __init__(self, cache: "ResultCache", key: str, ttl: Optional[float]):
+        self.cache = cache
+        self.key = key
+        self.ttl = ttl
+        self.size = 0
+        self.abandoned = False
+        self._chunks = []
+        self._file = None
+        self._path = cache._spill_path(key)
+
+    def write(self, chunk: bytes):
+        if self.abandoned:
+            return
+        self.size += len(chunk)
+        if self.size > self.cache.max_entry_bytes:
+            self.abort()
+            return
+        if self._file is None and self.size <= self.cache.spill_threshold:
+            self._chunks.append(chunk)
+            return
+        if self._file is None:
+            self._file = open(self._path, "wb")
+            for buffered in self._chunks:
+                self._file.write(buffered)
+            self._chunks = []
+        self._file.write(chunk)
+
+    def commit(self, headers: Optional[Dict[str, str]] = None) -> bool:
+        """Store the complete result, returns False if it was abandoned"""
+        if self.abandoned:
+            return False
+        if self._file is None:
+            return self.cache.put(self.key, b"".join(self._chunks), self.ttl, headers)
+        self._file.close()
+        self.cache._insert_spilled(self.key, self._path, self.ttl, headers)
+        return True
+
+    def abort(self):
+        """Drop what was written, e.g. after the query failed"""
+        self.abandoned = True
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            try:
+                os.remove(self._path)
+            except OSError as e:
+                logger.warning(f"Could not remove partial result {self._path}: {e}")
+
+
+class ResultCache:
+    """
+    LRU cache of query results with per-entry TTL.
+
+    Entries up to spill_threshold bytes are kept in memory, bounded by max_memory_bytes in total.
+    Larger entries are written to Arrow IPC files under spill_dir and memory-mapped on access,
+    bounded by max_disk_bytes. Entries bigger than max_entry_bytes are not cached at all.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 512 * 1024 * 1024,
+        max_disk_bytes: int = 4 * 1024 * 1024 * 1024,
+        spill_threshold: int = 16 * 1024 * 1024,
+        max_entry_bytes: int = 1024 * 1024 * 1024,
+        default_ttl: float = 300.0,
+        spill_dir: Optional[str] = None,
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.spill_threshold = spill_threshold
+        self.max_entry_bytes = max_entry_bytes
+        self.default_ttl = default_ttl
+        self.spill_dir = spill_dir or os.path.join(
+            tempfile.gettempdir(), "trino-result-cache"
+        )
+
+        # Spilled files do not survive a restart, their index lives in memory only
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._disk: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self._lock:
+            for entries in (self._memory, self._disk):
+                entry = entries.get(key)
+                if entry is None:
+                    continue
+                if entry.expired:
+                    self._remove(entries, key)
+                    self.expirations += 1
+                    break
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        key: str,
+        payload: bytes,
+        ttl: Optional[float] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> bool:
+        """Store a result and its response headers, returns False if it is too large to cache"""
+        size = len(payload)
+        if size > self.max_entry_bytes:
+            return False
+        ttl = self.default_ttl if ttl is None else ttl
+
+        if size > self.spill_threshold:
+            # Write outside the lock, the file is this entry's alone
+            path = self._spill_path(key)
+            with open(path, "wb") as f:
+                f.write(payload)
+            self._insert_spilled(key, path, ttl, headers)
+            return True
+
+        entry = CachedResult(key, payload, ttl, headers)
+        with self._lock:
+            self._remove(self._memory, key)
+            self._remove(self._disk, key)
+            self._memory[key] = entry
+            self.memory_bytes += size
+            self._evict(self._memory, self.max_memory_bytes)
+        return True
+
+    def writer(self, key: str, ttl: Optional[float] = None) -> CacheWriter:
+        """A CacheWriter storing a result under key once committed"""
+        return CacheWriter(self, key, self.default_ttl if ttl is None else ttl)
+
+    def _spill_path(self, key: str) -> str:
+        # Unique per entry, replacing or evicting an entry never touches the file of another
+        # one written for the same key at the same time
+        return os.path.join(self.spill_dir, f"{key}.{uuid.uuid4().hex}.arrows")
+
+    def _insert_spilled(
+        self, key: str, path: str, ttl: float, headers: Optional[Dict[str, str]] = None
+    ):
+        entry = CachedResult(key, pa.memory_map(path).read_buffer(), ttl, headers)
+        entry.path = path
+        with self._lock:
+            self._remove(self._memory, key)
+            self._remove(self._disk, key)
+            self._disk[key] = entry
+            self.disk_bytes += entry.size
+            self._evict(self._disk, self.max_disk_bytes)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._remove(self._memory, key)
+            self._remove(self._disk, key)
+
+    def clear(self):
+        with self._lock:
+            for entries in (self._memory, self._disk):
+                for key in list(entries):
+                    self._remove(entries, key)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self.disk_bytes,
+            }
+
+    def _evict(self, entries, max_bytes):
+        while entries and (
+            self.memory_bytes if entries is self._memory else self.disk_bytes
+        ) > max_bytes:
+            key = next(iter(entries))
+            self._remove(entries, key)
+            self.evictions += 1
+
+    def _remove(self, entries, key):
+        entry = entries.pop(key, None)
+        if entry is None:
+            return
+        if entry.path is None:
+            self.memory_bytes -= entry.size
+            return
+        self.disk_bytes -= entry.size
+        # Readers still holding the mapping keep working, the file is gone once they finish
+        try:
+            os.remove(entry.path)
+        except OSError as e:
+            logger.warning(f"Could not remove spilled result {entry.path}: {e}")
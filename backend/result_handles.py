@@ -0,0 +1,311 @@
+"""
+Result handles: a query result spilled to a local Arrow IPC file as Trino delivers it, and
+served back a range of record batches at a time. A grid can then scroll through tens of
+millions of rows without re-running the query or holding the whole result in the browser.
+
+The file holds the schema message followed by one message per record batch. A range of
+batches is served as a stream of its own: the schema message, the file bytes of the batches
+and an end-of-stream marker. Nothing has to be decoded on the way.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+import pyarrow as pa
+
+from trino_arrow import IPCChunkSink, create_converter
+
+logger = logging.getLogger(__name__)
+
+# Continuation marker and a zero length, see the Arrow IPC streaming format
+END_OF_STREAM = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+class ResultHandle:
+    """
+    A result being written to, or read back from, its spill file. The pages are fetched and
+    written on an executor thread (fetch_page), readers wait for batches on the IOLoop.
+    """
+
+    def __init__(self, handle_id: str, user: str, query: str, path: str, ttl: float):
+        self.id = handle_id
+        self.user = user
+        self.query = query
+        self.path = path
+        self.ttl = ttl
+        self.created = time.time()
+        self.expires = time.monotonic() + ttl
+        self.running = None
+        self.schema = None
+        self.schema_bytes = b""
+        # (offset in the file, length, rows) per record batch
+        self.batches: List[tuple] = []
+        self.num_rows = 0
+        self.size = 0
+        self.done = False
+        self.truncated = False
+        self.error = None
+        self._file = None
+        self._cursor = None
+        self._release = None
+        self._converter = None
+        self._writer = None
+        self._sink = IPCChunkSink()
+        self._compression = None
+        self._batch_rows = 0
+        self._waiters: List[asyncio.Future] = []
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() > self.expires
+
+    def touch(self):
+        self.expires = time.monotonic() + self.ttl
+
+    def start(self, lease, cursor, running, batch_rows, converter="native", compression=None):
+        """Take over an executed cursor and its connection lease (blocking)"""
+        self.running = running
+        self._release = lease.release
+        self._cursor = cursor
+        self._batch_rows = batch_rows
+        self._compression = compression
+        self._converter = create_converter(converter, cursor.description)
+        self._file = open(self.path, "wb")
+
+    def fetch_page(self, max_bytes: int) -> bool:
+        """
+        Fetch the next page and append it to the file (blocking), False once the result is
+        complete. Past max_bytes the query is cancelled and the result marked truncated.
+        """
+        if self.done:
+            return False
+        try:
+            rows = self._cursor.fetchmany(self._batch_rows)
+            self.running.check()
+            batch = self._converter.convert(rows)
+            if self._writer is None:
+                self.schema = batch.schema
+                self._writer = pa.ipc.new_stream(
+                    self._sink,
+                    self.schema,
+                    options=pa.ipc.IpcWriteOptions(compression=self._compression),
+                )
+                self.schema_bytes = self.schema.serialize().to_pybytes()
+                self._append(self.schema_bytes)
+            if batch.num_rows > 0:
+                self._writer.write_batch(batch)
+                chunk = self._sink.drain()
+                if not self.batches and chunk.startswith(self.schema_bytes):
+                    # The writer puts out the schema with the first batch, it is in already
+                    chunk = chunk[len(self.schema_bytes) :]
+                offset = self.size
+                self._append(chunk)
+                self.batches.append((offset, self.size - offset, batch.num_rows))
+                self.num_rows += batch.num_rows
+        except Exception as e:
+            self.finish(e)
+            raise
+
+        # fetchmany only comes back short once the result is exhausted
+        if len(rows) < self._batch_rows:
+            self.finish()
+        elif self.size > max_bytes:
+            logger.warning(
+                f"Result handle {self.id} truncated at {self.num_rows} rows ({self.size} bytes)"
+            )
+            self.truncated = True
+            self.finish()
+        return not self.done
+
+    def _append(self, data: bytes):
+        self._file.write(data)
+        # Readers open the file on their own, what is recorded must have reached it
+        self._file.flush()
+        self.size += len(data)
+
+    def finish(self, error: Optional[BaseException] = None):
+        """Stop writing: cancel the query if unfinished and return its connection (blocking)"""
+        if self.done:
+            return
+        self.done = True
+        self.error = str(error) if error is not None else None
+        try:
+            complete = self._writer is not None and error is None and not self.truncated
+            if not complete and self._cursor is not None:
+                self._cursor.cancel()
+        except Exception as e:
+            logger.warning(f"Error cancelling query of result handle {self.id}: {e}")
+        finally:
+            if self._file is not None:
+                self._file.close()
+            if self._release is not None:
+                release, self._release = self._release, None
+                release(error)
+
+    def notify(self):
+        """Wake up the readers waiting for batches, on the IOLoop"""
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_for(self, batches: int):
+        """Wait until there are at least batches record batches or the result is complete"""
+        while len(self.batches) < batches and not self.done:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def read(self, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+        """Batches [start, end) as an Arrow IPC stream, in chunks of up to chunk_size"""
+        batches = self.batches[start:end]
+        yield self.schema_bytes
+        if batches:
+            offset = batches[0][0]
+            length = batches[-1][0] + batches[-1][1] - offset
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                while length > 0:
+                    chunk = f.read(min(chunk_size, length))
+                    if not chunk:
+                        raise IOError(f"Spill file of result handle {self.id} is incomplete")
+                    length -= len(chunk)
+                    yield chunk
+        yield END_OF_STREAM
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "schema": (
+                [{"name": field.name, "type": str(field.type)} for field in self.schema]
+                if self.schema is not None
+                else None
+            ),
+            "batches": len(self.batches),
+            "batch_rows": [rows for _, _, rows in self.batches],
+            "rows": self.num_rows,
+            "bytes": self.size,
+            "done": self.done,
+            "truncated": self.truncated,
+            "error": self.error,
+            "expires_in": max(round(self.expires - time.monotonic()), 0),
+        }
+
+
+class ResultHandles:
+    """
+    The result handles of all users, spilled under spill_dir. A handle expires ttl seconds
+    after it was last read. A result stops growing, marked truncated, at max_handle_bytes or
+    when all handles together would exceed max_total_bytes.
+    """
+
+    def __init__(
+        self,
+        max_handle_bytes: int = 1024 * 1024 * 1024,
+        max_total_bytes: int = 8 * 1024 * 1024 * 1024,
+        ttl: float = 900.0,
+        spill_dir: Optional[str] = None,
+    ):
+        self.max_handle_bytes = max_handle_bytes
+        self.max_total_bytes = max_total_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir or os.path.join(
+            tempfile.gettempdir(), "trino-result-handles"
+        )
+
+        # Like the result cache, spill files do not survive a restart
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._handles: Dict[str, ResultHandle] = {}
+        self.created = 0
+        self.expired = 0
+        self.truncated = 0
+
+    def create(self, user: str, query: str) -> ResultHandle:
+        """
+        A new handle for query of user. Its id, which names the spill file, is made up here:
+        the request id comes from the client and must not end up in a path
+        """
+        handle_id = uuid.uuid4().hex
+        handle = ResultHandle(
+            handle_id,
+            user,
+            query,
+            os.path.join(self.spill_dir, f"{handle_id}.arrows"),
+            self.ttl,
+        )
+        with self._lock:
+            if handle_id in self._handles:
+                raise ValueError(f"Result handle {handle_id} already exists")
+            self._handles[handle_id] = handle
+            self.created += 1
+        return handle
+
+    def get(self, handle_id: str) -> Optional[ResultHandle]:
+        with self._lock:
+            handle = self._handles.get(handle_id)
+        if handle is not None:
+            handle.touch()
+        return handle
+
+    def max_bytes(self, handle: ResultHandle) -> int:
+        """How large handle may grow, given the space taken by the others"""
+        with self._lock:
+            others = sum(h.size for h in self._handles.values() if h is not handle)
+        return min(self.max_handle_bytes, self.max_total_bytes - others)
+
+    def fetch_page(self, handle: ResultHandle) -> bool:
+        """handle.fetch_page within the quotas (blocking)"""
+        more = handle.fetch_page(self.max_bytes(handle))
+        if handle.truncated and not more:
+            with self._lock:
+                self.truncated += 1
+        return more
+
+    def remove(self, handle_id: str) -> Optional[ResultHandle]:
+        with self._lock:
+            handle = self._handles.pop(handle_id, None)
+        if handle is not None:
+            self._delete(handle)
+        return handle
+
+    def expire(self) -> List[ResultHandle]:
+        """Remove the expired handles and return them, unfinished ones still need cancelling"""
+        with self._lock:
+            expired = [h for h in self._handles.values() if h.expired]
+            for handle in expired:
+                del self._handles[handle.id]
+            self.expired += len(expired)
+        for handle in expired:
+            logger.info(f"Result handle {handle.id} expired")
+            self._delete(handle)
+        return expired
+
+    def _delete(self, handle: ResultHandle):
+        # Readers still holding the file keep working, it is gone once they finish
+        try:
+            os.remove(handle.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove spill file {handle.path}: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "handles": len(self._handles),
+                "filling": sum(1 for h in self._handles.values() if not h.done),
+                "bytes": sum(h.size for h in self._handles.values()),
+                "created": self.created,
+                "expired": self.expired,
+                "truncated": self.truncated,
+            }
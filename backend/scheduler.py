@@ -0,0 +1,163 @@
+"""
+Fair-share scheduling of blocking work onto bounded thread pools ("lanes")
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+_METADATA_RE = re.compile(r"^\(*\s*(show|describe|explain|use)\b", re.I)
+_SYSTEM_TABLES_RE = re.compile(r"\b(information_schema|system\.(runtime|metadata))\.", re.I)
+_TRAILING_LIMIT_RE = re.compile(r"\blimit\s+(\d+)\s*;?\s*$", re.I)
+
+
+class QueueFullError(Exception):
+    """Raised by submit() when a lane's queue is at capacity, maps to HTTP 429"""
+
+
+def choose_lane(normalized_query: str, limit: Optional[int], small_query_rows: int) -> str:
+    """
+    Route metadata statements and small queries to the "interactive" lane, everything else
+    (potentially large extracts) to the "bulk" lane. limit is the client's row-limit hint, the
+    trailing LIMIT of the statement is used when there is none.
+    """
+    if _METADATA_RE.match(normalized_query) or _SYSTEM_TABLES_RE.search(
+        normalized_query
+    ):
+        return "interactive"
+    if limit is None:
+        match = _TRAILING_LIMIT_RE.search(normalized_query)
+        limit = int(match.group(1)) if match else None
+    if limit is not None and limit <= small_query_rows:
+        return "interactive"
+    return "bulk"
+
+
+class _UserExecutor(Executor):
+    """Executor facade that submits on behalf of one user, for use with run_on_executor"""
+
+    def __init__(self, lane: "FairShareExecutor", user: str):
+        self.lane = lane
+        self.user = user
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        return self.lane.submit_for(self.user, fn, *args, **kwargs)
+
+
+class FairShareExecutor(Executor):
+    """
+    A thread pool with a bounded, per-user fair queue in front of it.
+
+    While all max_workers threads are busy, new work is queued per user and dispatched
+    round-robin across users as threads free up, so one user's burst of extracts cannot starve
+    everybody else. Once max_queue tasks are waiting, submit() raises QueueFullError.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"lane-{name}"
+        )
+        self._lock = threading.Lock()
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._queued = 0
+        self._active = 0
+
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def for_user(self, user: str) -> Executor:
+        return _UserExecutor(self, user)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        return self.submit_for("anonymous", fn, *args, **kwargs)
+
+    def submit_for(self, user: str, fn, *args, **kwargs) -> Future:
+        future = Future()
+        task = (future, fn, args, kwargs, time.monotonic())
+        with self._lock:
+            if self._active < self.max_workers and self._queued == 0:
+                self._active += 1
+            else:
+                if self._queued >= self.max_queue:
+                    self.rejected += 1
+                    raise QueueFullError(
+                        f"Too many queued requests in the {self.name} lane, try again later"
+                    )
+                self._queues.setdefault(user, deque()).append(task)
+                self._queued += 1
+                return future
+        self._start(task)
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            queued = [task for tasks in self._queues.values() for task in tasks]
+            self._queues.clear()
+            self._queued = 0
+        for future, *_ in queued:
+            future.cancel()
+        self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self.completed + self._active
+            return {
+                "workers": self.max_workers,
+                "active": self._active,
+                "queued": self._queued,
+                "queued_users": len(self._queues),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_s": round(self.total_wait / started, 3) if started else 0.0,
+                "max_wait_s": round(self.max_wait, 3),
+            }
+
+    def _start(self, task):
+        future, fn, args, kwargs, enqueued = task
+        waited = time.monotonic() - enqueued
+        with self._lock:
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        self._pool.submit(self._run, future, fn, args, kwargs)
+
+    def _run(self, future, fn, args, kwargs):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self._task_done()
+
+    def _task_done(self):
+        with self._lock:
+            self.completed += 1
+            task = self._next_task()
+            if task is None:
+                self._active -= 1
+        if task is not None:
+            self._start(task)
+
+    def _next_task(self):
+        """Pop the head of the longest-waiting user's queue and rotate that user to the back"""
+        while self._queues:
+            user, tasks = next(iter(self._queues.items()))
+            task = tasks.popleft()
+            self._queued -= 1
+            if tasks:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if not task[0].cancelled():
+                return task
+        return None
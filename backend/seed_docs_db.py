@@ -4,17 +4,45 @@ Seed docs.db from the docs/ folder.
 
 Usage:
     python seed_docs_db.py [--docs-dir docs] [--db docs.db] [--search-yml docs/search.yml]
+                           [--embedder hashing] [--watch] [--interval 2]
 
-The script reads every file in --docs-dir, uses title and summaries from search.yml when
-available, and upserts rows into the `document` table (path, title, summary, content).
+The script syncs the `document` table (path, title, summary, content, content_hash, mtime)
+with the files in --docs-dir, using title and summaries from search.yml when available.
+Only files whose mtime changed are read, and of those only the ones whose content hash or
+metadata changed are written, in one bulk INSERT OR REPLACE. Documents whose file is gone
+are deleted. Changes go into a copy of docs.db which then replaces it, so the server can
+keep reading the old snapshot and reloads the new one without a restart.
+
+The full-text index used by /ai/search and the chunk embeddings used by /ai/semantic_search
+are updated for the changed documents only. --embedder is "hashing[:dim]" (no model
+needed) or "ollama:<model>", e.g. "ollama:nomic-embed-text"; the server embeds queries with
+the same embedder.
+
+--watch keeps running and applies changes every --interval seconds.
 """
 
 import argparse
 import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import duckdb
+import pyarrow as pa
 import yaml
 
+from docs_embeddings import (
+    SemanticIndex,
+    create_embedder,
+    remove_stale_vectors,
+    update_embedding_index,
+)
+from docs_index import has_search_index, update_search_index
+from docs_sections import content_hash
+
+# Threads reading changed files
+READ_WORKERS = 8
+
 
 def load_metadata(search_yml_path: str) -> dict[str, dict]:
     """Return {filename: {title, summary}} from search.yml, or empty dict if file missing."""
@@ -33,59 +61,225 @@ def load_metadata(search_yml_path: str) -> dict[str, dict]:
     return metadata
 
 
-def seed(docs_dir: str, db_path: str, search_yml_path: str) -> None:
+def scan_docs(docs_dir: str, search_yml_path: str) -> dict[str, float]:
+    """Return {filename: mtime} of the documents in docs_dir"""
+    search_yml_filename = os.path.basename(search_yml_path)
+    files = {}
+    with os.scandir(docs_dir) as entries:
+        for entry in entries:
+            if entry.name != search_yml_filename and entry.is_file():
+                files[entry.name] = entry.stat().st_mtime
+    return files
+
+
+def read_doc(filepath: str) -> str:
+    with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def read_stored(db_path: str, embedder_name: str) -> tuple[dict[str, tuple], bool]:
+    """
+    Return ({path: (title, summary, content_hash, mtime)}, whether the indexes need a full
+    build) for the current docs.db, read with a read-only connection so a running server is
+    not disturbed.
+    """
+    if not os.path.isfile(db_path):
+        return {}, True
+    conn = duckdb.connect(db_path, read_only=True)
+    try:
+        columns = {
+            row[0]
+            for row in conn.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = 'document'"
+            ).fetchall()
+        }
+        if not columns:
+            return {}, True
+        # Databases seeded before hashes were stored get every document re-read once
+        hashed = {"content_hash", "mtime"} <= columns
+        stored = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                "SELECT path, title, summary, "
+                + ("content_hash, mtime" if hashed else "NULL, NULL")
+                + " FROM document"
+            ).fetchall()
+        }
+        semantic = SemanticIndex.load(conn, db_path)
+        reindex = (
+            not has_search_index(conn)
+            or semantic is None
+            or semantic.embedder.name != embedder_name
+        )
+        return stored, reindex
+    finally:
+        conn.close()
+
+
+def seed(
+    docs_dir: str, db_path: str, search_yml_path: str, embedder: str = "hashing"
+) -> None:
     metadata = load_metadata(search_yml_path)
+    files = scan_docs(docs_dir, search_yml_path)
+    doc_embedder = create_embedder(embedder)
+    stored, reindex = read_stored(db_path, doc_embedder.name)
+
+    def doc_metadata(filename):
+        meta = metadata.get(filename, {})
+        return meta.get("title", filename), meta.get("summary", "")
 
-    conn = duckdb.connect(db_path)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS document (
-            path    VARCHAR PRIMARY KEY,
-            title   VARCHAR,
-            summary VARCHAR,
-            content VARCHAR
+    # Only files with a new mtime or new metadata can have changed
+    candidates = sorted(
+        filename
+        for filename, mtime in files.items()
+        if filename not in stored
+        or stored[filename][3] != mtime
+        or stored[filename][:2] != doc_metadata(filename)
+    )
+    with ThreadPoolExecutor(READ_WORKERS) as pool:
+        contents = pool.map(
+            read_doc, [os.path.join(docs_dir, filename) for filename in candidates]
         )
-    """)
 
-    inserted = 0
-    updated = 0
+    changed = []
+    touched = []
+    for filename, content in zip(candidates, contents):
+        title, summary = doc_metadata(filename)
+        digest = content_hash(content)
+        if filename in stored and stored[filename][:3] == (title, summary, digest):
+            touched.append(filename)
+        else:
+            changed.append((filename, title, summary, content, digest, files[filename]))
+            print(f"  {'updated' if filename in stored else 'inserted'}: {filename}")
+    deleted = sorted(set(stored) - set(files))
+    for filename in deleted:
+        print(f"  deleted: {filename}")
+
+    if not (changed or touched or deleted or reindex):
+        print(f"\nDone. No changes, {len(files)} unchanged → {db_path}")
+        return
 
-    search_yml_filename = os.path.basename(search_yml_path)
+    # Changes are applied to a copy that replaces docs.db in one rename, so a running
+    # server holding docs.db open never sees a half-written snapshot and picks up the new
+    # one on its next check
+    snapshot_path = f"{db_path}.seeding"
+    remove_snapshot(snapshot_path)
+    try:
+        vectors_file = apply_changes(
+            db_path, snapshot_path, embedder, doc_embedder, files, changed, touched, deleted
+        )
+    except BaseException:
+        # Leave no half-written snapshot behind, the next run starts from docs.db again
+        remove_snapshot(snapshot_path)
+        raise
+    os.replace(snapshot_path, db_path)
+    remove_stale_vectors(db_path, vectors_file)
 
-    for filename in sorted(os.listdir(docs_dir)):
-        if filename == search_yml_filename:
-            continue
-        filepath = os.path.join(docs_dir, filename)
-        if not os.path.isfile(filepath):
-            continue
+    inserted = sum(1 for row in changed if row[0] not in stored)
+    print(
+        f"\nDone. {inserted} inserted, {len(changed) - inserted} updated, "
+        f"{len(deleted)} deleted, {len(files) - len(changed)} unchanged → {db_path}"
+    )
 
-        with open(filepath, "r", encoding="utf-8", errors="replace") as f:
-            content = f.read()
 
-        meta = metadata.get(filename, {})
-        title = meta.get("title", filename)
-        summary = meta.get("summary", "")
+def remove_snapshot(snapshot_path: str) -> None:
+    for path in (snapshot_path, f"{snapshot_path}.wal"):
+        if os.path.exists(path):
+            os.remove(path)
 
-        existing = conn.execute(
-            "SELECT path FROM document WHERE path = ?", [filename]
-        ).fetchone()
 
-        if existing:
+def apply_changes(
+    db_path, snapshot_path, embedder, doc_embedder, files, changed, touched, deleted
+) -> str:
+    """Write the changes to a copy of docs.db at snapshot_path, returns its vectors file"""
+    if os.path.isfile(db_path):
+        shutil.copyfile(db_path, snapshot_path)
+
+    conn = duckdb.connect(snapshot_path)
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS document (
+                path         VARCHAR PRIMARY KEY,
+                title        VARCHAR,
+                summary      VARCHAR,
+                content      VARCHAR,
+                content_hash VARCHAR,
+                mtime        DOUBLE
+            )
+        """)
+        conn.execute("ALTER TABLE document ADD COLUMN IF NOT EXISTS content_hash VARCHAR")
+        conn.execute("ALTER TABLE document ADD COLUMN IF NOT EXISTS mtime DOUBLE")
+
+        if changed:
+            columns = list(zip(*changed))
+            rows = pa.table(
+                {
+                    "path": pa.array(columns[0], pa.string()),
+                    "title": pa.array(columns[1], pa.string()),
+                    "summary": pa.array(columns[2], pa.string()),
+                    "content": pa.array(columns[3], pa.string()),
+                    "content_hash": pa.array(columns[4], pa.string()),
+                    "mtime": pa.array(columns[5], pa.float64()),
+                }
+            )
             conn.execute(
-                "UPDATE document SET title = ?, summary = ?, content = ? WHERE path = ?",
-                [title, summary, content, filename],
+                "INSERT OR REPLACE INTO document (path, title, summary, content, content_hash, mtime)"
+                " SELECT path, title, summary, content, content_hash, mtime FROM rows"
+            )
+        if touched:
+            # Same content under a new mtime, only the mtime is written
+            touched_rows = pa.table(
+                {
+                    "path": pa.array(touched, pa.string()),
+                    "mtime": pa.array([files[f] for f in touched], pa.float64()),
+                }
             )
-            updated += 1
-        else:
             conn.execute(
-                "INSERT INTO document (path, title, summary, content) VALUES (?, ?, ?, ?)",
-                [filename, title, summary, content],
+                "UPDATE document SET mtime = touched_rows.mtime FROM touched_rows"
+                " WHERE document.path = touched_rows.path"
             )
-            inserted += 1
+        if deleted:
+            deleted_rows = pa.table({"path": pa.array(deleted, pa.string())})
+            conn.execute(
+                "DELETE FROM document WHERE path IN (SELECT path FROM deleted_rows)"
+            )
+
+        changed_paths = [row[0] for row in changed] + deleted
+        update_search_index(conn, changed_paths)
+        terms = conn.execute("SELECT count(*) FROM doc_term").fetchone()[0]
+        print(f"  indexed {terms} terms")
+        chunks = update_embedding_index(conn, db_path, doc_embedder, changed_paths)
+        print(f"  embedded {chunks} chunks with {embedder}")
+        return conn.execute("SELECT vectors FROM doc_embedding_meta").fetchone()[0]
+    finally:
+        conn.close()
 
-        print(f"  {'updated' if existing else 'inserted'}: {filename}")
 
-    conn.close()
-    print(f"\nDone. {inserted} inserted, {updated} updated → {db_path}")
+def watch(
+    docs_dir: str,
+    db_path: str,
+    search_yml_path: str,
+    embedder: str,
+    interval: float,
+) -> None:
+    """Seed whenever a file in docs_dir or search.yml is added, removed or modified"""
+    seen = None
+    while True:
+        try:
+            current = scan_docs(docs_dir, search_yml_path)
+            if os.path.isfile(search_yml_path):
+                current[search_yml_path] = os.stat(search_yml_path).st_mtime
+            if current != seen:
+                seed(docs_dir, db_path, search_yml_path, embedder)
+                seen = current
+        except duckdb.IOException as e:
+            # Most likely another process holds docs.db, retry on the next round
+            print(f"Could not update {db_path}: {e}")
+        except Exception as e:
+            # A file gone mid-scan, a broken search.yml, the embedder being down, ... none of
+            # which should end the watch, the next round tries again
+            print(f"Seeding {db_path} failed, retrying: {type(e).__name__}: {e}")
+        time.sleep(interval)
 
 
 if __name__ == "__main__":
@@ -97,6 +291,28 @@ if __name__ == "__main__":
         default="docs/search.yml",
         help="Path to search.yml for summaries",
     )
+    parser.add_argument(
+        "--embedder",
+        default="hashing",
+        help="Embedder for semantic search: hashing[:dim] or ollama:<model>",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and apply changes to the docs directory as they happen",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        help="Seconds between checks for changes in --watch mode",
+    )
     args = parser.parse_args()
 
-    seed(args.docs_dir, args.db, args.search_yml)
+    if args.watch:
+        try:
+            watch(args.docs_dir, args.db, args.search_yml, args.embedder, args.interval)
+        except KeyboardInterrupt:
+            pass
+    else:
+        seed(args.docs_dir, args.db, args.search_yml, args.embedder)
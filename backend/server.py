@@ -1,19 +1,113 @@
+import asyncio
 import json
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+import signal
+import threading
+import time
+import uuid
 
-import duckdb
-import pandas as pd
-import pyarrow as pa
 import tornado.ioloop
+import tornado.iostream
 import tornado.web
-import trino
 from tornado.concurrent import run_on_executor
-from trino.auth import BasicAuthentication
 
 DOCS_DB_PATH = os.environ.get("DOCS_DB_PATH", "docs.db")
+# Default Arrow IPC body compression for /trino: "none", "lz4" or "zstd"
+ARROW_COMPRESSION = os.environ.get("ARROW_COMPRESSION", "none")
+# Rows fetched from Trino per page, i.e. per Arrow record batch or JSON chunk
+ARROW_BATCH_ROWS = int(os.environ.get("ARROW_BATCH_ROWS", "10000"))
+# Trino row to Arrow conversion: "native" (typed, no pandas) or "pandas" (legacy path)
+ARROW_CONVERTER = os.environ.get("ARROW_CONVERTER", "native")
+# Trino connection pool sizing per cluster, timeouts in seconds
+TRINO_POOL_MAX_PER_KEY = int(os.environ.get("TRINO_POOL_MAX_PER_KEY", "8"))
+TRINO_POOL_IDLE_TIMEOUT = float(os.environ.get("TRINO_POOL_IDLE_TIMEOUT", "300"))
+TRINO_POOL_WAIT_TIMEOUT = float(os.environ.get("TRINO_POOL_WAIT_TIMEOUT", "30"))
+# Result cache budgets in MB, TTL in seconds
+RESULT_CACHE_MAX_MEMORY_MB = int(os.environ.get("RESULT_CACHE_MAX_MEMORY_MB", "512"))
+RESULT_CACHE_MAX_DISK_MB = int(os.environ.get("RESULT_CACHE_MAX_DISK_MB", "4096"))
+RESULT_CACHE_SPILL_MB = int(os.environ.get("RESULT_CACHE_SPILL_MB", "16"))
+RESULT_CACHE_MAX_ENTRY_MB = int(os.environ.get("RESULT_CACHE_MAX_ENTRY_MB", "1024"))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", None)
+# Results opened with mode=handle are spilled here and kept until unread for RESULT_HANDLE_TTL
+# seconds. A result stops at RESULT_HANDLE_MAX_MB, all of them together at
+# RESULT_HANDLE_MAX_TOTAL_MB
+RESULT_HANDLE_MAX_MB = int(os.environ.get("RESULT_HANDLE_MAX_MB", "1024"))
+RESULT_HANDLE_MAX_TOTAL_MB = int(os.environ.get("RESULT_HANDLE_MAX_TOTAL_MB", "8192"))
+RESULT_HANDLE_TTL = float(os.environ.get("RESULT_HANDLE_TTL", "900"))
+RESULT_HANDLE_DIR = os.environ.get("RESULT_HANDLE_DIR", None)
+# Identical streamed queries join one execution while its chunks sent so far stay under this
+SINGLE_FLIGHT_STREAM_MB = int(os.environ.get("SINGLE_FLIGHT_STREAM_MB", "16"))
+# SHOW/DESCRIBE are answered from catalog metadata loaded from information_schema, served for
+# METADATA_CACHE_TTL seconds and reloaded in the background every METADATA_REFRESH_INTERVAL
+# seconds while in use. Catalogs with more than METADATA_MAX_COLUMNS columns go to Trino
+METADATA_CACHE_TTL = float(os.environ.get("METADATA_CACHE_TTL", "900"))
+METADATA_REFRESH_INTERVAL = float(os.environ.get("METADATA_REFRESH_INTERVAL", "300"))
+METADATA_MAX_COLUMNS = int(os.environ.get("METADATA_MAX_COLUMNS", "500000"))
+# Executor lanes: interactive (metadata and small queries) and bulk (extracts) per cluster, AI chat
+TRINO_INTERACTIVE_WORKERS = int(os.environ.get("TRINO_INTERACTIVE_WORKERS", "4"))
+TRINO_BULK_WORKERS = int(os.environ.get("TRINO_BULK_WORKERS", "4"))
+TRINO_QUEUE_LIMIT = int(os.environ.get("TRINO_QUEUE_LIMIT", "100"))
+# Clusters kept for requests naming a host rather than an environment, least recently used go
+TRINO_MAX_ADHOC_CLUSTERS = int(os.environ.get("TRINO_MAX_ADHOC_CLUSTERS", "16"))
+AI_WORKERS = int(os.environ.get("AI_WORKERS", "4"))
+AI_QUEUE_LIMIT = int(os.environ.get("AI_QUEUE_LIMIT", "50"))
+# Threads and queue for docs.db queries (/ai/search, /ai/ls, ...), each thread has a cursor
+DOCS_WORKERS = int(os.environ.get("DOCS_WORKERS", "4"))
+DOCS_QUEUE_LIMIT = int(os.environ.get("DOCS_QUEUE_LIMIT", "100"))
+# DuckDB threads and memory limit for docs.db queries, DuckDB's defaults if unset
+DOCS_DUCKDB_THREADS = int(os.environ.get("DOCS_DUCKDB_THREADS", "0"))
+DOCS_DUCKDB_MEMORY_LIMIT = os.environ.get("DOCS_DUCKDB_MEMORY_LIMIT", None)
+# Threads and queue for dashboard aggregations on the server's DuckDB (/duckdb/...)
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", "4"))
+EXTRACT_QUEUE_LIMIT = int(os.environ.get("EXTRACT_QUEUE_LIMIT", "100"))
+# Memory all registered extracts may take, and how long an unused dashboard session is kept
+EXTRACT_MAX_MEMORY_MB = int(os.environ.get("EXTRACT_MAX_MEMORY_MB", "4096"))
+EXTRACT_SESSION_TTL = float(os.environ.get("EXTRACT_SESSION_TTL", "1800"))
+# DuckDB threads and memory limit per dashboard session, DuckDB's defaults if unset
+EXTRACT_DUCKDB_THREADS = int(os.environ.get("EXTRACT_DUCKDB_THREADS", "0"))
+EXTRACT_DUCKDB_MEMORY_LIMIT = os.environ.get("EXTRACT_DUCKDB_MEMORY_LIMIT", None)
+# Streamed /ai/chat completions in progress at once, they run on the IOLoop, not the AI lane
+AI_MAX_STREAMS = int(os.environ.get("AI_MAX_STREAMS", "50"))
+# Model calls per /ai/chat request with agent=true, tool calls the server runs itself in between
+AI_AGENT_MAX_TURNS = int(os.environ.get("AI_AGENT_MAX_TURNS", "8"))
+# Estimated prompt tokens per model call, older tool results and messages are cut or dropped
+# beyond it (0 disables compaction)
+AI_CONTEXT_BUDGET_TOKENS = int(os.environ.get("AI_CONTEXT_BUDGET_TOKENS", "32000"))
+# Most recent messages of a conversation that are never compacted
+AI_CONTEXT_KEEP_RECENT = int(os.environ.get("AI_CONTEXT_KEEP_RECENT", "6"))
+# Length older tool results and messages are cut to when over budget
+AI_CONTEXT_MAX_OLD_CHARS = int(os.environ.get("AI_CONTEXT_MAX_OLD_CHARS", "2000"))
+# Completions kept by the LLM response cache, 0 disables it
+LLM_CACHE_ENTRIES = int(os.environ.get("LLM_CACHE_ENTRIES", "0"))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", "3600"))
+# Also cache completions sampled with temperature > 0, i.e. replay one of the possible answers
+LLM_CACHE_ALLOW_SAMPLED = os.environ.get("LLM_CACHE_ALLOW_SAMPLED", "false").lower() == "true"
+# Comma-separated Ollama models to load at startup, so the first chat skips the model load
+OLLAMA_PRELOAD_MODELS = [
+    m.strip() for m in os.environ.get("OLLAMA_PRELOAD_MODELS", "").split(",") if m.strip()
+]
+# Queries limited to at most this many rows go to the interactive lane
+SMALL_QUERY_ROWS = int(os.environ.get("SMALL_QUERY_ROWS", "10000"))
+# Default per-query timeout for /trino, 0 disables it
+TRINO_QUERY_TIMEOUT_MS = int(os.environ.get("TRINO_QUERY_TIMEOUT_MS", "0"))
+# Most queries accepted by one /trino/batch request
+TRINO_BATCH_MAX_QUERIES = int(os.environ.get("TRINO_BATCH_MAX_QUERIES", "50"))
+# BM25 candidates /ai/search runs its regex over
+SEARCH_CANDIDATES = int(os.environ.get("SEARCH_CANDIDATES", "1000"))
+# Most chunks one /ai/semantic_search request returns
+SEMANTIC_SEARCH_MAX_K = int(os.environ.get("SEMANTIC_SEARCH_MAX_K", "50"))
+# Most characters of a document /ai/retrieve_doc returns at once, ranges and sections included
+RETRIEVE_DOC_MAX_CHARS = int(os.environ.get("RETRIEVE_DOC_MAX_CHARS", "20000"))
+# Parsed documents kept in memory for /ai/retrieve_doc
+DOC_CACHE_ENTRIES = int(os.environ.get("DOC_CACHE_ENTRIES", "256"))
+# Seconds between checks for a re-seeded docs.db, 0 disables them (POST /ai/docs/reload still works)
+DOCS_RELOAD_INTERVAL = float(os.environ.get("DOCS_RELOAD_INTERVAL", "5"))
+# Files per /ai/ls page, also the largest page a request can ask for
+LS_MAX_RESULTS = int(os.environ.get("LS_MAX_RESULTS", "200"))
+# Size of the slices cached results are written to the client in
+CACHE_WRITE_CHUNK_BYTES = 1024 * 1024
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -21,132 +115,470 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-from llm_factory import UniversalLLM, get_available_functions
+from clusters import ClusterRegistry
+import ai_tools
+from agent import run_agent
+from ai_tools import ServerTools, ToolError
+from docs_sections import DocumentCache
+from docs_store import DocsStore
+from extracts import ExtractEngine, encode_rows
+from compression import GZipWithStats, compression_headers, parse_ipc_compression
+from llm_cache import LLMResponseCache
+from llm_context import ContextCompactor
+from llm_factory import LLMFactory, UniversalLLM, get_available_functions
+from metadata_cache import (
+    RESULT_COLUMNS,
+    MetadataCache,
+    changes_metadata,
+    encode_arrow,
+    parse_metadata_query,
+)
+from query_registry import QueryCancelledError, QueryRegistry
+from result_cache import ResultCache, cache_key, is_cacheable, normalize_sql
+from result_handles import ResultHandles
+from scheduler import FairShareExecutor, QueueFullError, choose_lane
+from single_flight import SingleFlight
+from trino_arrow import ArrowBatchStream, encode_frame_header
+from trino_json import FORMATS as JSON_FORMATS, JsonBatchStream
+
+docs_store = DocsStore(
+    DOCS_DB_PATH,
+    pool_size=DOCS_WORKERS,
+    threads=DOCS_DUCKDB_THREADS,
+    memory_limit=DOCS_DUCKDB_MEMORY_LIMIT,
+)
+doc_cache = DocumentCache(DOC_CACHE_ENTRIES)
 
-docs_conn = duckdb.connect(DOCS_DB_PATH, read_only=True)
+# Load UI config from config.json (once at startup)
+_config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+try:
+    with open(_config_path, "r") as f:
+        _ui_config = json.load(f)
+    logger.info(f"Loaded UI config from {_config_path}")
+except Exception as e:
+    logger.warning(f"Could not load config.json ({e}), using defaults")
+    _ui_config = {
+        "disclaimer": "DISCLAIMER — AI can make mistakes, always check the results.",
+        "environments": [{"id": "local", "name": "Local", "cluster": "local"}],
+        "defaultEnvironment": "local",
+        "models": [{"id": "gpt-oss", "name": "gpt-oss"}],
+        "defaultModel": "gpt-oss",
+        "serverAggregation": False,
+    }
 
+# Environment variables provide the defaults, clusters in config.json can override them
+clusters = ClusterRegistry(
+    _ui_config,
+    {
+        "max_connections_per_key": TRINO_POOL_MAX_PER_KEY,
+        "pool_idle_timeout": TRINO_POOL_IDLE_TIMEOUT,
+        "pool_wait_timeout": TRINO_POOL_WAIT_TIMEOUT,
+        "interactive_workers": TRINO_INTERACTIVE_WORKERS,
+        "bulk_workers": TRINO_BULK_WORKERS,
+        "queue_limit": TRINO_QUEUE_LIMIT,
+    },
+    max_adhoc=TRINO_MAX_ADHOC_CLUSTERS,
+)
 
-def convertToRows(cols, tuples):
-    rows = []
-    for t in tuples:
-        row = {}
-        for i in range(len(cols)):
-            if isinstance(t[i], datetime):
-                row[cols[i]] = t[i].isoformat()
-            else:
-                row[cols[i]] = t[i]
-        rows.append(row)
-    return rows
-
-
-def rename_duplicate_columns(df):
-    cols = {}
-    newcols = []
-    for i, col in enumerate(df.columns):
-        if col in cols:
-            newcols.append(col + "_" + str(cols[col] + 1))
-            cols[col] += 1
+running_queries = QueryRegistry()
+
+# Identical /trino queries in flight at the same time share one execution
+single_flight = SingleFlight(max_join_bytes=SINGLE_FLIGHT_STREAM_MB * 1024 * 1024)
+
+ai_lane = FairShareExecutor("ai", AI_WORKERS, AI_QUEUE_LIMIT)
+
+# docs.db queries run here rather than on the IOLoop, a slow regex scan must not stall it
+docs_lane = FairShareExecutor("docs", DOCS_WORKERS, DOCS_QUEUE_LIMIT)
+
+extract_lane = FairShareExecutor("extracts", EXTRACT_WORKERS, EXTRACT_QUEUE_LIMIT)
+
+extract_engine = ExtractEngine(
+    max_bytes=EXTRACT_MAX_MEMORY_MB * 1024 * 1024,
+    ttl=EXTRACT_SESSION_TTL,
+    threads=EXTRACT_DUCKDB_THREADS,
+    memory_limit=EXTRACT_DUCKDB_MEMORY_LIMIT,
+)
+
+context_compactor = ContextCompactor(
+    AI_CONTEXT_BUDGET_TOKENS, AI_CONTEXT_KEEP_RECENT, AI_CONTEXT_MAX_OLD_CHARS
+)
+
+llm_cache = (
+    LLMResponseCache(LLM_CACHE_ENTRIES, LLM_CACHE_TTL, LLM_CACHE_ALLOW_SAMPLED)
+    if LLM_CACHE_ENTRIES > 0
+    else None
+)
+
+result_cache = ResultCache(
+    max_memory_bytes=RESULT_CACHE_MAX_MEMORY_MB * 1024 * 1024,
+    max_disk_bytes=RESULT_CACHE_MAX_DISK_MB * 1024 * 1024,
+    spill_threshold=RESULT_CACHE_SPILL_MB * 1024 * 1024,
+    max_entry_bytes=RESULT_CACHE_MAX_ENTRY_MB * 1024 * 1024,
+    default_ttl=RESULT_CACHE_TTL,
+    spill_dir=RESULT_CACHE_DIR,
+)
+
+result_handles = ResultHandles(
+    max_handle_bytes=RESULT_HANDLE_MAX_MB * 1024 * 1024,
+    max_total_bytes=RESULT_HANDLE_MAX_TOTAL_MB * 1024 * 1024,
+    ttl=RESULT_HANDLE_TTL,
+    spill_dir=RESULT_HANDLE_DIR,
+)
+
+metadata_cache = MetadataCache(
+    ttl=METADATA_CACHE_TTL,
+    refresh_interval=METADATA_REFRESH_INTERVAL,
+    max_columns=METADATA_MAX_COLUMNS,
+)
+
+
+def fetch_arrow(
+    cluster, connection, query, running, converter=ARROW_CONVERTER, compression=None
+):
+    """
+    Run query on cluster and return the whole result as Arrow IPC bytes (blocking), along with
+    the X-Compression* headers describing it when compressed
+    """
+    lease, cur = cluster.execute(*connection, query, running)
+    try:
+        stream = ArrowBatchStream(
+            cur, ARROW_BATCH_ROWS, converter, compression=compression
+        )
+        arrow_bytes = stream.read_all()
+        # A cancelled cursor just stops returning rows, don't pass a partial result off
+        running.check()
+    except Exception as e:
+        lease.release(e)
+        raise
+    lease.release()
+    return arrow_bytes, stream_compression_headers(stream)
+
+
+async def fill_result_handle(handle, executor):
+    """Fetch the remaining pages of a result handle on its lane, after POST /trino returned"""
+    loop = tornado.ioloop.IOLoop.current()
+    try:
+        more = not handle.done
+        while more:
+            more = await loop.run_in_executor(executor, result_handles.fetch_page, handle)
+            handle.notify()
+        logger.info(
+            f"Result handle {handle.id} complete: {handle.num_rows} rows in"
+            f" {len(handle.batches)} batches, {handle.size} bytes"
+        )
+    except Exception as e:
+        logger.error(f"Result handle {handle.id} failed: {e}")
+        # A rejected page never got to fetch_page, which finishes the handle on errors
+        await loop.run_in_executor(None, handle.finish, e)
+    finally:
+        handle.notify()
+        running_queries.unregister(handle.running)
+
+
+def expire_result_handles():
+    for handle in result_handles.expire():
+        if not handle.done:
+            tornado.ioloop.IOLoop.current().run_in_executor(
+                None, handle.running.cancel, "result handle expired", 410
+            )
+
+
+def run_metadata_query(cluster, connection, running):
+    """The rows of a query on cluster (blocking), for metadata_cache.load"""
+
+    def run(query):
+        lease, cur = cluster.execute(*connection, query, running)
+        try:
+            rows = cur.fetchall()
+            running.check()
+        except Exception as e:
+            lease.release(e)
+            raise
+        lease.release()
+        return rows
+
+    return run
+
+
+async def load_metadata(scope, catalog=None):
+    """
+    (Re)load the catalog list (catalog None) or a catalog of scope on the cluster's bulk lane,
+    joining a load of the same already in flight
+    """
+    running = running_queries.register(
+        None, scope.user, f"-- metadata of {catalog or 'all catalogs'}"
+    )
+
+    async def execute(shared):
+        return await tornado.ioloop.IOLoop.current().run_in_executor(
+            # information_schema of a large catalog is a bulk read
+            scope.cluster.lanes["bulk"].for_user(scope.user),
+            metadata_cache.load,
+            scope,
+            catalog,
+            run_metadata_query(scope.cluster, scope.connection, shared),
+        )
+
+    try:
+        entry, _ = await single_flight.run(
+            f"metadata\0{scope.key}\0{catalog or ''}", running, execute
+        )
+        return entry
+    finally:
+        running_queries.unregister(running)
+
+
+async def metadata_for(scope, catalog=None):
+    """The metadata entry of catalog, loaded unless fresh, None for a catalog not listed"""
+    if catalog is not None:
+        catalogs = metadata_cache.get(scope, None) or await load_metadata(scope)
+        if catalog not in catalogs.value:
+            return None
+    return metadata_cache.get(scope, catalog) or await load_metadata(scope, catalog)
+
+
+async def prefetch_metadata(scope, catalog=None, refresh=False):
+    try:
+        if refresh:
+            await load_metadata(scope, catalog)
         else:
-            newcols.append(col)
-            cols[col] = 1
+            await metadata_for(scope, catalog)
+    except Exception as e:
+        logger.warning(f"Could not load metadata of {catalog or 'all catalogs'}: {e}")
 
-    df.columns = newcols
 
-    return df
+def refresh_metadata():
+    for scope, catalog in metadata_cache.due():
+        tornado.ioloop.IOLoop.current().spawn_callback(
+            prefetch_metadata, scope, catalog, True
+        )
 
 
-def sanitize_df(df):
-    df = rename_duplicate_columns(df)
-    print(df)
+def answer_from_metadata(cluster, connection, query, compression=None, io_loop=None):
+    """
+    Arrow IPC bytes answering a SHOW/DESCRIBE query from metadata_cache, None if Trino has to.
+    Metadata not loaded yet is loaded in the background, on io_loop when called off the IOLoop.
+    """
+    request = parse_metadata_query(query, connection[2], connection[3])
+    if request is None:
+        return None
+    scope = metadata_cache.scope(cluster, connection)
+    rows, loaded = metadata_cache.lookup(scope, request)
+    if not loaded:
+        (io_loop or tornado.ioloop.IOLoop.current()).add_callback(
+            prefetch_metadata, scope, request.catalog
+        )
+    if rows is None:
+        return None
+    return encode_arrow(RESULT_COLUMNS[request.kind], rows, compression)
 
-    if len(df) <= 0:
-        return df
 
-    # Force object types to string, if they are not already
-    ts = df.dtypes
-    for k in ts.keys():
-        if ts[k] == "object" and not isinstance(df[k][0], str):
-            print(f"Forcing column {k} to string")
-            df[k] = df[k].astype(str)
+def stream_compression_headers(stream):
+    if stream.compression is None:
+        return {}
+    return compression_headers(
+        stream.compression,
+        stream.raw_bytes,
+        stream.encoded_bytes,
+        stream.write_seconds,
+    )
 
-    return df
+
+def parse_extra_credentials(extraCredentials):
+    if extraCredentials is None:
+        return None
+    return [(cred[0], cred[1]) for cred in extraCredentials]
 
 
 class TrinoArrowHandler(tornado.web.RequestHandler):
-    executor = ThreadPoolExecutor(max_workers=4)
+    # Replaced per request by the cluster lane picked for the query, on behalf of the user
+    executor = None
 
     def set_default_headers(self):
         # Allow CORS if needed
         self.set_header("Access-Control-Allow-Origin", "*")
         self.set_header("Access-Control-Allow-Headers", "Content-Type")
         self.set_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+        self.set_header(
+            "Access-Control-Expose-Headers",
+            "X-Cache, X-Cache-Age, X-Request-Id, "
+            "X-Compression, X-Compression-Ratio, X-Compression-Time-Ms",
+        )
 
     def options(self):
         # Handle preflight requests
         self.set_status(204)
         self.finish()
 
+    def initialize(self):
+        self.running = None
+        self.timeout_handle = None
+
+    def on_connection_close(self):
+        # Nobody is left to read the result, free the executor slot and the Trino resources
+        self.cancel_running("client disconnected")
+
+    def cancel_running(self, reason, status=409):
+        if self.running is not None and not self.running.cancelled:
+            tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.running.cancel, reason, status
+            )
+
     @run_on_executor
     def execute_query_arrow(
-        self, host, port, user, password, catalog, schema, query, extraCredentials
+        self,
+        cluster,
+        connection,
+        query,
+        running,
+        converter=ARROW_CONVERTER,
+        compression=None,
     ):
-        """Execute query and return arrow bytes - runs on executor thread"""
-        conn = trino.dbapi.connect(
-            host=host,
-            port=port,
-            user=user,
-            auth=BasicAuthentication(user, password)
-            if password and password != ""
-            else None,
-            catalog=catalog,
-            schema=schema,
-            extra_credential=extraCredentials,
-        )
+        """Execute query and return arrow bytes and headers - runs on executor thread"""
+        return fetch_arrow(cluster, connection, query, running, converter, compression)
 
-        df = sanitize_df(pd.read_sql(query, conn))
+    @run_on_executor
+    def open_arrow_stream(
+        self,
+        cluster,
+        connection,
+        query,
+        running,
+        converter=ARROW_CONVERTER,
+        compression=None,
+    ):
+        """Start query and return an ArrowBatchStream over its cursor - runs on executor thread"""
+        lease, cur = cluster.execute(*connection, query, running)
+        return ArrowBatchStream(
+            cur,
+            ARROW_BATCH_ROWS,
+            converter,
+            on_close=lease.release,
+            compression=compression,
+        )
 
-        # Convert DataFrame to Arrow Table
-        table = pa.Table.from_pandas(df)
-        print(f"Arrow schema {table.schema}")
+    @run_on_executor
+    def open_result_handle(
+        self, handle, cluster, connection, query, running, converter, compression
+    ):
+        """Start query and spill its first page to handle - runs on executor thread"""
+        lease, cur = cluster.execute(*connection, query, running)
+        try:
+            handle.start(lease, cur, running, ARROW_BATCH_ROWS, converter, compression)
+        except Exception as e:
+            lease.release(e)
+            raise
+        result_handles.fetch_page(handle)
 
-        # Serialize to Arrow IPC format
-        sink = pa.BufferOutputStream()
-        writer = pa.ipc.new_stream(sink, table.schema)
-        writer.write_table(table)
-        writer.close()
-        arrow_bytes = sink.getvalue().to_pybytes()
+    @run_on_executor
+    def open_json_stream(self, cluster, connection, query, running, format):
+        """Start query and return a JsonBatchStream over its cursor - runs on executor thread"""
+        lease, cur = cluster.execute(*connection, query, running)
+        return JsonBatchStream(
+            cur, ARROW_BATCH_ROWS, format, query, on_close=lease.release
+        )
 
-        return arrow_bytes
+    @run_on_executor
+    def next_stream_chunk(self, stream, running, cache_writer=None):
+        """Fetch the next page and return its encoded bytes - runs on executor thread"""
+        chunk = stream.next_chunk()
+        running.check()
+        if cache_writer is not None and chunk is not None:
+            cache_writer.write(chunk)
+        return chunk
 
     @run_on_executor
-    def execute_query_json(
-        self, host, port, user, password, catalog, schema, query, extraCredentials
-    ):
-        """Execute query and return JSON data - runs on executor thread"""
-        conn = trino.dbapi.connect(
-            host=host,
-            port=port,
-            user=user,
-            auth=BasicAuthentication(user, password)
-            if password and password != ""
-            else None,
-            catalog=catalog,
-            schema=schema,
-            extra_credential=extraCredentials,
-        )
+    def close_stream(self, stream, error=None):
+        """Cancel the query if unfinished and return its connection - runs on executor thread"""
+        stream.close(error)
+
+    def stream_producer(self, open_stream, compression=None, key=None, ttl=None):
+        """
+        produce(running, push) for single_flight.stream: opens the stream with
+        open_stream(running) and pushes each chunk as soon as its Trino page arrives
+        """
+
+        async def produce(running, push):
+            stream = await open_stream(running)
+            # The chunks go to the result cache as they pass, spilled to disk past the spill
+            # threshold, until the result gets too large
+            cache_writer = result_cache.writer(key, ttl) if key is not None else None
+            try:
+                chunk = await self.next_stream_chunk(stream, running, cache_writer)
+                while chunk is not None:
+                    await push(chunk)
+                    chunk = await self.next_stream_chunk(stream, running, cache_writer)
+            except Exception as e:
+                if cache_writer is not None:
+                    await self.commit_cache_writer(cache_writer, abort=True)
+                await self.close_stream(stream, e)
+                raise
+            await self.close_stream(stream)
+
+            headers = {}
+            if compression is not None:
+                headers = stream_compression_headers(stream)
+                # Headers went out with the first batch, the totals can only be logged
+                logger.info(f"Streamed {running.request_id} with {compression}: {headers}")
+            if cache_writer is not None:
+                # Hits get the compression totals that were only known once the stream ended
+                await self.commit_cache_writer(cache_writer, headers=headers)
+
+        return produce
+
+    async def stream_query(self, chunks, content_type="application/octet-stream"):
+        """Write each chunk of a single_flight.stream to the client as soon as it comes"""
+        self.set_header("Content-Type", content_type)
+        try:
+            async for chunk in chunks:
+                self.write(chunk)
+                await self.flush()
+        finally:
+            await chunks.aclose()
 
-        cur = conn.cursor()
-        cur.execute(query)
-        columns = [cd.name for cd in cur.description]
+    @run_on_executor
+    def commit_cache_writer(self, cache_writer, abort=False, headers=None):
+        """Store a streamed result in the cache, or drop it - runs on executor thread"""
+        if abort:
+            cache_writer.abort()
+        else:
+            cache_writer.commit(headers)
 
-        return {
-            "columns": columns,
-            "types": [cd.type_code for cd in cur.description],
-            "query": query,
-            "rows": convertToRows(columns, cur.fetchall()),
-            "error": None,
-            "connectionTested": True,
-        }
+    @run_on_executor
+    def cache_result(self, key, arrow_bytes, ttl, headers=None):
+        """Store a result in the cache, may spill to disk - runs on executor thread"""
+        result_cache.put(key, arrow_bytes, ttl, headers)
+
+    async def write_cached_result(self, entry):
+        self.set_header("Content-Type", "application/octet-stream")
+        self.set_header("X-Cache", "HIT")
+        self.set_header("X-Cache-Age", str(int(entry.age)))
+        for name, value in entry.headers.items():
+            self.set_header(name, value)
+        for chunk in entry.chunks(CACHE_WRITE_CHUNK_BYTES):
+            self.write(chunk)
+            await self.flush()
+
+    async def open_handle(self, cluster, connection, query, converter, compression):
+        """
+        Spill the result to a result handle and answer with its description once the schema
+        is known, the remaining pages are fetched in the background
+        """
+        handle = result_handles.create(self.running.user, query)
+        try:
+            await self.open_result_handle(
+                handle, cluster, connection, query, self.running, converter, compression
+            )
+        except Exception:
+            result_handles.remove(handle.id)
+            raise
+        # The query outlives the request now, fill_result_handle unregisters it
+        self.running = None
+        tornado.ioloop.IOLoop.current().spawn_callback(
+            fill_result_handle, handle, self.executor
+        )
+        self.set_header("Content-Type", "application/json")
+        self.write(handle.describe())
 
     async def post(self):
         try:
@@ -158,60 +590,882 @@ class TrinoArrowHandler(tornado.web.RequestHandler):
             if not query:
                 raise ValueError("Missing required 'query' parameter")
 
-            # Optional connection parameters with defaults
-            host = request_data.get("host", "localhost")
-            port = request_data.get("port", 8080)
+            # Optional connection parameters with defaults, catalog and schema default per cluster
+            environment = request_data.get("environment", None)
+            host = request_data.get("host", None)
+            port = request_data.get("port", None)
             user = request_data.get("user", "admin")
             password = request_data.get("password", None)
-            catalog = request_data.get("catalog", "default")
-            schema = request_data.get("schema", "default")
+            catalog = request_data.get("catalog", None)
+            schema = request_data.get("schema", None)
             format = request_data.get("format", "arrow")
+            stream = request_data.get("stream", False)
+            converter = request_data.get("converter", ARROW_CONVERTER)
+            compression = parse_ipc_compression(
+                request_data.get("compression", ARROW_COMPRESSION)
+            )
+            use_cache = request_data.get("cache", True)
+            refresh = request_data.get("refresh", False)
+            cache_ttl = request_data.get("cache_ttl", None)
+            timeout_ms = request_data.get("timeout_ms", TRINO_QUERY_TIMEOUT_MS)
 
-            extraCredentials = request_data.get("extraCredentials", None)
-            tuplifiedExtraCredentials = None
-            if extraCredentials is not None:
-                tuplifiedExtraCredentials = []
-                for cred in extraCredentials:
-                    tuplifiedExtraCredentials.append((cred[0], cred[1]))
+            tuplifiedExtraCredentials = parse_extra_credentials(
+                request_data.get("extraCredentials", None)
+            )
 
-            logger.info(f"Serving query: {query} from user {user} with format {format}")
+            cluster = clusters.resolve(environment, host, port)
+            connection = (
+                user,
+                password,
+                catalog or cluster.catalog,
+                schema or cluster.schema,
+                tuplifiedExtraCredentials,
+            )
 
+            self.running = running_queries.register(
+                request_data.get("request_id"), user, query
+            )
+            self.set_header("X-Request-Id", self.running.request_id)
+            if timeout_ms:
+                self.timeout_handle = tornado.ioloop.IOLoop.current().call_later(
+                    timeout_ms / 1000,
+                    self.cancel_running,
+                    f"timed out after {timeout_ms} ms",
+                    504,
+                )
+
+            lane = request_data.get("lane") or choose_lane(
+                normalize_sql(query), request_data.get("limit"), SMALL_QUERY_ROWS
+            )
+            if lane not in cluster.lanes:
+                raise ValueError(
+                    f"Unknown lane: {lane}. Supported lanes: {', '.join(cluster.lanes)}"
+                )
+            self.executor = cluster.lanes[lane].for_user(user)
+
+            logger.info(
+                f"Serving query {self.running.request_id}: {query} from user {user} with format {format} on {cluster.id}/{lane}"
+            )
+
+            if request_data.get("mode") == "handle":
+                if format != "arrow":
+                    raise ValueError("Result handles are only available with format arrow")
+                await self.open_handle(cluster, connection, query, converter, compression)
+                return
+
+            key = None
+            if format == "arrow" and compression is not None:
+                self.set_header("X-Compression", compression)
+            if format == "arrow" and use_cache and not refresh:
+                arrow_bytes = answer_from_metadata(cluster, connection, query, compression)
+                if arrow_bytes is not None:
+                    self.set_header("Content-Type", "application/octet-stream")
+                    self.set_header("X-Cache", "METADATA")
+                    self.write(arrow_bytes)
+                    return
             if format == "arrow":
-                arrow_bytes = await self.execute_query_arrow(
-                    host,
-                    port,
-                    user,
-                    password,
-                    catalog,
-                    schema,
-                    query,
-                    tuplifiedExtraCredentials,
+                if use_cache and is_cacheable(query):
+                    key = cache_key(
+                        query, cluster.id, *connection, converter, compression
+                    )
+                    entry = None if refresh else result_cache.get(key)
+                    if entry is not None:
+                        logger.info(f"Serving cached result ({int(entry.age)}s old)")
+                        await self.write_cached_result(entry)
+                        return
+                    self.set_header("X-Cache", "REFRESH" if refresh else "MISS")
+                else:
+                    self.set_header("X-Cache", "BYPASS")
+
+            if format == "arrow" and stream:
+                produce = self.stream_producer(
+                    lambda running: self.open_arrow_stream(
+                        cluster, connection, query, running, converter, compression
+                    ),
+                    compression,
+                    key,
+                    cache_ttl,
+                )
+                chunks, shared = single_flight.stream(
+                    key, self.running, produce, join=not refresh
+                )
+                if shared:
+                    self.set_header("X-Cache", "SHARED")
+                await self.stream_query(chunks)
+            elif format == "arrow" and key is not None:
+
+                async def execute(running):
+                    result = await self.execute_query_arrow(
+                        cluster, connection, query, running, converter, compression
+                    )
+                    await self.cache_result(key, result[0], cache_ttl, result[1])
+                    return result
+
+                (arrow_bytes, headers), shared = await single_flight.run(
+                    key, self.running, execute, join=not refresh
+                )
+                if shared:
+                    self.set_header("X-Cache", "SHARED")
+
+                self.set_header("Content-Type", "application/octet-stream")
+                for name, value in headers.items():
+                    self.set_header(name, value)
+                self.write(arrow_bytes)
+            elif format == "arrow":
+                arrow_bytes, headers = await self.execute_query_arrow(
+                    cluster, connection, query, self.running, converter, compression
                 )
 
                 # Set appropriate headers and return the Arrow IPC bytes
                 self.set_header("Content-Type", "application/octet-stream")
+                for name, value in headers.items():
+                    self.set_header(name, value)
                 self.write(arrow_bytes)
-            elif format == "json":
-                json_data = await self.execute_query_json(
-                    host,
-                    port,
+            elif format in JSON_FORMATS:
+                # JSON is always streamed, one page of rows at a time. It names the query as
+                # sent, only requests sending the very same text share an execution
+                json_key = None
+                if use_cache and is_cacheable(query):
+                    json_key = cache_key(query, cluster.id, *connection, format, query)
+                produce = self.stream_producer(
+                    lambda running: self.open_json_stream(
+                        cluster, connection, query, running, format
+                    )
+                )
+                chunks, _ = single_flight.stream(
+                    json_key, self.running, produce, join=not refresh
+                )
+                await self.stream_query(chunks, "application/json")
+            else:
+                raise ValueError(
+                    f"Unsupported format: {format}. Supported formats: arrow, {', '.join(JSON_FORMATS)}"
+                )
+
+            if changes_metadata(query):
+                metadata_cache.invalidate(cluster.id)
+
+        except QueueFullError as e:
+            logger.warning(f"Rejected query: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
+        except Exception as e:
+            logger.error(e)
+            if self._headers_written:
+                # Part of an Arrow stream already went out, all we can do is drop the connection
+                self.request.connection.close()
+                return
+            self.set_status(e.status if isinstance(e, QueryCancelledError) else 500)
+            self.write({"error": str(e)})
+        finally:
+            if self.timeout_handle is not None:
+                tornado.ioloop.IOLoop.current().remove_timeout(self.timeout_handle)
+            if self.running is not None:
+                running_queries.unregister(self.running)
+
+
+class TrinoBatchHandler(tornado.web.RequestHandler):
+    """
+    Runs a batch of independent queries concurrently and streams each result back as soon as
+    it completes, so a dashboard loads in the time of its slowest query rather than the sum.
+
+    Request: the connection parameters of /trino plus
+        "queries": [{"id": "orders", "query": "SELECT ...", "catalog"?, "schema"?, "limit"?,
+                     "lane"?, "cache"?, "refresh"?, "cache_ttl"?, "timeout_ms"?}, ...]
+
+    Response: one frame per query in completion order, see encode_frame_header(). The header
+    has the query id, its HTTP-style status, error, elapsed_ms, cache status and request_id
+    (the batch request id and the query id joined by ":", usable with /trino/cancel).
+    """
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "Content-Type")
+        self.set_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+        self.set_header("Access-Control-Expose-Headers", "X-Request-Id")
+
+    def options(self):
+        self.set_status(204)
+        self.finish()
+
+    def initialize(self):
+        self.running = []
+
+    def on_connection_close(self):
+        for running in self.running:
+            self.cancel_running(running, "client disconnected")
+
+    def cancel_running(self, running, reason, status=409):
+        if not running.cancelled:
+            tornado.ioloop.IOLoop.current().run_in_executor(
+                None, running.cancel, reason, status
+            )
+
+    async def run_query(self, cluster, connection, spec, running, defaults):
+        """Run one query of the batch on its lane, returns (frame header, payload)"""
+        loop = tornado.ioloop.IOLoop.current()
+        started = time.monotonic()
+        header = {"id": spec.get("id"), "request_id": running.request_id}
+        payload = b""
+        timeout_handle = None
+        try:
+            query = running.query
+            timeout_ms = spec.get("timeout_ms", defaults["timeout_ms"])
+            if timeout_ms:
+                timeout_handle = loop.call_later(
+                    timeout_ms / 1000,
+                    self.cancel_running,
+                    running,
+                    f"timed out after {timeout_ms} ms",
+                    504,
+                )
+
+            lane = spec.get("lane") or choose_lane(
+                normalize_sql(query), spec.get("limit"), SMALL_QUERY_ROWS
+            )
+            if lane not in cluster.lanes:
+                raise ValueError(
+                    f"Unknown lane: {lane}. Supported lanes: {', '.join(cluster.lanes)}"
+                )
+            executor = cluster.lanes[lane].for_user(running.user)
+
+            key = None
+            header["cache"] = "BYPASS"
+            if spec.get("cache", True) and is_cacheable(query):
+                key = cache_key(
+                    query,
+                    cluster.id,
+                    *connection,
+                    defaults["converter"],
+                    defaults["compression"],
+                )
+                refresh = spec.get("refresh", False)
+                entry = None if refresh else result_cache.get(key)
+                if entry is not None:
+                    header.update(cache="HIT", cache_age=int(entry.age), status=200)
+                    header.update(
+                        {
+                            name[2:].lower().replace("-", "_"): value
+                            for name, value in entry.headers.items()
+                        }
+                    )
+                    return header, entry
+                header["cache"] = "REFRESH" if refresh else "MISS"
+
+            async def execute(running):
+                result = await loop.run_in_executor(
+                    executor,
+                    fetch_arrow,
+                    cluster,
+                    connection,
+                    query,
+                    running,
+                    defaults["converter"],
+                    defaults["compression"],
+                )
+                if key is not None:
+                    await loop.run_in_executor(
+                        executor,
+                        result_cache.put,
+                        key,
+                        result[0],
+                        spec.get("cache_ttl"),
+                        result[1],
+                    )
+                return result
+
+            if key is not None:
+                (payload, headers), shared = await single_flight.run(
+                    key, running, execute, join=not spec.get("refresh", False)
+                )
+                if shared:
+                    header["cache"] = "SHARED"
+            else:
+                payload, headers = await execute(running)
+            header.update(
+                {name[2:].lower().replace("-", "_"): value for name, value in headers.items()}
+            )
+            header["status"] = 200
+        except QueueFullError as e:
+            logger.warning(f"Rejected batch query {running.request_id}: {e}")
+            header.update(status=429, error=str(e))
+        except Exception as e:
+            logger.error(e)
+            status = e.status if isinstance(e, QueryCancelledError) else 500
+            header.update(status=status, error=str(e))
+            payload = b""
+        finally:
+            header["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+            if timeout_handle is not None:
+                loop.remove_timeout(timeout_handle)
+            running_queries.unregister(running)
+        return header, payload
+
+    async def write_frame(self, header, payload):
+        if isinstance(payload, bytes):
+            self.write(encode_frame_header(header, len(payload)))
+            self.write(payload)
+        else:
+            # Cached result, possibly memory-mapped from disk
+            self.write(encode_frame_header(header, payload.size))
+            for chunk in payload.chunks(CACHE_WRITE_CHUNK_BYTES):
+                self.write(chunk)
+        await self.flush()
+
+    async def post(self):
+        try:
+            request_data = json.loads(self.request.body)
+
+            queries = request_data.get("queries")
+            if not queries:
+                raise ValueError("Missing required 'queries' parameter")
+            if len(queries) > TRINO_BATCH_MAX_QUERIES:
+                raise ValueError(
+                    f"Too many queries in batch: {len(queries)}, at most {TRINO_BATCH_MAX_QUERIES} are allowed"
+                )
+            for i, spec in enumerate(queries):
+                if not spec.get("query"):
+                    raise ValueError(f"Missing 'query' in batch entry {i}")
+                spec.setdefault("id", str(i))
+
+            user = request_data.get("user", "admin")
+            password = request_data.get("password", None)
+            tuplifiedExtraCredentials = parse_extra_credentials(
+                request_data.get("extraCredentials", None)
+            )
+            defaults = {
+                "converter": request_data.get("converter", ARROW_CONVERTER),
+                "timeout_ms": request_data.get("timeout_ms", TRINO_QUERY_TIMEOUT_MS),
+                "compression": parse_ipc_compression(
+                    request_data.get("compression", ARROW_COMPRESSION)
+                ),
+            }
+
+            cluster = clusters.resolve(
+                request_data.get("environment", None),
+                request_data.get("host", None),
+                request_data.get("port", None),
+            )
+            batch_id = request_data.get("request_id") or str(uuid.uuid4())
+            self.set_header("X-Request-Id", batch_id)
+            self.set_header("Content-Type", "application/octet-stream")
+
+            logger.info(
+                f"Serving batch {batch_id} of {len(queries)} queries from user {user} on {cluster.id}"
+            )
+
+            tasks = []
+            for spec in queries:
+                connection = (
                     user,
                     password,
-                    catalog,
-                    schema,
-                    query,
+                    spec.get("catalog") or request_data.get("catalog") or cluster.catalog,
+                    spec.get("schema") or request_data.get("schema") or cluster.schema,
                     tuplifiedExtraCredentials,
                 )
+                running = running_queries.register(
+                    f"{batch_id}:{spec['id']}", user, spec["query"]
+                )
+                self.running.append(running)
+                tasks.append(self.run_query(cluster, connection, spec, running, defaults))
 
-                self.set_header("Content-Type", "application/json")
-                self.write(json_data)
+            for next_done in asyncio.as_completed(tasks):
+                header, payload = await next_done
+                await self.write_frame(header, payload)
 
         except Exception as e:
             logger.error(e)
+            if self._headers_written:
+                # Some frames already went out, drop the connection and the queries still running
+                self.on_connection_close()
+                self.request.connection.close()
+                return
             self.set_status(500)
             self.write({"error": str(e)})
 
 
+class TrinoCancelHandler(tornado.web.RequestHandler):
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "Content-Type")
+        self.set_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+
+    def options(self):
+        self.set_status(204)
+        self.finish()
+
+    async def post(self):
+        try:
+            request_data = json.loads(self.request.body)
+            request_id = request_data.get("request_id", None)
+            query_id = request_data.get("query_id", None)
+            user = request_data.get("user", "admin")
+
+            if request_id is None and query_id is None:
+                raise ValueError("Missing required 'request_id' or 'query_id' parameter")
+
+            logger.info(
+                f"Cancel request from user {user}: request_id={request_id} query_id={query_id}"
+            )
+
+            running = running_queries.find(request_id=request_id, query_id=query_id)
+            if running is None:
+                self.set_status(404)
+                self.write({"error": "No running query found"})
+                return
+            if running.user != user:
+                self.set_status(403)
+                self.write({"error": "Query belongs to a different user"})
+                return
+
+            cancelled = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, running.cancel, f"cancelled by {user}"
+            )
+
+            self.set_header("Content-Type", "application/json")
+            self.write(
+                {
+                    "cancelled": cancelled,
+                    "request_id": running.request_id,
+                    "query_id": running.query_id,
+                }
+            )
+
+        except Exception as e:
+            logger.error(f"Cancel error: {e}")
+            self.set_status(500)
+            self.write({"error": str(e)})
+
+
+class TrinoMetadataHandler(tornado.web.RequestHandler):
+    """
+    POST /trino/metadata: catalog metadata from the metadata cache, loaded first if needed.
+    With the connection parameters of /trino plus, narrowing it down, catalog, schema and
+    table, it returns the catalogs, the schemas of a catalog with their tables, the tables of
+    a schema or the columns of a table. refresh reloads the catalog (the catalog list without
+    one) first.
+    """
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "Content-Type")
+        self.set_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+
+    def options(self):
+        self.set_status(204)
+        self.finish()
+
+    async def post(self):
+        try:
+            request_data = json.loads(self.request.body)
+            user = request_data.get("user", "admin")
+            # Names as Trino folds them, see parse_metadata_query
+            catalog, schema, table = (
+                (request_data.get(name) or "").lower() or None
+                for name in ("catalog", "schema", "table")
+            )
+            if table is not None and (catalog is None or schema is None):
+                raise ValueError("A table needs its catalog and schema")
+            if schema is not None and catalog is None:
+                raise ValueError("A schema needs its catalog")
+
+            cluster = clusters.resolve(
+                request_data.get("environment"),
+                request_data.get("host"),
+                request_data.get("port"),
+            )
+            connection = (
+                user,
+                request_data.get("password"),
+                cluster.catalog,
+                cluster.schema,
+                parse_extra_credentials(request_data.get("extraCredentials")),
+            )
+            scope = metadata_cache.scope(cluster, connection)
+            if request_data.get("refresh", False):
+                await load_metadata(scope, catalog)
+            entry = await metadata_for(scope, catalog)
+
+            result = None
+            if catalog is None:
+                result = {"catalogs": entry.value}
+            elif entry is not None and entry.value is None:
+                self.set_status(413)
+                self.write(
+                    {"error": f"Catalog {catalog} has too many columns to keep its metadata"}
+                )
+                return
+            elif entry is not None and schema is None:
+                result = {
+                    "catalog": catalog,
+                    "schemas": {name: sorted(tables) for name, tables in entry.value.items()},
+                }
+            elif entry is not None and schema in entry.value:
+                tables = entry.value[schema]
+                if table is None:
+                    result = {"catalog": catalog, "schema": schema, "tables": sorted(tables)}
+                elif table in tables:
+                    result = {
+                        "catalog": catalog,
+                        "schema": schema,
+                        "table": table,
+                        "columns": [
+                            {"name": name, "type": data_type, "comment": comment}
+                            for name, data_type, _, comment in tables[table]
+                        ],
+                    }
+
+            if result is None:
+                name = ".".join(n for n in (catalog, schema, table) if n is not None)
+                self.set_status(404)
+                self.write({"error": f"Not found: {name}"})
+                return
+            self.set_header("Content-Type", "application/json")
+            self.write({**result, "age": int(entry.age)})
+
+        except QueueFullError as e:
+            logger.warning(f"Rejected metadata request: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
+        except Exception as e:
+            logger.error(f"Metadata error: {e}")
+            self.set_status(e.status if isinstance(e, QueryCancelledError) else 500)
+            self.write({"error": str(e)})
+
+
+class ResultHandleHandler(tornado.web.RequestHandler):
+    """
+    GET /trino/{id}: state of a result handle opened with POST /trino and mode=handle, its
+    schema, number of batches and rows per batch so far, whether it is complete or truncated.
+    DELETE /trino/{id}: cancel the query if still running and drop the spilled result.
+    Both take the user owning the handle as ?user=.
+    """
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "Content-Type")
+        self.set_header("Access-Control-Allow-Methods", "GET, DELETE, OPTIONS")
+        self.set_header("Access-Control-Expose-Headers", "X-Batches, X-Handle-Done")
+
+    def options(self, *args):
+        self.set_status(204)
+        self.finish()
+
+    def find_handle(self, handle_id):
+        """The handle if it exists and belongs to the user, else None with the error written"""
+        handle = result_handles.get(handle_id)
+        if handle is None:
+            self.set_status(404)
+            self.write({"error": f"Unknown or expired result handle: {handle_id}"})
+            return None
+        if handle.user != self.get_argument("user", "admin"):
+            self.set_status(403)
+            self.write({"error": "Result handle belongs to a different user"})
+            return None
+        return handle
+
+    def get(self, handle_id):
+        handle = self.find_handle(handle_id)
+        if handle is not None:
+            self.write(handle.describe())
+
+    async def delete(self, handle_id):
+        handle = self.find_handle(handle_id)
+        if handle is None:
+            return
+        result_handles.remove(handle_id)
+        if not handle.done:
+            await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, handle.running.cancel, "result handle closed"
+            )
+        self.write({"removed": handle_id})
+
+
+class ResultHandleBatchesHandler(ResultHandleHandler):
+    """
+    GET /trino/{id}/batches?from=&to=: record batches [from, to) of a result handle as an
+    Arrow IPC stream, all of them without to. Waits for batches not fetched yet, a range past
+    the end of a complete result is cut short. X-Batches is the number of batches served.
+    """
+
+    SUPPORTED_METHODS = ("GET", "OPTIONS")
+
+    async def get(self, handle_id):
+        try:
+            handle = self.find_handle(handle_id)
+            if handle is None:
+                return
+            start = int(self.get_argument("from", "0"))
+            end = self.get_argument("to", None)
+            end = int(end) if end is not None else None
+            if start < 0 or (end is not None and end < start):
+                raise ValueError(f"Invalid batch range: {start} to {end}")
+
+            await handle.wait_for(end if end is not None else float("inf"))
+            available = len(handle.batches)
+            wanted = available + 1 if end is None else end
+            if handle.error is not None and available < wanted:
+                raise RuntimeError(handle.error)
+            end = available if end is None else min(end, available)
+            start = min(start, end)
+
+            self.set_header("Content-Type", "application/octet-stream")
+            self.set_header("X-Batches", str(end - start))
+            self.set_header("X-Handle-Done", "true" if handle.done else "false")
+            for chunk in handle.read(start, end, CACHE_WRITE_CHUNK_BYTES):
+                self.write(chunk)
+                await self.flush()
+        except Exception as e:
+            logger.error(e)
+            if self._headers_written:
+                self.request.connection.close()
+                return
+            self.set_status(500)
+            self.write({"error": str(e)})
+
+
+class ExtractTableHandler(tornado.web.RequestHandler):
+    """
+    POST /duckdb/{session}/tables: run a query (or take its result from the result cache) and
+    register the result as a table of the session's DuckDB, creating the session. The session
+    id is made up by the client, e.g. one per dashboard run, and only works for the user who
+    created it.
+
+    Request: "table" and the query and connection parameters of /trino
+    Response: {table, rows, bytes, columns: [{name, type}], cache}
+    """
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "Content-Type")
+        self.set_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+
+    def options(self, *args):
+        self.set_status(204)
+        self.finish()
+
+    def initialize(self):
+        self.running = None
+
+    def on_connection_close(self):
+        if self.running is not None and not self.running.cancelled:
+            tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.running.cancel, "client disconnected"
+            )
+
+    async def fetch(self, cluster, connection, request_data, executor):
+        """Arrow IPC payload of the query and its cache status"""
+        loop = tornado.ioloop.IOLoop.current()
+        query = self.running.query
+        converter = request_data.get("converter", ARROW_CONVERTER)
+        compression = parse_ipc_compression(
+            request_data.get("compression", ARROW_COMPRESSION)
+        )
+        refresh = request_data.get("refresh", False)
+        key = None
+        if request_data.get("cache", True) and is_cacheable(query):
+            key = cache_key(query, cluster.id, *connection, converter, compression)
+
+        async def execute(running):
+            result = await loop.run_in_executor(
+                executor,
+                fetch_arrow,
+                cluster,
+                connection,
+                query,
+                running,
+                converter,
+                compression,
+            )
+            if key is not None:
+                await loop.run_in_executor(
+                    executor,
+                    result_cache.put,
+                    key,
+                    result[0],
+                    request_data.get("cache_ttl"),
+                    result[1],
+                )
+            return result
+
+        if key is None:
+            return (await execute(self.running))[0], "BYPASS"
+
+        entry = None if refresh else result_cache.get(key)
+        if entry is not None:
+            return entry.payload, "HIT"
+        (payload, _), shared = await single_flight.run(
+            key, self.running, execute, join=not refresh
+        )
+        return payload, "SHARED" if shared else ("REFRESH" if refresh else "MISS")
+
+    async def post(self, session_id):
+        loop = tornado.ioloop.IOLoop.current()
+        timeout_handle = None
+        try:
+            request_data = json.loads(self.request.body)
+            table_name = request_data.get("table")
+            query = request_data.get("query")
+            if not table_name or not query:
+                raise ValueError("Missing required 'table' or 'query' parameter")
+            user = request_data.get("user", "admin")
+
+            cluster = clusters.resolve(
+                request_data.get("environment"),
+                request_data.get("host"),
+                request_data.get("port"),
+            )
+            connection = (
+                user,
+                request_data.get("password"),
+                request_data.get("catalog") or cluster.catalog,
+                request_data.get("schema") or cluster.schema,
+                parse_extra_credentials(request_data.get("extraCredentials")),
+            )
+            session = await loop.run_in_executor(
+                None, extract_engine.session, session_id, user
+            )
+
+            self.running = running_queries.register(request_data.get("request_id"), user, query)
+            timeout_ms = request_data.get("timeout_ms", TRINO_QUERY_TIMEOUT_MS)
+            if timeout_ms:
+                timeout_handle = loop.call_later(
+                    timeout_ms / 1000,
+                    lambda: loop.run_in_executor(
+                        None, self.running.cancel, f"timed out after {timeout_ms} ms", 504
+                    ),
+                )
+            lane = request_data.get("lane") or choose_lane(
+                normalize_sql(query), request_data.get("limit"), SMALL_QUERY_ROWS
+            )
+            if lane not in cluster.lanes:
+                raise ValueError(
+                    f"Unknown lane: {lane}. Supported lanes: {', '.join(cluster.lanes)}"
+                )
+
+            payload, cache = await self.fetch(
+                cluster, connection, request_data, cluster.lanes[lane].for_user(user)
+            )
+            table = await loop.run_in_executor(
+                extract_lane.for_user(user), extract_engine.load, session, table_name, payload
+            )
+            logger.info(
+                f"Registered {table.num_rows} rows as {table_name} of extract session"
+                f" {session_id} ({cache})"
+            )
+            self.write(
+                {
+                    "table": table_name,
+                    "rows": table.num_rows,
+                    "bytes": table.nbytes,
+                    "columns": [
+                        {"name": field.name, "type": str(field.type)} for field in table.schema
+                    ],
+                    "cache": cache,
+                }
+            )
+        except QueueFullError as e:
+            logger.warning(f"Rejected extract: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
+        except PermissionError as e:
+            self.set_status(403)
+            self.write({"error": str(e)})
+        except MemoryError as e:
+            logger.warning(f"Rejected extract: {e}")
+            self.set_status(507)
+            self.write({"error": str(e)})
+        except Exception as e:
+            logger.error(e)
+            self.set_status(e.status if isinstance(e, QueryCancelledError) else 500)
+            self.write({"error": str(e)})
+        finally:
+            if timeout_handle is not None:
+                loop.remove_timeout(timeout_handle)
+            if self.running is not None:
+                running_queries.unregister(self.running)
+
+
+class ExtractQueryHandler(tornado.web.RequestHandler):
+    """
+    POST /duckdb/{session}?user=: SQL against the tables of a session, in the protocol of
+    Mosaic's REST connector. Request {"type": "arrow" | "json" | "exec", "sql": ...}, answered
+    with an Arrow IPC stream, a JSON array of rows or nothing.
+    DELETE /duckdb/{session}?user=: close the session and drop its tables.
+    Only the user who created the session can do either.
+    """
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "Content-Type")
+        self.set_header("Access-Control-Allow-Methods", "POST, DELETE, OPTIONS")
+
+    def options(self, *args):
+        self.set_status(204)
+        self.finish()
+
+    async def post(self, session_id):
+        try:
+            request_data = json.loads(self.request.body)
+            query_type = request_data.get("type", "arrow")
+            sql = request_data.get("sql")
+            if not sql:
+                raise ValueError("Missing required 'sql' parameter")
+
+            session = extract_engine.session(
+                session_id, self.get_argument("user", "admin"), create=False
+            )
+            if session is None:
+                self.set_status(404)
+                self.write({"error": f"Unknown or expired extract session: {session_id}"})
+                return
+
+            started = time.monotonic()
+            result = await tornado.ioloop.IOLoop.current().run_in_executor(
+                extract_lane.for_user(session.user), session.execute, query_type, sql
+            )
+            logger.info(
+                f"Extract session {session_id}: {query_type} query in"
+                f" {(time.monotonic() - started) * 1000:.1f} ms: {sql}"
+            )
+            if query_type == "arrow":
+                self.set_header("Content-Type", "application/octet-stream")
+                self.write(result)
+            elif query_type == "json":
+                self.set_header("Content-Type", "application/json")
+                self.write(encode_rows(result))
+        except QueueFullError as e:
+            logger.warning(f"Rejected extract query: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
+        except PermissionError as e:
+            self.set_status(403)
+            self.write({"error": str(e)})
+        except Exception as e:
+            logger.error(f"Extract query error: {e}")
+            self.set_status(500)
+            self.write({"error": str(e)})
+
+    async def delete(self, session_id):
+        user = self.get_argument("user", "admin")
+        try:
+            closed = await tornado.ioloop.IOLoop.current().run_in_executor(
+                extract_lane.for_user(user), extract_engine.close, session_id, user
+            )
+            self.write({"closed": closed})
+        except QueueFullError as e:
+            logger.warning(f"Rejected extract session close: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
+        except PermissionError as e:
+            self.set_status(403)
+            self.write({"error": str(e)})
+
+
 class SearchHandler(tornado.web.RequestHandler):
     def set_default_headers(self):
         self.set_header("Access-Control-Allow-Origin", "*")
@@ -233,39 +1487,30 @@ class SearchHandler(tornado.web.RequestHandler):
                 f"Search request from user {user}: regex={pattern!r} max_results={max_results}"
             )
 
-            with docs_conn.cursor() as conn:
-                rows = conn.execute(
-                    "SELECT path, title, summary FROM document"
-                    " WHERE regexp_matches(COALESCE(title, ''), ?, 'i')"
-                    "    OR regexp_matches(COALESCE(content, ''), ?, 'i')"
-                    " ORDER BY path LIMIT ?",
-                    [pattern, pattern, max_results],
-                ).fetchall()
-
-            results = [
-                {"title": title or path, "id": path, "summary": summary or ""}
-                for path, title, summary in rows
-            ]
-
-            yaml_lines = ["results:"]
-            for r in results:
-                yaml_lines.append(f'  - title: "{r["title"]}"')
-                yaml_lines.append(f'    id: "{r["id"]}"')
-                yaml_lines.append(f'    summary: "{r["summary"]}"')
-            yaml_lines.append(f'regex: "{pattern}"')
-            yaml_lines.append(f"total_results: {len(results)}")
-            yaml_output = "\n".join(yaml_lines) + "\n"
+            yaml_output = await tornado.ioloop.IOLoop.current().run_in_executor(
+                docs_lane.for_user(user),
+                ai_tools.search,
+                docs_store.current,
+                pattern,
+                max_results,
+                SEARCH_CANDIDATES,
+            )
 
             self.set_header("Content-Type", "text/yaml")
             self.write(yaml_output)
 
+        except QueueFullError as e:
+            logger.warning(f"Search rejected: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
         except Exception as e:
             logger.error(f"Search error: {e}")
             self.set_status(500)
             self.write({"error": str(e)})
 
 
-class LSHandler(tornado.web.RequestHandler):
+class SemanticSearchHandler(tornado.web.RequestHandler):
     def set_default_headers(self):
         self.set_header("Access-Control-Allow-Origin", "*")
         self.set_header("Access-Control-Allow-Headers", "Content-Type")
@@ -278,34 +1523,72 @@ class LSHandler(tornado.web.RequestHandler):
     async def post(self):
         try:
             request_data = json.loads(self.request.body)
-            prefix = request_data.get("prefix", "")
+            query = request_data.get("query", "")
+            k = min(max(int(request_data.get("k", 5)), 1), SEMANTIC_SEARCH_MAX_K)
             user = request_data.get("user", "anonymous")
 
-            logger.info(f"LS request from user {user}: prefix={prefix!r}")
+            logger.info(f"Semantic search request from user {user}: query={query!r} k={k}")
+
+            yaml_output = await tornado.ioloop.IOLoop.current().run_in_executor(
+                docs_lane.for_user(user),
+                ai_tools.semantic_search,
+                docs_store.current,
+                query,
+                k,
+            )
+
+            self.set_header("Content-Type", "text/yaml")
+            self.write(yaml_output)
+
+        except ToolError as e:
+            self.set_status(e.status)
+            self.write({"error": str(e)})
+        except QueueFullError as e:
+            logger.warning(f"Semantic search rejected: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
+        except Exception as e:
+            logger.error(f"Semantic search error: {e}")
+            self.set_status(500)
+            self.write({"error": str(e)})
 
-            with docs_conn.cursor() as conn:
-                rows = conn.execute(
-                    "SELECT path, title, summary FROM document WHERE path LIKE ? ORDER BY path",
-                    [prefix + "%"],
-                ).fetchall()
 
-            results = [
-                {"title": title or path, "id": path, "summary": summary or ""}
-                for path, title, summary in rows
-            ]
+class LSHandler(tornado.web.RequestHandler):
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "Content-Type")
+        self.set_header("Access-Control-Allow-Methods", "POST, OPTIONS")
 
-            yaml_lines = ["files:"]
-            for r in results:
-                yaml_lines.append(f'  - title: "{r["title"]}"')
-                yaml_lines.append(f'    id: "{r["id"]}"')
-                yaml_lines.append(f'    summary: "{r["summary"]}"')
-            yaml_lines.append(f'prefix: "{prefix}"')
-            yaml_lines.append(f"total_files: {len(results)}")
-            yaml_output = "\n".join(yaml_lines) + "\n"
+    def options(self):
+        self.set_status(204)
+        self.finish()
+
+    async def post(self):
+        try:
+            request_data = json.loads(self.request.body)
+            prefix = request_data.get("prefix", "")
+            offset = int(request_data.get("offset") or 0)
+            limit = int(request_data.get("limit") or LS_MAX_RESULTS)
+            limit = min(max(limit, 1), LS_MAX_RESULTS)
+            user = request_data.get("user", "anonymous")
+
+            logger.info(
+                f"LS request from user {user}: prefix={prefix!r} offset={offset} limit={limit}"
+            )
+
+            yaml_output = await tornado.ioloop.IOLoop.current().run_in_executor(
+                docs_lane.for_user(user), ai_tools.ls, docs_store.current, prefix, offset, limit
+            )
 
             self.set_header("Content-Type", "text/yaml")
             self.write(yaml_output)
 
+        except QueueFullError as e:
+            logger.warning(f"LS rejected: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
         except Exception as e:
             logger.error(f"LS error: {e}")
             self.set_status(500)
@@ -313,6 +1596,13 @@ class LSHandler(tornado.web.RequestHandler):
 
 
 class RetrieveDocHandler(tornado.web.RequestHandler):
+    """
+    POST {doc_id, toc?, section?, offset?, length?}: the whole document by default, its table
+    of contents with toc=true, one section by number or heading with section, or a character
+    range with offset/length. Output is capped at RETRIEVE_DOC_MAX_CHARS, with a note on how
+    to continue.
+    """
+
     def set_default_headers(self):
         self.set_header("Access-Control-Allow-Origin", "*")
         self.set_header("Access-Control-Allow-Headers", "Content-Type")
@@ -327,22 +1617,40 @@ class RetrieveDocHandler(tornado.web.RequestHandler):
             request_data = json.loads(self.request.body)
             doc_id = request_data.get("doc_id", "unknown")
             user = request_data.get("user", "anonymous")
+            toc = bool(request_data.get("toc", False))
+            section = request_data.get("section")
+            offset = request_data.get("offset")
+            length = request_data.get("length")
 
-            logger.info(f"Retrieve document request from user {user}: {doc_id}")
-
-            with docs_conn.cursor() as conn:
-                row = conn.execute(
-                    "SELECT content FROM document WHERE path = ?", [doc_id]
-                ).fetchone()
+            logger.info(
+                f"Retrieve document request from user {user}: {doc_id}"
+                f" toc={toc} section={section!r} offset={offset} length={length}"
+            )
 
-            if row is None:
-                self.set_status(404)
-                self.write({"error": f"Document not found: {doc_id}"})
-                return
+            text = await tornado.ioloop.IOLoop.current().run_in_executor(
+                docs_lane.for_user(user),
+                ai_tools.retrieve_doc,
+                doc_cache,
+                docs_store.current,
+                doc_id,
+                RETRIEVE_DOC_MAX_CHARS,
+                toc,
+                section,
+                offset,
+                length,
+            )
 
             self.set_header("Content-Type", "text/plain")
-            self.write(f"Document: {doc_id}\n\n{row[0]}")
-
+            self.write(text)
+
+        except ToolError as e:
+            self.set_status(e.status)
+            self.write({"error": str(e), **e.details})
+        except QueueFullError as e:
+            logger.warning(f"Retrieve doc rejected: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
         except Exception as e:
             logger.error(f"Retrieve doc error: {e}")
             self.set_status(500)
@@ -350,10 +1658,19 @@ class RetrieveDocHandler(tornado.web.RequestHandler):
 
 
 class AIHandler(tornado.web.RequestHandler):
-    executor = ThreadPoolExecutor(max_workers=4)
+    # Replaced per request by the AI lane on behalf of the requesting user
+    executor = ai_lane
+    # Streamed completions in progress, across all requests
+    active_streams = 0
+    # Sampling options a request may set
+    request_options = ("temperature", "top_p", "top_k", "seed")
 
     def initialize(self):
-        pass
+        self.client_closed = False
+        self.llm_cache = llm_cache
+        self.llm_options = None
+        # The Trino queries of the agent's tool calls, cancelled together with the request
+        self.running = None
 
     def set_default_headers(self):
         self.set_header("Access-Control-Allow-Origin", "*")
@@ -364,18 +1681,169 @@ class AIHandler(tornado.web.RequestHandler):
         self.set_status(204)
         self.finish()
 
-    @run_on_executor
-    def execute_chat_completion(self, messages, functions, model=None):
-        """Execute chat completion - runs on executor thread"""
+    def create_llm(self, model=None):
         kwargs = {}
         if model:
             kwargs["model"] = model
-        llm = UniversalLLM(provider="ollama", **kwargs)
+        return UniversalLLM(
+            provider="ollama", cache=self.llm_cache, options=self.llm_options, **kwargs
+        )
+
+    @run_on_executor
+    def execute_chat_completion(self, messages, functions, model=None):
+        """Execute chat completion - runs on executor thread"""
+        llm = self.create_llm(model)
         logger.info(
             f"Using LLM provider: {llm.get_provider()}, model: {llm.get_model_name()}"
         )
         return llm.chat_complete(messages, functions)
 
+    def server_tools(self, request_data, user):
+        """
+        Tools the agent loop runs on the server. Metadata queries need the Trino connection
+        the browser would use, passed as trino: {environment, user, password, catalog, schema,
+        extraCredentials, timeout_ms}. They run on the cluster's lanes like /trino queries,
+        each cancelled when the request goes away or after timeout_ms.
+        """
+        run_query = None
+        query_executor = None
+        trino = request_data.get("trino")
+        if trino:
+            cluster = clusters.resolve(
+                trino.get("environment"), trino.get("host"), trino.get("port")
+            )
+            connection = (
+                trino.get("user") or user,
+                trino.get("password"),
+                trino.get("catalog") or cluster.catalog,
+                trino.get("schema") or cluster.schema,
+                parse_extra_credentials(trino.get("extraCredentials")),
+            )
+
+            timeout_ms = trino.get("timeout_ms", TRINO_QUERY_TIMEOUT_MS)
+            io_loop = tornado.ioloop.IOLoop.current()
+            self.running = running_queries.register(
+                request_data.get("request_id"), connection[0], "-- agent tool calls"
+            )
+
+            def query_executor(query):
+                lane = choose_lane(normalize_sql(query or ""), None, SMALL_QUERY_ROWS)
+                return cluster.lanes[lane].for_user(connection[0])
+
+            def run_query(query):
+                arrow_bytes = answer_from_metadata(cluster, connection, query, io_loop=io_loop)
+                if arrow_bytes is not None:
+                    return arrow_bytes
+                running = running_queries.register(None, connection[0], query)
+                self.running.on_cancel(running.cancel)
+                # Runs on the cluster lane, off the IOLoop, so the timeout gets a timer thread
+                timer = None
+                if timeout_ms:
+                    timer = threading.Timer(
+                        timeout_ms / 1000,
+                        running.cancel,
+                        (f"timed out after {timeout_ms} ms", 504),
+                    )
+                    timer.start()
+                try:
+                    return fetch_arrow(cluster, connection, query, running)[0]
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+                    running_queries.unregister(running)
+
+        return ServerTools(
+            docs_store,
+            doc_cache,
+            {
+                "search_candidates": SEARCH_CANDIDATES,
+                "semantic_search_max_k": SEMANTIC_SEARCH_MAX_K,
+                "ls_max_results": LS_MAX_RESULTS,
+                "retrieve_doc_max_chars": RETRIEVE_DOC_MAX_CHARS,
+            },
+            run_query,
+            query_executor,
+        )
+
+    async def execute_agent(self, messages, functions, model, tools):
+        """Agent loop without streaming, returns the final response as chat_complete does"""
+        llm = self.create_llm(model)
+        logger.info(
+            f"Running agent with LLM provider: {llm.get_provider()}, model: {llm.get_model_name()}"
+        )
+        events = run_agent(
+            llm,
+            messages,
+            functions,
+            tools,
+            self.executor,
+            AI_AGENT_MAX_TURNS,
+            compact=context_compactor.compact,
+            tool_executor=self.tool_executor,
+        )
+        try:
+            async for event in events:
+                if event["type"] == "error":
+                    return {"success": False, "error": event["error"]}
+                if event["type"] == "done":
+                    return event
+        finally:
+            await events.aclose()
+        return {"success": False, "error": "Agent stopped without a response"}
+
+    def on_connection_close(self):
+        self.client_closed = True
+        if self.running is not None and not self.running.cancelled:
+            tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.running.cancel, "client disconnected"
+            )
+
+    async def stream_chat_completion(self, messages, functions, model=None, tools=None):
+        """
+        Forward the completion as server-sent events while Ollama generates it. The request
+        to Ollama is async, so no executor thread is held, and it is closed as soon as the
+        client goes away. With tools, the agent loop runs them in between model calls.
+        """
+        llm = self.create_llm(model)
+        logger.info(
+            f"Streaming with LLM provider: {llm.get_provider()}, model: {llm.get_model_name()}"
+        )
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        # Keep reverse proxies from buffering the stream
+        self.set_header("X-Accel-Buffering", "no")
+
+        AIHandler.active_streams += 1
+        if tools is not None:
+            events = run_agent(
+                llm,
+                messages,
+                functions,
+                tools,
+                self.executor,
+                AI_AGENT_MAX_TURNS,
+                stream=True,
+                compact=context_compactor.compact,
+                tool_executor=self.tool_executor,
+            )
+        else:
+            events = llm.chat_stream(messages, functions)
+        try:
+            async for event in events:
+                if self.client_closed:
+                    logger.info("Client disconnected, stopping chat completion")
+                    break
+                if event["type"] == "done":
+                    logger.info(f"Chat completion response: {event}")
+                self.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n")
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            logger.info("Client disconnected, stopping chat completion")
+        finally:
+            AIHandler.active_streams -= 1
+            await events.aclose()
+
     async def post(self):
         try:
             request_data = json.loads(self.request.body)
@@ -384,21 +1852,50 @@ class AIHandler(tornado.web.RequestHandler):
             messages = request_data.get("messages", [])
             model = request_data.get("model", None)
             user = request_data.get("user", "anonymous")
+            agent = bool(request_data.get("agent", False))
 
+            # Histories get long, the compactor logs their size instead
             logger.info(
-                f"Chat completion request from user {user} with model={model}: {messages}"
+                f"Chat completion request from user {user} with model={model} agent={agent}"
             )
 
             if not messages:
                 raise ValueError("Missing required 'messages' parameter")
 
+            messages, _ = context_compactor.compact(messages)
+
+            # temperature 0 makes completions deterministic, and so cacheable
+            options = request_data.get("options") or {}
+            self.llm_options = {
+                k: v for k, v in options.items() if k in self.request_options
+            } or None
+            if not request_data.get("cache", True):
+                self.llm_cache = None
+
+            self.executor = ai_lane.for_user(user)
+            self.tool_executor = docs_lane.for_user(user)
+            tools = self.server_tools(request_data, user) if agent else None
+
+            if request_data.get("stream"):
+                if AIHandler.active_streams >= AI_MAX_STREAMS:
+                    raise QueueFullError(
+                        f"Too many streamed chat completions in progress ({AI_MAX_STREAMS})"
+                    )
+                await self.stream_chat_completion(
+                    messages, get_available_functions(), model, tools
+                )
+                return
+
             # Get available functions
             functions = get_available_functions()
 
             # Call LLM with functions (now runs on executor)
-            llm_response = await self.execute_chat_completion(
-                messages, functions, model
-            )
+            if tools is not None:
+                llm_response = await self.execute_agent(messages, functions, model, tools)
+            else:
+                llm_response = await self.execute_chat_completion(
+                    messages, functions, model
+                )
 
             if not llm_response.get("success"):
                 self.set_status(500)
@@ -409,57 +1906,135 @@ class AIHandler(tornado.web.RequestHandler):
                 "text": llm_response.get("text", ""),
                 "model": llm_response.get("model", "unknown"),
                 "function_call": llm_response.get("function_call"),
+                "function_calls": llm_response.get("function_calls", []),
                 "extra_data": llm_response.get("extra_data"),
             }
+            if tools is not None:
+                response_data["steps"] = llm_response.get("steps", [])
 
             logger.info(f"Chat completion response: {response_data}")
 
             self.set_header("Content-Type", "application/json")
             self.write(response_data)
 
+        except QueueFullError as e:
+            logger.warning(f"AI Handler rejected request: {e}")
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.write({"error": str(e)})
         except Exception as e:
             print(f"AI Handler error: {e}")
             self.set_status(500)
             self.write({"error": str(e)})
+        finally:
+            if self.running is not None:
+                running_queries.unregister(self.running)
 
 
-# Load UI config from config.json (once at startup)
-_config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
-try:
-    with open(_config_path, "r") as f:
-        _ui_config = json.load(f)
-    logger.info(f"Loaded UI config from {_config_path}")
-except Exception as e:
-    logger.warning(f"Could not load config.json ({e}), using defaults")
-    _ui_config = {
-        "disclaimer": "DISCLAIMER — AI can make mistakes, always check the results.",
-        "environments": [{"id": "local", "name": "Local", "cluster": "local"}],
-        "defaultEnvironment": "local",
-        "models": [{"id": "gpt-oss", "name": "gpt-oss"}],
-        "defaultModel": "gpt-oss",
-    }
+class DocsReloadHandler(tornado.web.RequestHandler):
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "Content-Type")
+        self.set_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+
+    def options(self):
+        self.set_status(204)
+        self.finish()
+
+    async def post(self):
+        try:
+            reloaded = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, docs_store.reload, True
+            )
+            self.set_header("Content-Type", "application/json")
+            self.write({"reloaded": reloaded, **docs_store.metrics()})
+        except Exception as e:
+            logger.error(f"Docs reload error: {e}")
+            self.set_status(500)
+            self.write({"error": str(e)})
+
+
+async def reload_docs_if_changed():
+    if docs_store.changed():
+        try:
+            await tornado.ioloop.IOLoop.current().run_in_executor(None, docs_store.reload)
+        except Exception:
+            # Logged by reload(), the next check tries again
+            pass
+
+
+def preload_llm_model(model):
+    started = time.perf_counter()
+    try:
+        UniversalLLM(provider="ollama", model=model).preload()
+        logger.info(f"Preloaded LLM model {model} in {time.perf_counter() - started:.1f} s")
+    except Exception as e:
+        logger.warning(f"Could not preload LLM model {model}: {e}")
 
 
 class ConfigHandler(tornado.web.RequestHandler):
     def get(self):
         self.set_header("Content-Type", "application/json")
-        self.write(_ui_config)
+        # Cluster coordinates are backend-only
+        self.write(
+            {
+                **{k: v for k, v in _ui_config.items() if k != "clusters"},
+                "batchMaxQueries": TRINO_BATCH_MAX_QUERIES,
+            }
+        )
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "application/json")
+        self.write(
+            {
+                "clusters": clusters.metrics(),
+                "result_cache": result_cache.metrics(),
+                "queries": running_queries.metrics(),
+                "single_flight": single_flight.metrics(),
+                "result_handles": result_handles.metrics(),
+                "metadata_cache": metadata_cache.metrics(),
+                "extracts": extract_engine.metrics(),
+                "extract_lane": extract_lane.metrics(),
+                "ai_lane": ai_lane.metrics(),
+                "docs_lane": docs_lane.metrics(),
+                "ai_streams": AIHandler.active_streams,
+                "ai_context": context_compactor.metrics(),
+                "llm_cache": llm_cache.metrics() if llm_cache is not None else None,
+                "llms": LLMFactory.instances(),
+                "docs": docs_store.metrics(),
+                "doc_cache": doc_cache.metrics(),
+            }
+        )
 
 
 app = tornado.web.Application(
     [
         (r"/config.json", ConfigHandler),
+        (r"/metrics", MetricsHandler),
         (r"/trino", TrinoArrowHandler),
+        (r"/trino/batch", TrinoBatchHandler),
+        (r"/trino/cancel", TrinoCancelHandler),
+        (r"/trino/metadata", TrinoMetadataHandler),
+        (r"/trino/([^/]+)/batches", ResultHandleBatchesHandler),
+        (r"/trino/([^/]+)", ResultHandleHandler),
+        (r"/duckdb/([^/]+)/tables", ExtractTableHandler),
+        (r"/duckdb/([^/]+)", ExtractQueryHandler),
         (r"/ai/chat", AIHandler),
         (r"/ai/search", SearchHandler),
+        (r"/ai/semantic_search", SemanticSearchHandler),
         (r"/ai/ls", LSHandler),
         (r"/ai/retrieve_doc", RetrieveDocHandler),
+        (r"/ai/docs/reload", DocsReloadHandler),
         (
             r"/(.*)",
             tornado.web.StaticFileHandler,
             {"path": "./", "default_filename": "sql2.html"},
         ),
-    ]
+    ],
+    # gzip for JSON, YAML and text responses when the client accepts it
+    transforms=[GZipWithStats],
 )
 
 
@@ -476,4 +2051,27 @@ print("Starting web server")
 # Start the Tornado server
 app.listen(8888)
 loop = tornado.ioloop.IOLoop.current()
-loop.start()
+tornado.ioloop.PeriodicCallback(
+    clusters.evict_idle, TRINO_POOL_IDLE_TIMEOUT * 1000 / 2
+).start()
+tornado.ioloop.PeriodicCallback(
+    expire_result_handles, RESULT_HANDLE_TTL * 1000 / 2
+).start()
+tornado.ioloop.PeriodicCallback(refresh_metadata, METADATA_REFRESH_INTERVAL * 1000 / 2).start()
+tornado.ioloop.PeriodicCallback(
+    lambda: loop.run_in_executor(None, extract_engine.expire), EXTRACT_SESSION_TTL * 1000 / 2
+).start()
+if DOCS_RELOAD_INTERVAL > 0:
+    tornado.ioloop.PeriodicCallback(
+        reload_docs_if_changed, DOCS_RELOAD_INTERVAL * 1000
+    ).start()
+for model in OLLAMA_PRELOAD_MODELS:
+    loop.run_in_executor(None, preload_llm_model, model)
+loop.asyncio_loop.add_signal_handler(signal.SIGTERM, loop.stop)
+try:
+    loop.start()
+finally:
+    ai_lane.shutdown(wait=False, cancel_futures=True)
+    docs_lane.shutdown(wait=False, cancel_futures=True)
+    extract_lane.shutdown(wait=False, cancel_futures=True)
+    clusters.shutdown()
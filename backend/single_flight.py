@@ -0,0 +1,281 @@
+"""
+Single-flight execution of /trino queries. When a dashboard is open in several tabs, or
+several analysts open the same shared dashboard, the same queries arrive at the same moment.
+Concurrent requests for the same result (same normalised SQL, cluster, credential scope and
+encoding, see result_cache.cache_key) attach to one Trino execution and all get its result.
+
+Streamed requests (stream=true and JSON) share a streamed execution: its chunks are handed
+to every request reading it as they come. A request can join as long as the chunks sent so
+far are still all held, up to max_join_bytes; past that the chunks are dropped once every
+reader has them, and the producer waits for readers that fall that far behind. Streamed and
+buffered requests do not join each other.
+
+Every request keeps its own RunningQuery. Cancelling one (disconnect, timeout, /trino/cancel)
+detaches just that request. The shared execution is cancelled when the last one leaves.
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from query_registry import QueryCancelledError, RunningQuery
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, running: RunningQuery, execute: Callable[[RunningQuery], Awaitable]):
+        # The execution gets a RunningQuery of its own, no single request may cancel it
+        self.running = RunningQuery(
+            f"{running.request_id}:shared", running.user, running.query
+        )
+        self.task = asyncio.ensure_future(execute(self.running))
+        self.waiters = 0
+
+
+class _StreamFlight:
+    """A streamed execution, its chunks are kept until every reader has them"""
+
+    def __init__(
+        self,
+        running: RunningQuery,
+        produce: Callable[[RunningQuery, Callable[[bytes], Awaitable]], Awaitable],
+        max_join_bytes: int,
+        joinable: bool,
+    ):
+        self.running = RunningQuery(
+            f"{running.request_id}:shared", running.user, running.query
+        )
+        self.max_join_bytes = max_join_bytes
+        self.joinable = joinable
+        self.chunks: List[bytes] = []
+        # Position in the stream of chunks[0], and the bytes held in chunks
+        self.first = 0
+        self.buffered = 0
+        # Position of the next chunk, by reader
+        self.positions: Dict[object, int] = {}
+        self._changed: Optional[asyncio.Future] = None
+        self.task = asyncio.ensure_future(produce(self.running, self.push))
+
+    def changed(self) -> asyncio.Future:
+        """A future resolved on the next chunk, reader progress or the end of the stream"""
+        if self._changed is None or self._changed.done():
+            self._changed = asyncio.get_running_loop().create_future()
+        return self._changed
+
+    def notify(self):
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+
+    async def push(self, chunk: bytes):
+        """Hand chunk to the readers, waits while the slowest is max_join_bytes behind"""
+        self.chunks.append(chunk)
+        self.buffered += len(chunk)
+        if self.buffered > self.max_join_bytes:
+            # Later requests would miss what gets dropped from now on
+            self.joinable = False
+        self.notify()
+        while self.positions and self.buffered > self.max_join_bytes:
+            await self.changed()
+
+    def advance(self, reader, position: int):
+        self.positions[reader] = position
+        self.trim()
+
+    def leave(self, reader):
+        self.positions.pop(reader, None)
+        self.trim()
+        # The producer may be waiting for this reader
+        self.notify()
+
+    def trim(self):
+        """Drop the chunks every reader has, once no request can join any more"""
+        if self.joinable:
+            return
+        end = self.first + len(self.chunks)
+        drop = min(self.positions.values(), default=end) - self.first
+        if drop > 0:
+            self.buffered -= sum(len(chunk) for chunk in self.chunks[:drop])
+            del self.chunks[:drop]
+            self.first += drop
+            self.notify()
+
+
+class SingleFlight:
+    """Executions in flight by key, only used on the IOLoop"""
+
+    def __init__(self, max_join_bytes: int = 16 * 1024 * 1024):
+        self.max_join_bytes = max_join_bytes
+        self._flights: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self.executions = 0
+        self.saved = 0
+        self.abandoned = 0
+
+    async def run(
+        self,
+        key: str,
+        running: RunningQuery,
+        execute: Callable[[RunningQuery], Awaitable],
+        join: bool = True,
+    ) -> Tuple[Any, bool]:
+        """
+        Result of execute(running) for the execution of key, started unless one is in flight,
+        and whether it was another request's. Errors of the execution are raised to every
+        request waiting for it.
+
+        running: the request's RunningQuery, once cancelled this raises QueryCancelledError
+            without waiting for the execution
+        join: False starts a new execution even if one is in flight, e.g. for a refresh;
+            later requests join the new one
+        """
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key) if join else None
+        shared = flight is not None
+        if shared:
+            self.saved += 1
+            logger.info(
+                f"Request {running.request_id} shares the execution of"
+                f" {flight.running.request_id}"
+            )
+        else:
+            flight = _Flight(running, execute)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._finished(key, flight))
+            self.executions += 1
+        running.shared = flight.running
+        flight.waiters += 1
+
+        left = loop.create_future()
+
+        def leave(reason, status):
+            if not left.done():
+                left.set_exception(QueryCancelledError(reason, status))
+
+        running.on_cancel(
+            lambda reason, status: loop.call_soon_threadsafe(leave, reason, status)
+        )
+        try:
+            await asyncio.wait([flight.task, left], return_when=asyncio.FIRST_COMPLETED)
+            if flight.task.done():
+                return flight.task.result(), shared
+            return left.result(), shared
+        finally:
+            left.cancel()
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody is left to read the result
+                self.abandoned += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                loop.run_in_executor(
+                    None,
+                    flight.running.cancel,
+                    running.reason or "no request is waiting for the result",
+                    running.status or 409,
+                )
+
+    def stream(
+        self,
+        key: Optional[str],
+        running: RunningQuery,
+        produce: Callable[[RunningQuery, Callable[[bytes], Awaitable]], Awaitable],
+        join: bool = True,
+    ) -> Tuple[AsyncIterator[bytes], bool]:
+        """
+        The chunks of the streamed execution of key, started unless a joinable one is in
+        flight, and whether it was another request's. produce(running, push) runs the query
+        and awaits push(chunk) for each chunk. Errors of the execution are raised to every
+        reader once it has the chunks before. Close the iterator (aclose) when done with it.
+
+        key: None for an execution of its own, that nobody else joins
+        running, join: as for run()
+        """
+        flight = self._streams.get(key) if join and key is not None else None
+        shared = flight is not None and flight.joinable
+        if shared:
+            self.saved += 1
+            logger.info(
+                f"Request {running.request_id} shares the stream of"
+                f" {flight.running.request_id}"
+            )
+        else:
+            flight = _StreamFlight(
+                running, produce, self.max_join_bytes, joinable=key is not None
+            )
+            if key is not None:
+                self._streams[key] = flight
+            flight.task.add_done_callback(lambda task: self._stream_finished(key, flight))
+            self.executions += 1
+        running.shared = flight.running
+        reader = object()
+        flight.positions[reader] = flight.first
+        return self._read(key, flight, reader, running), shared
+
+    async def _read(
+        self, key: Optional[str], flight: _StreamFlight, reader, running: RunningQuery
+    ) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        left = loop.create_future()
+
+        def leave(reason, status):
+            if not left.done():
+                left.set_exception(QueryCancelledError(reason, status))
+
+        running.on_cancel(
+            lambda reason, status: loop.call_soon_threadsafe(leave, reason, status)
+        )
+        try:
+            position = flight.positions[reader]
+            while True:
+                if left.done():
+                    left.result()
+                if position < flight.first + len(flight.chunks):
+                    chunk = flight.chunks[position - flight.first]
+                    position += 1
+                    flight.advance(reader, position)
+                    yield chunk
+                elif flight.task.done():
+                    flight.task.result()
+                    return
+                else:
+                    await asyncio.wait(
+                        [flight.changed(), left], return_when=asyncio.FIRST_COMPLETED
+                    )
+        finally:
+            left.cancel()
+            flight.leave(reader)
+            if not flight.positions and not flight.task.done():
+                # Nobody is left to read the stream
+                self.abandoned += 1
+                if key is not None and self._streams.get(key) is flight:
+                    del self._streams[key]
+                loop.run_in_executor(
+                    None,
+                    flight.running.cancel,
+                    running.reason or "no request is reading the result",
+                    running.status or 409,
+                )
+
+    def _stream_finished(self, key: Optional[str], flight: _StreamFlight):
+        if key is not None and self._streams.get(key) is flight:
+            del self._streams[key]
+        flight.notify()
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def _finished(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Retrieved here in case every request left before it completed
+            flight.task.exception()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "streaming": len(self._streams),
+            "executions": self.executions,
+            "saved": self.saved,
+            "abandoned": self.abandoned,
+        }
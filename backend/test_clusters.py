@@ -0,0 +1,51 @@
+import pytest
+
+from clusters import ClusterRegistry
+
+DEFAULTS = {
+    "max_connections_per_key": 2,
+    "pool_idle_timeout": 60.0,
+    "pool_wait_timeout": 1.0,
+    "interactive_workers": 1,
+    "bulk_workers": 1,
+    "queue_limit": 10,
+}
+
+
+@pytest.fixture
+def registry():
+    registry = ClusterRegistry({}, DEFAULTS, max_adhoc=1)
+    yield registry
+    registry.shutdown()
+
+
+def is_shut_down(cluster):
+    return all(lane._pool._shutdown for lane in cluster.lanes.values())
+
+
+def test_adhoc_clusters_are_kept_per_host(registry):
+    cluster = registry.resolve(None, "trino-a", 443)
+    assert registry.resolve("ignored", "trino-a", 443) is cluster
+    assert registry.resolve(None, "trino-a", 8443) is not cluster
+
+
+def test_retired_cluster_is_shut_down_once_drained(registry):
+    first = registry.resolve(None, "trino-a", 443)
+    first.coordinators[0].in_flight = 1
+
+    registry.resolve(None, "trino-b", 443)
+    assert not is_shut_down(first)
+    assert "trino-a:443" in registry.metrics()
+
+    first.coordinators[0].in_flight = 0
+    registry.evict_idle()
+    assert is_shut_down(first)
+    assert "trino-a:443" not in registry.metrics()
+
+
+def test_retired_cluster_comes_back_while_still_busy(registry):
+    first = registry.resolve(None, "trino-a", 443)
+    first.coordinators[0].in_flight = 1
+    registry.resolve(None, "trino-b", 443)
+    assert registry.resolve(None, "trino-a", 443) is first
+    assert not is_shut_down(first)
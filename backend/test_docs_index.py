@@ -0,0 +1,78 @@
+import duckdb
+import pytest
+
+from docs_index import build_search_index, regex_terms, scan_search, search
+
+DOCS = {
+    "a.md": "total revenue by order id",
+    "b.md": "x marks the spot, colour of the sales",
+    "c.md": "orders table with customer_id",
+    "d.md": "Color report, revenue_id",
+}
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.execute(
+        "CREATE TABLE document"
+        " (path VARCHAR PRIMARY KEY, title VARCHAR, summary VARCHAR, content VARCHAR)"
+    )
+    for path, content in DOCS.items():
+        conn.execute("INSERT INTO document VALUES (?, ?, '', ?)", [path, path, content])
+    build_search_index(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize(
+    "pattern, terms",
+    [
+        ("revenue", ["revenue"]),
+        ("ORDER", ["order"]),
+        ("total revenue", ["revenue", "total"]),
+        ("colou?r", ["colo"]),
+        ("re(venue|port)", ["re", "port", "venue"]),
+        ("(sales|revenue) report", ["report", "revenue", "sales"]),
+        ("(?:total )?revenue", ["revenue"]),
+        ("ord(er)?s?", ["ord"]),
+        # An alternative or optional part without a word can match anything
+        ("(revenue|x)", []),
+        ("(?:orders|\\w+)", []),
+        ("(a|(b|.+))c", []),
+        (".", []),
+        ("[", []),
+    ],
+)
+def test_regex_terms(pattern, terms):
+    assert sorted(regex_terms(pattern)) == sorted(terms)
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "revenue",
+        "venue",
+        "_id",
+        "ORDER",
+        "colou?r",
+        "colo(u)?r",
+        "ord(er)?s?",
+        "re(venue|port)",
+        "(revenue|x)",
+        "(?:orders|\\w+)",
+        "(sales|revenue) report",
+        "(?:total )?revenue",
+        "\\bid\\b",
+    ],
+)
+def test_search_finds_what_a_scan_finds(conn, pattern):
+    found = sorted(row[0] for row in search(conn, pattern, 10))
+    assert found == sorted(row[0] for row in scan_search(conn, pattern, 10))
+
+
+def test_search_ranks_indexed_results(conn):
+    rows = search(conn, "revenue", 10)
+    assert {row[0] for row in rows} == {"a.md", "d.md"}
+    assert all(row[3] is not None for row in rows)
+    assert search(conn, ".", 10, indexed=True)[0][3] is None
@@ -0,0 +1,67 @@
+import pytest
+
+from metadata_cache import MetadataRequest, changes_metadata, parse_metadata_query
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("SHOW CATALOGS", MetadataRequest("catalogs", None, None, None)),
+        ("show catalogs;", MetadataRequest("catalogs", None, None, None)),
+        ("SHOW SCHEMAS", MetadataRequest("schemas", "hive", None, None)),
+        ("SHOW SCHEMAS FROM iceberg", MetadataRequest("schemas", "iceberg", None, None)),
+        ("SHOW TABLES", MetadataRequest("tables", "hive", "sales", None)),
+        ("SHOW TABLES IN finance", MetadataRequest("tables", "hive", "finance", None)),
+        (
+            "SHOW TABLES FROM iceberg.finance",
+            MetadataRequest("tables", "iceberg", "finance", None),
+        ),
+        ("DESCRIBE orders", MetadataRequest("columns", "hive", "sales", "orders")),
+        (
+            "describe finance.Orders",
+            MetadataRequest("columns", "hive", "finance", "orders"),
+        ),
+        (
+            'SHOW COLUMNS FROM "Iceberg"."fin ance"."a""b"',
+            MetadataRequest("columns", "iceberg", "fin ance", 'a"b'),
+        ),
+        (
+            "-- the schema browser\nDESCRIBE  /* x */ orders ;",
+            MetadataRequest("columns", "hive", "sales", "orders"),
+        ),
+    ],
+)
+def test_parse_metadata_query(query, expected):
+    assert parse_metadata_query(query, "Hive", "sales") == expected
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SHOW TABLES LIKE 'ord%'",
+        "SHOW STATS FOR orders",
+        "SHOW CREATE TABLE orders",
+        "DESCRIBE INPUT q",
+        "SELECT * FROM orders",
+        "DESCRIBE a.b.c.d",
+        "",
+        None,
+    ],
+)
+def test_parse_metadata_query_leaves_the_rest_to_trino(query):
+    assert parse_metadata_query(query, "hive", "sales") is None
+
+
+def test_parse_metadata_query_needs_a_catalog_and_schema():
+    assert parse_metadata_query("SHOW SCHEMAS", None, None) is None
+    assert parse_metadata_query("SHOW TABLES", "hive", None) is None
+    assert parse_metadata_query("DESCRIBE orders", "hive", None) is None
+    assert parse_metadata_query("DESCRIBE hive.sales.orders", None, None) == MetadataRequest(
+        "columns", "hive", "sales", "orders"
+    )
+
+
+def test_changes_metadata():
+    assert changes_metadata("CREATE TABLE t AS SELECT 1")
+    assert changes_metadata("/* etl */ drop table t")
+    assert not changes_metadata("SELECT * FROM created")
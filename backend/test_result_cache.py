@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+from result_cache import ResultCache, cache_key, is_cacheable, normalize_sql
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(
+        max_memory_bytes=100,
+        max_disk_bytes=1000,
+        spill_threshold=10,
+        max_entry_bytes=500,
+        spill_dir=str(tmp_path / "cache"),
+    )
+
+
+def payload(entry):
+    return b"".join(entry.chunks(4))
+
+
+def spill_files(cache):
+    return sorted(os.listdir(cache.spill_dir))
+
+
+def test_writer_keeps_a_small_result_in_memory(cache):
+    writer = cache.writer("k")
+    writer.write(b"abc")
+    writer.write(b"def")
+    assert writer.commit({"X-Compression": "zstd"})
+
+    entry = cache.get("k")
+    assert payload(entry) == b"abcdef"
+    assert entry.path is None
+    assert entry.headers == {"X-Compression": "zstd"}
+    assert spill_files(cache) == []
+
+
+def test_writer_spills_past_the_threshold(cache):
+    writer = cache.writer("k")
+    for _ in range(5):
+        writer.write(b"abcd")
+    assert writer.commit()
+
+    entry = cache.get("k")
+    assert payload(entry) == b"abcd" * 5
+    assert entry.path is not None
+    assert spill_files(cache) == [os.path.basename(entry.path)]
+
+
+def test_writer_is_abandoned_past_max_entry_bytes(cache):
+    writer = cache.writer("k")
+    for _ in range(200):
+        writer.write(b"abcd")
+    assert writer.abandoned
+    assert not writer.commit()
+    assert cache.get("k") is None
+    assert spill_files(cache) == []
+
+
+def test_abort_removes_the_partial_file(cache):
+    writer = cache.writer("k")
+    writer.write(b"x" * 50)
+    writer.abort()
+    assert not writer.commit()
+    assert spill_files(cache) == []
+
+
+def test_concurrent_writers_of_one_key_do_not_share_a_file(cache):
+    first = cache.writer("k")
+    second = cache.writer("k")
+    first.write(b"1" * 50)
+    second.write(b"2" * 50)
+    assert first.commit()
+    # The older entry goes, the file being committed stays
+    assert second.commit()
+    assert payload(cache.get("k")) == b"2" * 50
+    assert len(spill_files(cache)) == 1
+
+    cache.invalidate("k")
+    assert spill_files(cache) == []
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for key in "abc":
+        cache.put(key, b"x" * 10)
+    cache.get("a")
+    for key in "defghijk":
+        cache.put(key, b"x" * 10)
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.metrics()["memory_bytes"] <= 100
+
+
+def test_expired_entries_are_not_served(cache):
+    cache.put("k", b"abc", ttl=-1)
+    assert cache.get("k") is None
+    assert cache.metrics()["expirations"] == 1
+
+
+def test_normalize_sql_keys_equivalent_queries_alike():
+    assert normalize_sql("SELECT  1 -- one\n;") == "SELECT 1"
+    assert normalize_sql("SELECT '--  x' /* c */ ;") == "SELECT '--  x'"
+    assert cache_key("SELECT 1;", "c", "u", "p", "cat", "s", None) == cache_key(
+        "SELECT\n  1", "c", "u", "p", "cat", "s", None
+    )
+    assert cache_key("SELECT 1", "c", "u", "p", "cat", "s", None) != cache_key(
+        "SELECT 1", "c", "u", "other", "cat", "s", None
+    )
+
+
+def test_is_cacheable():
+    assert is_cacheable("/* dashboard */ WITH t AS (SELECT 1) SELECT * FROM t")
+    assert is_cacheable("(SELECT 1)")
+    assert not is_cacheable("INSERT INTO t SELECT 1")
@@ -0,0 +1,106 @@
+import os
+
+import pyarrow as pa
+import pytest
+from trino.dbapi import ColumnDescription
+
+from result_handles import ResultHandles
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.description = [ColumnDescription("n", "bigint", None, None, None, None, None)]
+        self.rows = list(rows)
+        self.cancelled = False
+
+    def fetchmany(self, size):
+        page, self.rows = self.rows[:size], self.rows[size:]
+        return page
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeLease:
+    def __init__(self):
+        self.released = []
+
+    def release(self, error=None):
+        self.released.append(error)
+
+
+class FakeRunning:
+    def check(self):
+        pass
+
+
+@pytest.fixture
+def handles(tmp_path):
+    return ResultHandles(spill_dir=str(tmp_path / "handles"))
+
+
+def fill(handles, handle, rows, batch_rows=2):
+    cursor = FakeCursor(rows)
+    lease = FakeLease()
+    handle.start(lease, cursor, FakeRunning(), batch_rows)
+    while handles.fetch_page(handle):
+        pass
+    return cursor, lease
+
+
+def read(handle, start, end):
+    return pa.ipc.open_stream(b"".join(handle.read(start, end, chunk_size=7))).read_all()
+
+
+def test_handle_ids_are_made_up_by_the_server(handles):
+    first = handles.create("alice", "SELECT 1")
+    second = handles.create("alice", "SELECT 1")
+    assert first.id != second.id
+    assert len(first.id) == 32 and int(first.id, 16) >= 0
+    assert os.path.dirname(first.path) == handles.spill_dir
+    assert handles.get(first.id) is first
+
+
+def test_batches_are_served_by_range(handles):
+    handle = handles.create("alice", "SELECT n")
+    cursor, lease = fill(handles, handle, [(i,) for i in range(7)])
+
+    assert handle.done and not handle.truncated and handle.error is None
+    assert [rows for _, _, rows in handle.batches] == [2, 2, 2, 1]
+    assert handle.num_rows == 7
+    assert lease.released == [None]
+    assert not cursor.cancelled
+
+    assert read(handle, 0, 4).column("n").to_pylist() == list(range(7))
+    assert read(handle, 1, 3).column("n").to_pylist() == [2, 3, 4, 5]
+    assert read(handle, 4, 9).num_rows == 0
+    assert read(handle, 4, 9).schema == handle.schema
+
+
+def test_handle_is_truncated_past_its_quota(tmp_path):
+    handles = ResultHandles(max_handle_bytes=1, spill_dir=str(tmp_path))
+    handle = handles.create("alice", "SELECT n")
+    cursor, lease = fill(handles, handle, [(i,) for i in range(100)], batch_rows=10)
+
+    assert handle.truncated and handle.done
+    assert handle.num_rows == 10
+    assert cursor.cancelled
+    assert lease.released == [None]
+    assert handles.metrics()["truncated"] == 1
+    assert read(handle, 0, 1).num_rows == 10
+
+
+def test_remove_and_expire_delete_the_spill_file(handles):
+    handle = handles.create("alice", "SELECT n")
+    fill(handles, handle, [(1,)])
+    assert os.path.exists(handle.path)
+    assert handles.remove(handle.id) is handle
+    assert not os.path.exists(handle.path)
+    assert handles.get(handle.id) is None
+
+    handle = handles.create("alice", "SELECT n")
+    fill(handles, handle, [(1,)])
+    handle.expires = 0
+    assert handles.expire() == [handle]
+    assert not os.path.exists(handle.path)
+    assert handles.metrics()["handles"] == 0
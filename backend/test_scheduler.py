@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from scheduler import FairShareExecutor, QueueFullError, choose_lane
+
+
+@pytest.fixture
+def lane():
+    lane = FairShareExecutor("test", max_workers=1, max_queue=4)
+    yield lane
+    lane.shutdown(wait=True)
+
+
+def block(lane):
+    """Occupy the lane's only worker until the returned event is set"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def run():
+        started.set()
+        release.wait(5)
+
+    future = lane.submit_for("blocker", run)
+    assert started.wait(5)
+    return release, future
+
+
+def test_queued_work_is_dispatched_round_robin_across_users(lane):
+    release, _ = block(lane)
+    order = []
+    futures = [
+        lane.submit_for(user, order.append, name)
+        for user, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]
+    ]
+    assert lane.metrics()["queued"] == 4
+    assert lane.metrics()["queued_users"] == 2
+
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ["a1", "b1", "a2", "a3"]
+    assert lane.metrics()["completed"] == 5
+
+
+def test_submit_raises_once_the_queue_is_full(lane):
+    release, _ = block(lane)
+    for _ in range(4):
+        lane.submit(lambda: None)
+    with pytest.raises(QueueFullError):
+        lane.submit(lambda: None)
+    assert lane.metrics()["rejected"] == 1
+    release.set()
+
+
+def test_cancelled_work_is_skipped(lane):
+    release, _ = block(lane)
+    ran = []
+    cancelled = lane.submit(ran.append, "cancelled")
+    kept = lane.for_user("a").submit(ran.append, "kept")
+    assert cancelled.cancel()
+    release.set()
+    kept.result(5)
+    assert ran == ["kept"]
+
+
+def test_exceptions_end_up_in_the_future(lane):
+    with pytest.raises(ZeroDivisionError):
+        lane.submit(lambda: 1 / 0).result(5)
+    assert lane.submit(lambda: 42).result(5) == 42
+
+
+@pytest.mark.parametrize(
+    "query, limit, lane_name",
+    [
+        ("show tables", None, "interactive"),
+        ("(describe orders)", None, "interactive"),
+        ("select * from system.runtime.queries", None, "interactive"),
+        ("select * from orders", 100, "interactive"),
+        ("select * from orders limit 10", None, "interactive"),
+        ("select * from orders limit 10", 1000000, "bulk"),
+        ("select * from orders", None, "bulk"),
+    ],
+)
+def test_choose_lane(query, limit, lane_name):
+    assert choose_lane(query, limit, small_query_rows=1000) == lane_name
@@ -0,0 +1,128 @@
+import datetime
+import decimal
+import uuid
+
+import pyarrow as pa
+import pytest
+from trino.dbapi import ColumnDescription
+
+from trino_arrow import ArrowBatchStream, create_converter, parse_trino_type
+
+
+def describe(*columns):
+    return [
+        ColumnDescription(name, type_code, None, None, None, None, None)
+        for name, type_code in columns
+    ]
+
+
+class FakeCursor:
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = list(rows)
+        self.cancelled = False
+
+    def fetchmany(self, size):
+        page, self.rows = self.rows[:size], self.rows[size:]
+        return page
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.mark.parametrize(
+    "type_code, arrow_type",
+    [
+        ("bigint", pa.int64()),
+        ("varchar(10)", pa.string()),
+        ("decimal(12,2)", pa.decimal128(12, 2)),
+        ("decimal(50,2)", pa.string()),
+        ("timestamp(3)", pa.timestamp("us")),
+        ("timestamp(6) with time zone", pa.timestamp("us", tz="UTC")),
+        ("time(3) with time zone", pa.string()),
+        ("array(integer)", pa.list_(pa.int32())),
+        ("map(varchar, array(double))", pa.map_(pa.string(), pa.list_(pa.float64()))),
+        (
+            'row(a integer, "b c" varchar, decimal(10,2))',
+            pa.struct(
+                [
+                    pa.field("a", pa.int32()),
+                    pa.field("b c", pa.string()),
+                    pa.field("field2", pa.decimal128(10, 2)),
+                ]
+            ),
+        ),
+        ("uuid", pa.string()),
+        (None, pa.string()),
+    ],
+)
+def test_parse_trino_type(type_code, arrow_type):
+    assert parse_trino_type(type_code) == arrow_type
+
+
+def test_native_converter_keeps_trino_types():
+    converter = create_converter(
+        "native",
+        describe(
+            ("id", "bigint"),
+            ("amount", "decimal(10,2)"),
+            ("at", "timestamp(3) with time zone"),
+            ("tags", "map(varchar, integer)"),
+            ("id", "uuid"),
+        ),
+    )
+    at = datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+    key = uuid.UUID(int=1)
+    batch = converter.convert(
+        [
+            (1, decimal.Decimal("12.34"), at, {"a": 1}, key),
+            (2, None, None, None, None),
+        ]
+    )
+    assert batch.schema.names == ["id", "amount", "at", "tags", "id_2"]
+    assert batch.schema.field("amount").type == pa.decimal128(10, 2)
+    assert batch.column(0).to_pylist() == [1, 2]
+    assert batch.column(1).to_pylist() == [decimal.Decimal("12.34"), None]
+    assert batch.column(2).to_pylist()[0] == at
+    assert batch.column(3).to_pylist() == [[("a", 1)], None]
+    # Values without an Arrow type of their own end up as strings
+    assert batch.column(4).to_pylist() == [str(key), None]
+
+
+def test_native_converter_keeps_the_schema_of_an_empty_result():
+    converter = create_converter("native", describe(("n", "integer")))
+    assert converter.convert([]).schema == pa.schema([pa.field("n", pa.int32())])
+
+
+def test_unknown_converter():
+    with pytest.raises(ValueError):
+        create_converter("polars", describe(("n", "integer")))
+
+
+def test_arrow_batch_stream_pages_through_the_cursor():
+    cursor = FakeCursor(describe(("n", "integer")), [(i,) for i in range(5)])
+    closed = []
+    stream = ArrowBatchStream(cursor, batch_rows=2, on_close=closed.append)
+
+    chunks = []
+    chunk = stream.next_chunk()
+    while chunk is not None:
+        chunks.append(chunk)
+        chunk = stream.next_chunk()
+    stream.close()
+
+    assert len(chunks) == 3
+    table = pa.ipc.open_stream(b"".join(chunks)).read_all()
+    assert table.column("n").to_pylist() == [0, 1, 2, 3, 4]
+    assert [len(b) for b in table.to_batches()] == [2, 2, 1]
+    assert not cursor.cancelled
+    assert closed == [None]
+
+
+def test_arrow_batch_stream_cancels_an_abandoned_query():
+    cursor = FakeCursor(describe(("n", "integer")), [(i,) for i in range(5)])
+    stream = ArrowBatchStream(cursor, batch_rows=2, compression="zstd")
+    stream.next_chunk()
+    stream.close()
+    assert cursor.cancelled
+    assert stream.next_chunk() is None
@@ -0,0 +1,384 @@
+"""
+Conversion of Trino query results into Arrow record batches and IPC streams
+"""
+
+import json
+import logging
+import re
+import struct
+import time
+from typing import Any, Callable, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+_DECIMAL_RE = re.compile(r"^decimal\((\d+),\s*(\d+)\)$")
+_PRECISION_RE = re.compile(r"^(timestamp|time)(?:\((\d+)\))?( with time zone)?$")
+
+_PRIMITIVE_TYPES = {
+    "boolean": pa.bool_(),
+    "tinyint": pa.int8(),
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "real": pa.float32(),
+    "double": pa.float64(),
+    "varbinary": pa.binary(),
+    "date": pa.date32(),
+    "interval day to second": pa.duration("us"),
+    "unknown": pa.null(),
+}
+
+
+def unique_column_names(names: Sequence[str]) -> List[str]:
+    """Suffix repeated column names with _2, _3, ... so they can be used as Arrow field names"""
+    counts = {}
+    unique = []
+    for name in names:
+        if name in counts:
+            counts[name] += 1
+            unique.append(name + "_" + str(counts[name]))
+        else:
+            counts[name] = 1
+            unique.append(name)
+    return unique
+
+
+def rename_duplicate_columns(df):
+    df.columns = unique_column_names(df.columns)
+    return df
+
+
+def sanitize_df(df):
+    df = rename_duplicate_columns(df)
+
+    if len(df) <= 0:
+        return df
+
+    # Force object types to string, if they are not already
+    ts = df.dtypes
+    for k in ts.keys():
+        if ts[k] == "object" and not isinstance(df[k][0], str):
+            logger.debug(f"Forcing column {k} to string")
+            df[k] = df[k].astype(str)
+
+    return df
+
+
+def _split_type_arguments(arguments: str) -> List[str]:
+    """Split the inside of e.g. 'row(a integer, b map(varchar, bigint))' on top level commas"""
+    parts = []
+    depth = 0
+    quoted = False
+    current = ""
+    for ch in arguments:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _split_row_field(field: str, index: int):
+    """Split a row field definition into (name, type), Trino allows anonymous fields"""
+    if field.startswith('"'):
+        end = field.index('"', 1)
+        return field[1:end], field[end + 1 :].strip()
+
+    name, _, rest = field.partition(" ")
+    # Anonymous field, e.g. row(integer, varchar) or row(decimal(10,2))
+    if not rest or "(" in name or parse_trino_type(field) != pa.string():
+        return f"field{index}", field
+    return name, rest
+
+
+def parse_trino_type(type_code: Optional[str]) -> pa.DataType:
+    """
+    Map a Trino type signature (cursor.description type_code) to an Arrow type
+
+    Types without a faithful Arrow equivalent (varchar, json, uuid, ipaddress, time with time
+    zone, interval year to month, ...) map to string.
+    """
+    if not type_code:
+        return pa.string()
+    type_code = type_code.strip()
+    base = type_code.split("(", 1)[0].strip()
+
+    if base in _PRIMITIVE_TYPES and "(" not in type_code:
+        return _PRIMITIVE_TYPES[base]
+
+    if base == "decimal":
+        match = _DECIMAL_RE.match(type_code)
+        if match and int(match.group(1)) <= 38:
+            return pa.decimal128(int(match.group(1)), int(match.group(2)))
+        return pa.string()
+
+    match = _PRECISION_RE.match(type_code)
+    if match:
+        kind, _, with_tz = match.groups()
+        if kind == "timestamp":
+            # The Trino client hands out Python datetimes, so microseconds is the finest unit
+            return pa.timestamp("us", tz="UTC" if with_tz else None)
+        if not with_tz:
+            return pa.time64("us")
+        return pa.string()
+
+    if base in ("array", "map", "row") and type_code.endswith(")"):
+        arguments = _split_type_arguments(type_code[type_code.index("(") + 1 : -1])
+        if base == "array" and len(arguments) == 1:
+            return pa.list_(parse_trino_type(arguments[0]))
+        if base == "map" and len(arguments) == 2:
+            return pa.map_(parse_trino_type(arguments[0]), parse_trino_type(arguments[1]))
+        if base == "row":
+            fields = [_split_row_field(field, i) for i, field in enumerate(arguments)]
+            return pa.struct(
+                [pa.field(name, parse_trino_type(t)) for name, t in fields]
+            )
+
+    return pa.string()
+
+
+def schema_from_description(description) -> pa.Schema:
+    """Build an Arrow schema from a DB-API cursor description"""
+    names = unique_column_names([cd.name for cd in description])
+    return pa.schema(
+        [pa.field(name, parse_trino_type(cd.type_code)) for name, cd in zip(names, description)]
+    )
+
+
+def _to_string(value: Any) -> Any:
+    if value is None or isinstance(value, str):
+        return value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _stringify_nested(value: Any, arrow_type: pa.DataType) -> Any:
+    """Recursively turn values destined for string fields into strings"""
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        return _to_string(value)
+    if pa.types.is_list(arrow_type):
+        return [_stringify_nested(v, arrow_type.value_type) for v in value]
+    if pa.types.is_map(arrow_type):
+        return [
+            (
+                _stringify_nested(k, arrow_type.key_type),
+                _stringify_nested(v, arrow_type.item_type),
+            )
+            for k, v in value.items()
+        ]
+    if pa.types.is_struct(arrow_type):
+        return {
+            arrow_type.field(i).name: _stringify_nested(v, arrow_type.field(i).type)
+            for i, v in enumerate(value)
+        }
+    return value
+
+
+def _needs_stringify(arrow_type: pa.DataType) -> bool:
+    if pa.types.is_string(arrow_type):
+        return True
+    if pa.types.is_list(arrow_type):
+        return _needs_stringify(arrow_type.value_type)
+    if pa.types.is_map(arrow_type):
+        return _needs_stringify(arrow_type.key_type) or _needs_stringify(
+            arrow_type.item_type
+        )
+    if pa.types.is_struct(arrow_type):
+        return any(_needs_stringify(field.type) for field in arrow_type)
+    return False
+
+
+class NativeBatchConverter:
+    """
+    Builds Arrow record batches straight from Trino client rows, without going through pandas.
+
+    The schema is derived once from the cursor description so every batch of a result has the
+    same, properly typed schema (decimal128, timestamp[tz], list, map, struct).
+    """
+
+    def __init__(self, description):
+        self.schema = schema_from_description(description)
+        self._stringify = [_needs_stringify(field.type) for field in self.schema]
+
+    def convert(self, rows: Sequence[Sequence[Any]]) -> pa.RecordBatch:
+        arrays = []
+        for i, field in enumerate(self.schema):
+            column = [row[i] for row in rows]
+            try:
+                arrays.append(pa.array(column, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+                # e.g. uuid, ipaddress or time with time zone values bound for a string field
+                if not self._stringify[i]:
+                    raise
+                column = [_stringify_nested(v, field.type) for v in column]
+                arrays.append(pa.array(column, type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+class PandasBatchConverter:
+    """
+    Builds Arrow record batches via a sanitized pandas DataFrame (the original conversion path).
+
+    The schema is inferred from the first batch and later batches are coerced to it.
+    """
+
+    def __init__(self, description):
+        self.columns = [cd.name for cd in description]
+        self.schema = None
+
+    def convert(self, rows: Sequence[Sequence[Any]]) -> pa.RecordBatch:
+        df = sanitize_df(pd.DataFrame.from_records(rows, columns=self.columns))
+        if self.schema is None:
+            batch = pa.RecordBatch.from_pandas(df, preserve_index=False)
+            self.schema = batch.schema
+            return batch
+        return pa.RecordBatch.from_pandas(df, schema=self.schema, preserve_index=False)
+
+
+CONVERTERS = {
+    "native": NativeBatchConverter,
+    "pandas": PandasBatchConverter,
+}
+
+
+def create_converter(name: str, description):
+    if name not in CONVERTERS:
+        raise ValueError(
+            f"Unsupported converter: {name}. Supported converters: {', '.join(CONVERTERS)}"
+        )
+    return CONVERTERS[name](description)
+
+
+def encode_frame_header(header: dict, length: int) -> bytes:
+    """
+    Header of one frame in a multiplexed response (/trino/batch): a 4 byte big-endian length,
+    then that many bytes of UTF-8 JSON header, which carries the length of the payload (an
+    Arrow IPC stream, possibly empty) that follows it.
+    """
+    encoded = json.dumps({**header, "length": length}).encode("utf-8")
+    return struct.pack(">I", len(encoded)) + encoded
+
+
+class IPCChunkSink:
+    """File-like sink for the Arrow IPC writer that hands out bytes as they are produced"""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ArrowBatchStream:
+    """
+    Converts an executed Trino cursor into Arrow IPC stream chunks, one fetch page at a time.
+
+    Each call to next_chunk() fetches up to batch_rows rows and returns the IPC bytes for that
+    record batch (the schema message is emitted with the first one). The end-of-stream marker is
+    appended once the cursor is exhausted, after which next_chunk() returns None.
+
+    close() must be called when the caller is done with the stream; on_close(error) is invoked
+    from there, e.g. to hand the connection back to its pool.
+
+    With compression ("lz4" or "zstd") the record batch buffers are compressed by the IPC
+    writer. raw_bytes, encoded_bytes and write_seconds track how well that went.
+    """
+
+    def __init__(
+        self,
+        cursor,
+        batch_rows: int,
+        converter: str = "native",
+        on_close: Optional[Callable[[Optional[BaseException]], None]] = None,
+        compression: Optional[str] = None,
+    ):
+        self.cursor = cursor
+        self.on_close = on_close
+        self.batch_rows = batch_rows
+        self.converter = create_converter(converter, cursor.description)
+        self.compression = compression
+        self.schema = None
+        self.sink = IPCChunkSink()
+        self.writer = None
+        self.done = False
+        self.raw_bytes = 0
+        self.encoded_bytes = 0
+        self.write_seconds = 0.0
+
+    def next_chunk(self) -> Optional[bytes]:
+        if self.done:
+            return None
+
+        rows = self.cursor.fetchmany(self.batch_rows)
+        batch = self.converter.convert(rows)
+
+        if self.writer is None:
+            self.schema = batch.schema
+            logger.debug(f"Arrow schema {self.schema}")
+            self.writer = pa.ipc.new_stream(
+                self.sink,
+                self.schema,
+                options=pa.ipc.IpcWriteOptions(compression=self.compression),
+            )
+
+        if batch.num_rows > 0:
+            started = time.perf_counter()
+            self.writer.write_batch(batch)
+            self.write_seconds += time.perf_counter() - started
+            self.raw_bytes += batch.nbytes
+
+        # fetchmany only comes back short once the result is exhausted
+        if len(rows) < self.batch_rows:
+            self.writer.close()
+            self.done = True
+
+        chunk = self.sink.drain()
+        self.encoded_bytes += len(chunk)
+        return chunk
+
+    def close(self, error: Optional[BaseException] = None):
+        """Cancel the query if its result was not read to the end and release resources"""
+        if not self.done:
+            self.done = True
+            try:
+                self.cursor.cancel()
+            except Exception as e:
+                logger.warning(f"Error cancelling abandoned query: {e}")
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            on_close(error)
+
+    def read_all(self) -> bytes:
+        """Drain the remaining result into a single IPC stream buffer"""
+        chunks = []
+        chunk = self.next_chunk()
+        while chunk is not None:
+            chunks.append(chunk)
+            chunk = self.next_chunk()
+        return b"".join(chunks)
@@ -0,0 +1,203 @@
+"""
+Conversion of Trino query results into JSON, row-oriented or columnar, one fetch page at a time
+"""
+
+import base64
+import datetime
+import decimal
+import json
+import logging
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("json", "json-columnar")
+
+
+def _base64(value: bytes) -> str:
+    return base64.b64encode(value).decode("ascii")
+
+
+def _isoformat_column(values: list) -> list:
+    return [None if v is None else v.isoformat() for v in values]
+
+
+def _str_column(values: list) -> list:
+    return [None if v is None else str(v) for v in values]
+
+
+def _base64_column(values: list) -> list:
+    return [None if v is None else _base64(v) for v in values]
+
+
+def _seconds_column(values: list) -> list:
+    return [None if v is None else v.total_seconds() for v in values]
+
+
+def _json_default(value: Any) -> Any:
+    """Fallback for values nested inside arrays, maps and rows"""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return _base64(value)
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return str(value)
+
+
+def column_formatter(type_code: Optional[str]) -> Optional[Callable[[list], list]]:
+    """
+    The function turning a column of Trino values into JSON values in one pass, None if they
+    already are. Decimals are rendered as strings so no precision is lost.
+    """
+    base = (type_code or "").lower().split("(", 1)[0].strip()
+    if base in ("date", "time", "timestamp"):
+        return _isoformat_column
+    if base == "decimal":
+        return _str_column
+    if base == "varbinary":
+        return _base64_column
+    if base == "interval day to second":
+        return _seconds_column
+    return None
+
+
+def convert_columns(rows, formatters: List[Optional[Callable]]) -> List[list]:
+    """Transpose a page of rows into columns, formatting each column in a single pass"""
+    if not rows:
+        return [[] for _ in formatters]
+    columns = [list(column) for column in zip(*rows)]
+    for i, fmt in enumerate(formatters):
+        if fmt is not None:
+            columns[i] = fmt(columns[i])
+    return columns
+
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, default=_json_default, separators=(",", ":"))
+
+
+class JsonBatchStream:
+    """
+    Converts an executed Trino cursor into JSON text chunks, with the same interface as
+    ArrowBatchStream.
+
+    format "json" produces {"columns", "types", "query", "rows": [{column: value}, ...], ...}
+    and is emitted page by page, so only one page of rows is ever held in memory.
+
+    format "json-columnar" produces {"columns", "types", "query", "data": [[col0...], ...]}.
+    Column-major output can only be written once the last row is known, so each page is
+    serialised per column straight away and only the JSON text is kept until the end.
+
+    The first page is fetched before anything is returned, errors in the query itself
+    surface before the response has started.
+    """
+
+    def __init__(
+        self,
+        cursor,
+        batch_rows: int,
+        format: str = "json",
+        query: Optional[str] = None,
+        on_close: Optional[Callable[[Optional[BaseException]], None]] = None,
+    ):
+        if format not in FORMATS:
+            raise ValueError(
+                f"Unsupported format: {format}. Supported formats: {', '.join(FORMATS)}"
+            )
+        self.cursor = cursor
+        self.batch_rows = batch_rows
+        self.format = format
+        self.query = query
+        self.on_close = on_close
+        self.columns = [cd.name for cd in cursor.description]
+        self.types = [cd.type_code for cd in cursor.description]
+        self.formatters = [column_formatter(t) for t in self.types]
+        self.started = False
+        self.done = False
+        self.exhausted = False
+        self._pending = []
+
+    def _header(self) -> str:
+        return (
+            "{"
+            f'"columns":{dumps(self.columns)},'
+            f'"types":{dumps(self.types)},'
+            f'"query":{dumps(self.query)},'
+            '"error":null,"connectionTested":true,'
+        )
+
+    def _fetch(self) -> List[list]:
+        rows = self.cursor.fetchmany(self.batch_rows)
+        # fetchmany only comes back short once the result is exhausted
+        if len(rows) < self.batch_rows:
+            self.exhausted = True
+        return convert_columns(rows, self.formatters)
+
+    def _rows_chunk(self, columns: List[list]) -> str:
+        rows = [dict(zip(self.columns, values)) for values in zip(*columns)]
+        text = dumps(rows)[1:-1]
+        if text and self.started:
+            text = "," + text
+        return text
+
+    def next_chunk(self) -> Optional[bytes]:
+        if self.done:
+            return None
+
+        if self.format == "json-columnar":
+            return self._next_columnar_chunk()
+
+        chunk = self._rows_chunk(self._fetch())
+        if not self.started:
+            chunk = self._header() + '"rows":[' + chunk
+            self.started = True
+        if self.exhausted:
+            chunk += "]}"
+            self.done = True
+        return chunk.encode("utf-8")
+
+    def _next_columnar_chunk(self) -> bytes:
+        if not self.started:
+            fragments = [[] for _ in self.columns]
+            while not self.exhausted:
+                for i, column in enumerate(self._fetch()):
+                    if column:
+                        fragments[i].append(dumps(column)[1:-1])
+            self._pending = [f"[{','.join(parts)}]" for parts in fragments]
+            self.started = True
+            chunk = self._header() + '"data":['
+            if self._pending:
+                chunk += self._pending.pop(0)
+        elif self._pending:
+            chunk = "," + self._pending.pop(0)
+        else:
+            chunk = ""
+        # One column per chunk keeps the writes bounded for wide results
+        if not self._pending:
+            chunk += "]}"
+            self.done = True
+        return chunk.encode("utf-8")
+
+    def close(self, error: Optional[BaseException] = None):
+        """Cancel the query if its result was not read to the end and release resources"""
+        self.done = True
+        if not self.exhausted:
+            self.exhausted = True
+            try:
+                self.cursor.cancel()
+            except Exception as e:
+                logger.warning(f"Error cancelling abandoned query: {e}")
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            on_close(error)
+
+    def read_all(self) -> bytes:
+        chunks = []
+        chunk = self.next_chunk()
+        while chunk is not None:
+            chunks.append(chunk)
+            chunk = self.next_chunk()
+        return b"".join(chunks)
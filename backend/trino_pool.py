@@ -0,0 +1,309 @@
+"""
+Bounded pool of Trino DB-API connections, keyed by connection identity and credentials
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import trino
+from trino.auth import BasicAuthentication
+from trino.exceptions import TrinoUserError
+
+logger = logging.getLogger(__name__)
+
+
+def credentials_hash(password: Optional[str], extra_credential) -> str:
+    """Hash the secret parts of a connection so they never appear in pool keys or logs"""
+    digest = hashlib.sha256()
+    digest.update((password or "").encode("utf-8"))
+    for name, value in sorted(extra_credential or []):
+        digest.update(b"\0" + str(name).encode("utf-8") + b"=" + str(value).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def session_state(conn) -> Optional[Tuple]:
+    """
+    What statements like USE, SET SESSION, SET ROLE, PREPARE or SET SESSION AUTHORIZATION
+    change of a connection's client session, None for connections without one
+    """
+    session = getattr(conn, "_client_session", None)
+    if session is None:
+        return None
+    return (
+        session.authorization_user,
+        session.catalog,
+        session.schema,
+        tuple(sorted(session.properties.items())),
+        tuple(sorted(session.roles.items())),
+        tuple(sorted(session.prepared_statements.items())),
+        session.transaction_id,
+    )
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection became available within the wait timeout"""
+
+
+class _PooledConnection:
+    def __init__(self, conn, session):
+        self.conn = conn
+        # Client session state when the connection was opened
+        self.session = session
+        self.last_used = time.monotonic()
+
+
+class TrinoConnectionPool:
+    """
+    Keeps idle Trino connections (and with them their HTTP sessions and TLS state) for reuse.
+
+    At most max_per_key connections exist per key, further callers wait up to wait_timeout
+    seconds for one to be released. Connections idle for longer than idle_timeout are closed by
+    evict_idle(), and a connection idle for longer than health_check_interval is probed with
+    SELECT 1 before it is handed out again. A connection whose client session was changed by
+    the query on it (USE, SET SESSION, ...) is closed on release rather than handed to the next
+    request of its key.
+    """
+
+    def __init__(
+        self,
+        max_per_key: int = 8,
+        idle_timeout: float = 300.0,
+        wait_timeout: float = 30.0,
+        health_check_interval: float = 60.0,
+    ):
+        self.max_per_key = max_per_key
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Condition()
+        self._idle: Dict[Tuple, List[_PooledConnection]] = {}
+        self._open: Dict[Tuple, int] = {}
+        # id(connection): client session state it was opened with, for checked out connections
+        self._sessions: Dict[int, Optional[Tuple]] = {}
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.evictions = 0
+        self.failed_health_checks = 0
+        self.changed_sessions = 0
+
+    def _key(self, host, port, user, password, catalog, schema, extra_credential, kwargs):
+        return (
+            host,
+            port,
+            user,
+            catalog,
+            schema,
+            credentials_hash(password, extra_credential),
+            tuple(sorted((k, repr(v)) for k, v in kwargs.items())),
+        )
+
+    def acquire(
+        self,
+        host,
+        port,
+        user,
+        password,
+        catalog,
+        schema,
+        extra_credential=None,
+        **kwargs,
+    ):
+        """Check out a connection, returns (key, connection). Pair with release()."""
+        key = self._key(
+            host, port, user, password, catalog, schema, extra_credential, kwargs
+        )
+
+        with self._lock:
+            started = None
+            while True:
+                if self._closed:
+                    raise RuntimeError("Trino connection pool is shut down")
+
+                idle = self._idle.get(key)
+                if idle:
+                    pooled = idle.pop()
+                    self.hits += 1
+                    break
+
+                if self._open.get(key, 0) < self.max_per_key:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    self.misses += 1
+                    pooled = None
+                    break
+
+                if started is None:
+                    started = time.monotonic()
+                    self.waits += 1
+                remaining = self.wait_timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.wait_time += time.monotonic() - started
+                    raise PoolTimeoutError(
+                        f"Timed out waiting for a Trino connection to {host}:{port} as {user}"
+                    )
+                self._lock.wait(remaining)
+
+            if started is not None:
+                self.wait_time += time.monotonic() - started
+
+        if pooled is not None:
+            if time.monotonic() - pooled.last_used > self.health_check_interval:
+                if not self._healthy(pooled.conn):
+                    self.failed_health_checks += 1
+                    self._close_quietly(pooled.conn)
+                    pooled = None
+                    # The slot stays counted, reuse it for a fresh connection
+            if pooled is not None:
+                with self._lock:
+                    self._sessions[id(pooled.conn)] = pooled.session
+                return key, pooled.conn
+
+        try:
+            conn = trino.dbapi.connect(
+                host=host,
+                port=port,
+                user=user,
+                auth=BasicAuthentication(user, password)
+                if password and password != ""
+                else None,
+                catalog=catalog,
+                schema=schema,
+                extra_credential=extra_credential,
+                **kwargs,
+            )
+        except Exception:
+            self._forget(key)
+            raise
+        with self._lock:
+            self._sessions[id(conn)] = session_state(conn)
+        return key, conn
+
+    def release(self, key, conn, error: Optional[BaseException] = None):
+        """
+        Return a connection to the pool. If the query on it failed with anything other than a
+        Trino query error (syntax, permissions, ...) the connection may be broken and is closed.
+        So is a connection whose session the query changed, the next request of the key would
+        inherit its catalog, schema, session properties or authorization.
+        """
+        with self._lock:
+            session = self._sessions.pop(id(conn), None)
+        if error is not None and not isinstance(error, TrinoUserError):
+            self._close_quietly(conn)
+            self._forget(key)
+            return
+        if session_state(conn) != session:
+            logger.info("Closing a Trino connection whose session was changed by its query")
+            with self._lock:
+                self.changed_sessions += 1
+            self._close_quietly(conn)
+            self._forget(key)
+            return
+
+        with self._lock:
+            if self._closed:
+                self._close_quietly(conn)
+                self._forget(key)
+                return
+            pooled = _PooledConnection(conn, session)
+            self._idle.setdefault(key, []).append(pooled)
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, *args, **kwargs):
+        """Context manager around acquire()/release()"""
+        key, conn = self.acquire(*args, **kwargs)
+        try:
+            yield conn
+        except BaseException as e:
+            self.release(key, conn, e)
+            raise
+        else:
+            self.release(key, conn)
+
+    def evict_idle(self):
+        """Close connections that have not been used for idle_timeout seconds"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, idle in self._idle.items():
+                keep = []
+                for pooled in idle:
+                    if now - pooled.last_used > self.idle_timeout:
+                        expired.append(pooled.conn)
+                        self._open[key] -= 1
+                    else:
+                        keep.append(pooled)
+                idle[:] = keep
+            self._idle = {k: v for k, v in self._idle.items() if v}
+            self._open = {k: v for k, v in self._open.items() if v > 0}
+            self.evictions += len(expired)
+            if expired:
+                self._lock.notify_all()
+
+        for conn in expired:
+            self._close_quietly(conn)
+        if expired:
+            logger.info(f"Evicted {len(expired)} idle Trino connections")
+
+    def close_all(self):
+        """Close every idle connection and refuse new checkouts, used on shutdown"""
+        with self._lock:
+            self._closed = True
+            idle = [p.conn for conns in self._idle.values() for p in conns]
+            for key, conns in self._idle.items():
+                self._open[key] = self._open.get(key, 0) - len(conns)
+            self._open = {k: v for k, v in self._open.items() if v > 0}
+            self._idle = {}
+            self._lock.notify_all()
+
+        for conn in idle:
+            self._close_quietly(conn)
+        logger.info(f"Closed {len(idle)} pooled Trino connections")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_time_s": round(self.wait_time, 3),
+                "evictions": self.evictions,
+                "failed_health_checks": self.failed_health_checks,
+                "changed_sessions": self.changed_sessions,
+                "open": sum(self._open.values()),
+                "idle": sum(len(v) for v in self._idle.values()),
+                "keys": len(self._open),
+            }
+
+    def _forget(self, key):
+        with self._lock:
+            self._open[key] = self._open.get(key, 1) - 1
+            if self._open[key] <= 0:
+                del self._open[key]
+            self._lock.notify()
+
+    @staticmethod
+    def _healthy(conn) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchall()
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled Trino connection failed health check: {e}")
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Error closing Trino connection: {e}")
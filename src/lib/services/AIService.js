@@ -19,7 +19,8 @@ The user will be able to see the full results of the query.
 
 - Today's date is {{today}}.
 - DO NOT generate data modification queries (INSERT, DELETE, DROP, UPDATE, TRUNCATE, etc.)
-- Use the "search" and "retrieve_doc" functions to access knowledge and sample queries. Start here before running metadata exploration queries. Always read the "glossary.md" file.
+- Use the "semantic_search", "search" and "retrieve_doc" functions to access knowledge and sample queries. "semantic_search" answers a question with the relevant passages directly. Start here before running metadata exploration queries. Always read the "glossary.md" file.
+- Call several functions in one turn when they do not depend on each other's results (e.g. several searches, documents or DESCRIBE queries), they run in parallel.
 - Where necessary, use DESCRIBE <table> and SHOW TABLES FROM <schema>, SHOW SCHEMAS FROM <catalog> and SHOW CATALOGS for table metadata and schema discovery where needed
 - For Malloy queries, include all necessary model definitions, imports, and experimental parameter settings in the query.
 
@@ -102,17 +103,24 @@ Key points:
   }
 
   /**
-   * Send a chat message to the AI and handle function calls
+   * Send a chat message to the AI and handle function calls.
+   * With onDelta the answer is streamed: onDelta(textSoFar) is called as it grows and can
+   * return false to stop the generation.
+   * options.agent lets the server run the tools it can itself, returning them as steps;
+   * options.trino ({environment, user, password, extraCredentials}) allows metadata queries.
    */
-  async sendMessage(messages, model, user) {
+  async sendMessage(messages, model, user, onDelta, options = {}) {
     try {
-      const body = { messages };
+      const body = { messages, ...options };
       if (model) {
         body.model = model;
       }
       if (user) {
         body.user = user;
       }
+      if (onDelta) {
+        body.stream = true;
+      }
 
       const response = await fetch(`${this.baseUrl}/ai/chat`, {
         method: "POST",
@@ -127,7 +135,9 @@ Key points:
         throw new Error(errorData.error || `HTTP ${response.status}`);
       }
 
-      const result = await response.json();
+      const result = onDelta
+        ? await this.readChatStream(response, onDelta)
+        : await response.json();
 
       return {
         success: true,
@@ -141,6 +151,55 @@ Key points:
     }
   }
 
+  /**
+   * Read the server-sent events of a streamed chat completion, returning the final "done"
+   * event, which has the same fields as a non-streamed response
+   */
+  async readChatStream(response, onDelta) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let text = "";
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) {
+        throw new Error("Chat stream ended before the completion was done");
+      }
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) >= 0) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const data = block
+          .split("\n")
+          .filter((line) => line.startsWith("data: "))
+          .map((line) => line.slice(6))
+          .join("\n");
+        if (!data) continue;
+
+        const event = JSON.parse(data);
+        if (event.type === "tool_result") {
+          // The text so far went with a tool call the server ran, the answer follows
+          text = "";
+        } else if (event.type === "delta") {
+          text += event.text;
+          if (onDelta(text) === false) {
+            await reader.cancel();
+            return { text, function_call: null };
+          }
+        } else if (event.type === "error") {
+          await reader.cancel();
+          throw new Error(event.error);
+        } else if (event.type === "done") {
+          await reader.cancel();
+          return event;
+        }
+      }
+    }
+  }
+
   /**
    * Search knowledge files by regex against file contents
    */
@@ -180,9 +239,10 @@ Key points:
   /**
    * List knowledge files by filename prefix
    */
-  async ls(prefix, user) {
+  async ls(prefix, user, options = {}) {
     try {
-      const body = { prefix: prefix ?? "" };
+      // options: offset, limit
+      const body = { prefix: prefix ?? "", ...options };
       if (user) {
         body.user = user;
       }
@@ -213,12 +273,49 @@ Key points:
     }
   }
 
+  /**
+   * Search knowledge files by meaning, the k chunks closest to the query
+   */
+  async semanticSearch(query, k, user) {
+    try {
+      const body = { query, k };
+      if (user) {
+        body.user = user;
+      }
+      const response = await fetch(`${this.baseUrl}/ai/semantic_search`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify(body),
+      });
+
+      if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.error || `HTTP ${response.status}`);
+      }
+
+      const yamlContent = await response.text();
+
+      return {
+        success: true,
+        content: yamlContent,
+      };
+    } catch (error) {
+      return {
+        success: false,
+        error: error.message,
+      };
+    }
+  }
+
   /**
    * Retrieve a specific document by ID
    */
-  async retrieveDoc(docId, user) {
+  async retrieveDoc(docId, user, options = {}) {
     try {
-      const body = { doc_id: docId };
+      // options: toc, section, offset, length
+      const body = { doc_id: docId, ...options };
       if (user) {
         body.user = user;
       }
@@ -252,7 +349,7 @@ Key points:
   /**
    * Process AI response and handle function calls
    */
-  async processAIResponse(chatHistory, model, user) {
+  async processAIResponse(chatHistory, model, user, onDelta, options = {}) {
     // Get custom system prompt or use default
     const customSystemPrompt = this.storageService.getSystemPrompt();
     const defaultSystemPrompt = this.getDefaultSystemPrompt();
@@ -318,7 +415,13 @@ Key points:
       }
     }
 
-    const aiResponse = await this.sendMessage(messages, model, user);
+    const aiResponse = await this.sendMessage(
+      messages,
+      model,
+      user,
+      onDelta,
+      options,
+    );
 
     return aiResponse;
   }
@@ -9,6 +9,10 @@ const DEFAULT_CONFIG = {
   defaultEnvironment: "local",
   models: [{ id: "gpt-oss", name: "gpt-oss" }],
   defaultModel: "gpt-oss",
+  // Dashboards aggregate on the server's DuckDB instead of DuckDB-WASM
+  serverAggregation: false,
+  // Most queries the server runs in one /trino/batch request
+  batchMaxQueries: 50,
 };
 
 let _config = { ...DEFAULT_CONFIG };
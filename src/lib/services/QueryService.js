@@ -81,6 +81,10 @@ export class QueryService {
         return {
           success: true,
           data: await response.arrayBuffer(),
+          cache: {
+            status: response.headers.get("X-Cache"),
+            age: Number(response.headers.get("X-Cache-Age") ?? 0),
+          },
         };
       } else {
         return await response.json();
@@ -93,4 +97,260 @@ export class QueryService {
       };
     }
   }
+
+  /**
+   * Execute several queries in one /trino/batch request. The server runs them
+   * concurrently and streams each result back as it completes; onResult is
+   * called once per query, in completion order, with
+   * { id, success, data?, error?, elapsed, cache }.
+   *
+   * Each frame is a 4 byte big-endian header length, the JSON header, then
+   * header.length bytes of Arrow IPC payload.
+   */
+  async executeBatch(
+    queries,
+    username,
+    password,
+    environment = "local",
+    extraCredentials = [],
+    onResult = () => {},
+  ) {
+    const response = await fetch(`${this.baseUrl}/trino/batch`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        queries: queries.map((q) => ({
+          id: q.id,
+          query: isSpecialCommand(q.query)
+            ? q.query
+            : rewriteQueryWithLimit(q.query, q.limit),
+        })),
+        user: username,
+        password: password,
+        environment: environment,
+        extraCredentials: extraCredentials,
+      }),
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(errorData.error ?? "Batch query failed");
+    }
+
+    const reader = response.body.getReader();
+    let buffer = new Uint8Array(0);
+    const decoder = new TextDecoder();
+
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (value) {
+        const joined = new Uint8Array(buffer.length + value.length);
+        joined.set(buffer);
+        joined.set(value, buffer.length);
+        buffer = joined;
+      }
+
+      // Hand out every complete frame received so far
+      for (;;) {
+        if (buffer.length < 4) break;
+        const headerLength = new DataView(
+          buffer.buffer,
+          buffer.byteOffset,
+        ).getUint32(0);
+        if (buffer.length < 4 + headerLength) break;
+        const header = JSON.parse(
+          decoder.decode(buffer.subarray(4, 4 + headerLength)),
+        );
+        const end = 4 + headerLength + header.length;
+        if (buffer.length < end) break;
+
+        const success = header.status === 200;
+        onResult({
+          id: header.id,
+          success,
+          data: success ? buffer.slice(4 + headerLength, end).buffer : undefined,
+          error: header.error,
+          elapsed: header.elapsed_ms,
+          cache: { status: header.cache, age: header.cache_age ?? 0 },
+        });
+        buffer = buffer.subarray(end);
+      }
+
+      if (done) break;
+    }
+
+    if (buffer.length > 0) {
+      throw new Error("Batch response ended in the middle of a result");
+    }
+  }
+
+  /**
+   * Run a query on the server (or take it from the result cache) and register
+   * the result as `table` of the server-side DuckDB session `session`, for
+   * Mosaic to aggregate there. Resolves with { success, table, rows, bytes,
+   * columns, cache } or { success: false, error }.
+   */
+  async loadExtract(
+    session,
+    table,
+    query,
+    limit,
+    username,
+    password,
+    environment = "local",
+    extraCredentials = [],
+  ) {
+    const response = await fetch(
+      `${this.baseUrl}/duckdb/${encodeURIComponent(session)}/tables`,
+      {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify({
+          table: table,
+          query: isSpecialCommand(query)
+            ? query
+            : rewriteQueryWithLimit(query, limit),
+          limit: limit,
+          user: username,
+          password: password,
+          environment: environment,
+          extraCredentials: extraCredentials,
+        }),
+      },
+    );
+    const data = await response.json();
+    return response.ok
+      ? { success: true, ...data, cache: { status: data.cache, age: 0 } }
+      : { success: false, error: data.error };
+  }
+
+  /**
+   * Drop a server-side DuckDB session of the user and its tables.
+   */
+  async closeExtractSession(session, username) {
+    await fetch(
+      `${this.baseUrl}/duckdb/${encodeURIComponent(session)}?user=${encodeURIComponent(username)}`,
+      {
+        method: "DELETE",
+      },
+    );
+  }
+
+  /**
+   * Catalog metadata from the server's metadata cache: the catalogs without
+   * catalog, the schemas of a catalog with their tables, the tables of a schema
+   * or the columns ({ name, type }) of a table. Resolves with { success, ...,
+   * age } or { success: false, status, error }.
+   */
+  async fetchMetadata(
+    username,
+    password,
+    environment = "local",
+    extraCredentials = [],
+    { catalog, schema, table, refresh = false } = {},
+  ) {
+    const response = await fetch(`${this.baseUrl}/trino/metadata`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        catalog: catalog,
+        schema: schema,
+        table: table,
+        refresh: refresh,
+        user: username,
+        password: password,
+        environment: environment,
+        extraCredentials: extraCredentials,
+      }),
+    });
+    const data = await response.json();
+    return response.ok
+      ? { success: true, ...data }
+      : { success: false, status: response.status, error: data.error };
+  }
+
+  /**
+   * Run a query into a server-side result handle instead of fetching it whole.
+   * Resolves as soon as the schema is known with { success, id, schema,
+   * batches, batch_rows, rows, done, truncated }; the server keeps fetching
+   * the rest, use fetchBatches to page through it.
+   */
+  async openResultHandle(
+    query,
+    username,
+    password,
+    environment = "local",
+    extraCredentials = [],
+  ) {
+    const response = await fetch(`${this.baseUrl}/trino`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        query: query,
+        mode: "handle",
+        user: username,
+        password: password,
+        environment: environment,
+        extraCredentials: extraCredentials,
+      }),
+    });
+    const data = await response.json();
+    return response.ok
+      ? { success: true, ...data }
+      : { success: false, error: data.error };
+  }
+
+  /**
+   * Current state of a result handle, as returned by openResultHandle.
+   */
+  async describeResultHandle(id, username) {
+    const response = await fetch(
+      `${this.baseUrl}/trino/${encodeURIComponent(id)}?user=${encodeURIComponent(username)}`,
+    );
+    const data = await response.json();
+    return response.ok
+      ? { success: true, ...data }
+      : { success: false, error: data.error };
+  }
+
+  /**
+   * Record batches [from, to) of a result handle as Arrow IPC, every batch
+   * from `from` on without `to`. Waits on the server for batches not fetched
+   * from Trino yet.
+   */
+  async fetchBatches(id, username, from = 0, to = undefined) {
+    const params = new URLSearchParams({ user: username, from: String(from) });
+    if (to !== undefined) params.set("to", String(to));
+    const response = await fetch(
+      `${this.baseUrl}/trino/${encodeURIComponent(id)}/batches?${params}`,
+    );
+    if (!response.ok) {
+      const errorData = await response.json();
+      return { success: false, error: errorData.error };
+    }
+    return {
+      success: true,
+      data: await response.arrayBuffer(),
+      batches: Number(response.headers.get("X-Batches") ?? 0),
+      done: response.headers.get("X-Handle-Done") === "true",
+    };
+  }
+
+  /**
+   * Cancel the query of a result handle if still running and drop its result.
+   */
+  async closeResultHandle(id, username) {
+    await fetch(
+      `${this.baseUrl}/trino/${encodeURIComponent(id)}?user=${encodeURIComponent(username)}`,
+      { method: "DELETE" },
+    );
+  }
 }
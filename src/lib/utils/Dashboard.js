@@ -5,9 +5,12 @@ import "golden-layout/dist/css/goldenlayout-base.css";
 import "golden-layout/dist/css/themes/goldenlayout-light-theme.css";
 import {
     createFetchFromTrino,
+    createLoadExtract,
     createLoadTrino,
     createPerspectivePanel,
+    serverConnector,
 } from "./dashboardRuntime.js";
+import { getConfig } from "../services/ConfigService.js";
 import { createGoldenBuilder } from "./goldenBuilder.js";
 import { runYamlDashboard } from "./dashboardYaml.js";
 
@@ -15,6 +18,10 @@ import { runYamlDashboard } from "./dashboardYaml.js";
  * Manages the full lifecycle of a dashboard execution: Mosaic coordinator,
  * DuckDB connector, GoldenLayout instance, and user snippet evaluation.
  *
+ * With `serverAggregation` in the backend config, loadTrino registers results
+ * in a DuckDB session on the server and Mosaic queries go there; only
+ * Perspective panels copy their table into DuckDB-WASM.
+ *
  * Usage:
  *   const db = new Dashboard({ queryService, username, password, selectedEnvironment, extraCredentials });
  *   await db.mount(element, code, { onQueryLog, layoutState, onLayoutStateChange });
@@ -24,6 +31,7 @@ import { runYamlDashboard } from "./dashboardYaml.js";
 export class Dashboard {
     #coordinator = null;
     #dbConnector = null;
+    #extractSession = null;
     #glInstance = null;
     #queryLog = [];
     #opts;
@@ -53,7 +61,15 @@ export class Dashboard {
 
         this.#coordinator = new Coordinator();
         this.#dbConnector = wasmConnector();
-        this.#coordinator.databaseConnector(this.#dbConnector);
+        let server = null;
+        if (getConfig().serverAggregation) {
+            this.#extractSession = crypto.randomUUID();
+            server = serverConnector(
+                `${this.#opts.queryService.baseUrl}/duckdb/${this.#extractSession}` +
+                    `?user=${encodeURIComponent(this.#opts.username)}`,
+            );
+        }
+        this.#coordinator.databaseConnector(server ?? this.#dbConnector);
         vg.coordinator(this.#coordinator);
 
         const logQueryStatus = (entry) => {
@@ -67,9 +83,19 @@ export class Dashboard {
             onQueryLog?.(this.#queryLog);
         };
 
-        const fetchFromTrino = createFetchFromTrino({ ...this.#opts, logQueryStatus });
-        const loadTrino = createLoadTrino(fetchFromTrino, this.#dbConnector);
-        const perspective = createPerspectivePanel(this.#dbConnector, this.#coordinator);
+        const fetchFromTrino = createFetchFromTrino({
+            ...this.#opts,
+            logQueryStatus,
+            batchMaxQueries: getConfig().batchMaxQueries,
+        });
+        const loadTrino = server
+            ? createLoadExtract({ ...this.#opts, logQueryStatus }, this.#extractSession)
+            : createLoadTrino(fetchFromTrino, this.#dbConnector);
+        const perspective = createPerspectivePanel(
+            this.#dbConnector,
+            this.#coordinator,
+            server ?? undefined,
+        );
         const golden = createGoldenBuilder(GoldenLayout);
 
         let result;
@@ -126,6 +152,12 @@ export class Dashboard {
             } catch (_) {}
             this.#coordinator = null;
         }
+        if (this.#extractSession) {
+            this.#opts.queryService
+                .closeExtractSession(this.#extractSession, this.#opts.username)
+                .catch(() => {});
+            this.#extractSession = null;
+        }
         this.#dbConnector = null;
     }
 }
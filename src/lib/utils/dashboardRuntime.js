@@ -13,6 +13,8 @@ import {
  *
  * `logQueryStatus` is called with the entry object on each state change
  * (initial "running", then "done" or "error"). The caller owns the log array.
+ * Concurrent calls are coalesced into /trino/batch requests of up to
+ * `batchMaxQueries` queries each, the most the server accepts in one.
  *
  * @param {{
  *   queryService: any,
@@ -20,7 +22,8 @@ import {
  *   password: string,
  *   selectedEnvironment: any,
  *   extraCredentials: any,
- *   logQueryStatus: (entry: { sql: string, status: string, elapsed: number }) => void,
+ *   batchMaxQueries?: number,
+ *   logQueryStatus: (entry: { sql: string, status: string, elapsed: number, cache?: { status: string, age: number } }) => void,
  * }} opts
  * @returns {(sql: string, limit?: number) => Promise<ArrayBuffer>}
  */
@@ -32,38 +35,89 @@ export function createFetchFromTrino(opts) {
     selectedEnvironment,
     extraCredentials,
     logQueryStatus,
+    batchMaxQueries = 50,
   } = opts;
 
-  return async function fetchFromTrino(sql, limit = 1000000) {
-    const entry = { sql, status: "running", elapsed: 0 };
-    logQueryStatus(entry);
-    const start = performance.now();
+  const finish = (call, result) => {
+    const elapsed = performance.now() - call.start;
+    const status = result.success ? "done" : "error";
+    logQueryStatus({ ...call.entry, status, elapsed, cache: result.cache });
+    if (result.success) call.resolve(result.data);
+    else call.reject(new Error(result.error ?? "Query failed"));
+  };
+
+  // Network-level failure, the service call itself threw
+  const fail = (call, err) => {
+    logQueryStatus({
+      ...call.entry,
+      status: "error",
+      elapsed: performance.now() - call.start,
+    });
+    call.reject(err);
+  };
+
+  const runSingle = async (call) => {
     try {
       const result = await queryService.executeQuery(
-        sql,
-        limit,
+        call.sql,
+        call.limit,
         username,
         password,
         selectedEnvironment,
         "arrow",
         extraCredentials,
       );
-      const elapsed = performance.now() - start;
-      const status = result.success ? "done" : "error";
-      logQueryStatus({ ...entry, status, elapsed });
-      if (!result.success) throw new Error(result.error ?? "Query failed");
-      return result.data;
+      finish(call, result);
+    } catch (err) {
+      fail(call, err);
+    }
+  };
+
+  const runBatch = async (calls) => {
+    const byId = new Map(calls.map((call, i) => [String(i), call]));
+    try {
+      await queryService.executeBatch(
+        [...byId].map(([id, call]) => ({ id, query: call.sql, limit: call.limit })),
+        username,
+        password,
+        selectedEnvironment,
+        extraCredentials,
+        (result) => {
+          const call = byId.get(result.id);
+          if (!call) return;
+          byId.delete(result.id);
+          finish(call, result);
+        },
+      );
+      if (byId.size > 0) throw new Error("Batch response is missing results");
     } catch (err) {
-      if (entry.status === "running") {
-        // Network-level failure — executeQuery itself threw
-        logQueryStatus({
-          ...entry,
-          status: "error",
-          elapsed: performance.now() - start,
+      for (const call of byId.values()) fail(call, err);
+    }
+  };
+
+  // Calls made in the same tick (e.g. Promise.all over several loadTrino calls)
+  // go out as /trino/batch requests, each resolving as its result streams in
+  let pending = [];
+
+  return function fetchFromTrino(sql, limit = 1000000) {
+    return new Promise((resolve, reject) => {
+      const entry = { sql, status: "running", elapsed: 0 };
+      logQueryStatus(entry);
+      pending.push({ sql, limit, entry, start: performance.now(), resolve, reject });
+      if (pending.length === 1) {
+        queueMicrotask(() => {
+          const calls = pending;
+          pending = [];
+          if (calls.length === 1) {
+            runSingle(calls[0]);
+            return;
+          }
+          for (let i = 0; i < calls.length; i += batchMaxQueries) {
+            runBatch(calls.slice(i, i + batchMaxQueries));
+          }
         });
       }
-      throw err;
-    }
+    });
   };
 }
 
@@ -84,6 +138,96 @@ export function createLoadTrino(fetchFromTrino, dbConnector) {
   };
 }
 
+/**
+ * A Mosaic database connector for a DuckDB session on the server
+ * (/duckdb/{session}), speaking the protocol of Mosaic's REST connector. Only
+ * query results, usually small aggregates, come back to the browser.
+ *
+ * @param {string} uri  — e.g. `${baseUrl}/duckdb/${session}?user=${username}`
+ */
+export function serverConnector(uri) {
+  return {
+    async query({ type = "arrow", sql }) {
+      const response = await fetch(uri, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify({ type, sql }),
+      });
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(
+          errorData.error ?? `Query failed with HTTP status ${response.status}`,
+        );
+      }
+      if (type === "exec") return undefined;
+      if (type === "json") return response.json();
+      return tableFromIPC(await response.arrayBuffer());
+    },
+  };
+}
+
+/**
+ * Creates a `loadTrino` helper that runs the query on the server and registers
+ * the result as a table of the server-side DuckDB session, without
+ * downloading it.
+ *
+ * @param {{
+ *   queryService: any,
+ *   username: string,
+ *   password: string,
+ *   selectedEnvironment: any,
+ *   extraCredentials: any,
+ *   logQueryStatus: (entry: any) => void,
+ * }} opts
+ * @param {string} session  — id of the server-side DuckDB session
+ * @returns {(tableName: string, sql: string, limit?: number) => Promise<void>}
+ */
+export function createLoadExtract(opts, session) {
+  const {
+    queryService,
+    username,
+    password,
+    selectedEnvironment,
+    extraCredentials,
+    logQueryStatus,
+  } = opts;
+
+  return async function loadTrino(tableName, sql, limit = 1000000) {
+    const entry = { sql, status: "running", elapsed: 0 };
+    const start = performance.now();
+    logQueryStatus(entry);
+    let result;
+    try {
+      result = await queryService.loadExtract(
+        session,
+        tableName,
+        sql,
+        limit,
+        username,
+        password,
+        selectedEnvironment,
+        extraCredentials,
+      );
+    } catch (err) {
+      logQueryStatus({
+        ...entry,
+        status: "error",
+        elapsed: performance.now() - start,
+      });
+      throw err;
+    }
+    logQueryStatus({
+      ...entry,
+      status: result.success ? "done" : "error",
+      elapsed: performance.now() - start,
+      cache: result.cache,
+    });
+    if (!result.success) throw new Error(result.error ?? "Query failed");
+  };
+}
+
 /**
  * Creates a `perspective(tableName, config?, opts?)` helper backed by the shared DuckDB instance.
  *
@@ -99,10 +243,32 @@ export function createLoadTrino(fetchFromTrino, dbConnector) {
  *
  * @param {any} dbConnector  — wasmConnector instance (shared with Mosaic coordinator)
  * @param {any} [coordinator] — Mosaic Coordinator instance; required when using filterBy
+ * @param {any} [sourceConnector] — connector the tables live in when they were
+ *   not loaded into dbConnector (server-side aggregation), each table is copied
+ *   over once before its first viewer opens
  * @returns {(tableName: string, config?: object, opts?: { filterBy?: any }) => Promise<HTMLElement>}
  */
-export function createPerspectivePanel(dbConnector, coordinator) {
+export function createPerspectivePanel(dbConnector, coordinator, sourceConnector) {
   let pspClientPromise = null;
+  const copied = new Map();
+
+  function copyTable(tableName) {
+    if (!copied.has(tableName)) {
+      copied.set(
+        tableName,
+        (async () => {
+          const table = await sourceConnector.query({
+            type: "arrow",
+            sql: `SELECT * FROM "${tableName}"`,
+          });
+          const conn = await dbConnector.getConnection();
+          await conn.query(`DROP TABLE IF EXISTS "${tableName}"`);
+          await conn.insertArrowTable(table, { name: tableName });
+        })(),
+      );
+    }
+    return copied.get(tableName);
+  }
 
   async function getPspClient() {
     if (!pspClientPromise) {
@@ -119,6 +285,7 @@ export function createPerspectivePanel(dbConnector, coordinator) {
     config = {},
     { filterBy, selectAs, selectColumns } = {},
   ) {
+    if (sourceConnector) await copyTable(tableName);
     const client = await getPspClient();
 
     const viewer = document.createElement("perspective-viewer");